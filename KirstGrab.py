@@ -1,22 +1,59 @@
+import time
+# Reference point of the start-up profile, taken before any other import
+STARTUP_STARTED = time.perf_counter()
+
 import os
 import sys
 import ctypes
 import threading
 import subprocess
-import tkinter as tk
-from tkinter import filedialog, messagebox, font as tkfont
+import argparse
+# Only the window needs Tk, --batch runs on machines without it
+try:
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, font as tkfont
+except ImportError:
+    tk = None
 import urllib.request
+import urllib.error
 import urllib.parse
 import json
 import tempfile
 import shutil
 import zipfile
+import queue
+import itertools
+import codecs
+import locale
+import re
+import collections
+import logging
+import logging.handlers
+import hashlib
+import sqlite3
+import uuid
+import socket
+import secrets
+import http.server
+import zlib
+import io
+import statistics
+import platform
+import concurrent.futures
+import traceback
 
-try:
-    from PIL import Image, ImageTk, ImageFont
-    PIL_AVAILABLE = True
-except ImportError:
-    PIL_AVAILABLE = False
+_pil_modules = None
+
+def load_pil():
+    """Import Pillow on first use, returns (Image, ImageFont) or None"""
+    global _pil_modules
+    if _pil_modules is None:
+        try:
+            from PIL import Image, ImageFont
+            _pil_modules = (Image, ImageFont)
+        except ImportError:
+            _pil_modules = False
+    return _pil_modules or None
 
 # Windows API constants for clipboard access
 if sys.platform.startswith("win"):
@@ -35,37 +72,142 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
+def app_data_dir(*parts):
+    """Per-user writable directory for KirstGrab state, created on demand"""
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".local", "share")
+    path = os.path.join(base, "KirstGrab", *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
 def ensure_cookies_file(path):
     if not os.path.exists(path):
         open(path, "w", encoding="utf-8").close()
 
-def clear_cookies_file():
-    """Clear the cookies.txt file on startup"""
-    cookies_path = resource_path("cookies.txt")
-    try:
-        with open(cookies_path, "w", encoding="utf-8") as f:
-            f.write("")  # Clear the file
-    except Exception as e:
-        print(f"Warning: Could not clear cookies file: {e}")
+# Sites whose short links need the cookies of another domain
+COOKIE_SITE_ALIASES = {"youtu.be": "youtube.com"}
+
+def cookie_site(host):
+    """Registrable part of a host name, e.g. www.youtube.com -> youtube.com"""
+    labels = host.lower().strip(".").split(".")
+    # Two letter country domains with a short second level, e.g. bbc.co.uk
+    if len(labels) > 2 and len(labels[-1]) == 2 and len(labels[-2]) <= 3:
+        site = ".".join(labels[-3:])
+    else:
+        site = ".".join(labels[-2:])
+    return COOKIE_SITE_ALIASES.get(site, site)
+
+class CookieStore:
+    """Netscape format cookies kept in one file and indexed by site.
+
+    The file is only parsed again when it changed, so pasting a browser
+    export with thousands of cookies costs one parse. job_file() writes
+    just the cookies of the job's site to a private temp file, which the
+    job's yt-dlp may also update without racing other jobs.
+    """
+
+    HEADER = "# Netscape HTTP Cookie File\n"
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._index = {}
+
+    @staticmethod
+    def parse(text):
+        """({site: [cookie lines]}, number of invalid lines), expired cookies are dropped"""
+        index = {}
+        skipped = 0
+        now = time.time()
+        for line in text.splitlines():
+            line = line.strip("\r\n")
+            if not line.strip() or (line.startswith("#") and not line.startswith("#HttpOnly_")):
+                continue
+            fields = line.split("\t")
+            domain = fields[0][len("#HttpOnly_"):] if fields[0].startswith("#HttpOnly_") else fields[0]
+            try:
+                valid = (len(fields) == 7 and domain and fields[1] in ("TRUE", "FALSE")
+                         and fields[3] in ("TRUE", "FALSE") and int(fields[4]) >= 0)
+            except ValueError:
+                valid = False
+            if not valid:
+                skipped += 1
+                continue
+            if 0 < int(fields[4]) < now:
+                continue
+            index.setdefault(cookie_site(domain), []).append(line)
+        return index, skipped
+
+    def _load(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            self._signature = None
+            self._index = {}
+            return
+        signature = (st.st_size, st.st_mtime_ns)
+        if signature != self._signature:
+            with open(self.path, "r", encoding="utf-8", errors="replace") as f:
+                self._index = self.parse(f.read())[0]
+            self._signature = signature
+
+    def import_text(self, text):
+        """Merge pasted cookies, a site's old cookies are replaced. Returns (cookies, sites, invalid lines)"""
+        index, skipped = self.parse(text)
+        if not index:
+            return 0, 0, skipped
+        with self._lock:
+            self._load()
+            self._index.update(index)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(self.HEADER)
+                for lines in self._index.values():
+                    f.write("\n".join(lines) + "\n")
+            if not sys.platform.startswith("win"):
+                os.chmod(temp_path, 0o600)
+            os.replace(temp_path, self.path)
+        return sum(len(lines) for lines in index.values()), len(index), skipped
+
+    def cookies_for(self, url):
+        host = urllib.parse.urlsplit(url).hostname
+        if not host:
+            return []
+        with self._lock:
+            self._load()
+            return list(self._index.get(cookie_site(host), []))
+
+    def covers(self, url):
+        return bool(self.cookies_for(url))
+
+    def job_file(self, url, job_id):
+        """Private cookie file with only the cookies for url, None when there are none"""
+        lines = self.cookies_for(url)
+        if not lines:
+            return None
+        fd, path = tempfile.mkstemp(prefix=f"kirstgrab_cookies_job{job_id}_", suffix=".txt")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(self.HEADER + "\n".join(lines) + "\n")
+        return path
+
+cookie_store = CookieStore(os.path.join(app_data_dir(), "cookies.txt"))
 
 def edit_cookies_file():
-    """Open cookies.txt file in notepad for editing"""
-    cookies_path = resource_path("cookies.txt")
-    ensure_cookies_file(cookies_path)
-    
-    try:
+    """Open the cookie store in notepad for editing, without waiting for the editor"""
+    def open_editor(cookies_path):
+        ensure_cookies_file(cookies_path)
         if sys.platform.startswith("win"):
-            os.system(f'notepad.exe "{cookies_path}"')
+            subprocess.Popen(["notepad.exe", cookies_path])
         elif sys.platform.startswith("darwin"):  # macOS
-            os.system(f'open -e "{cookies_path}"')
+            subprocess.Popen(["open", "-e", cookies_path])
         else:  # Linux
-            os.system(f'xdg-open "{cookies_path}"')
-    except Exception as e:
-        messagebox.showerror("Error", f"Could not open cookies file: {e}")
+            subprocess.Popen(["xdg-open", cookies_path])
+
+    run_in_background(open_editor, cookie_store.path,
+                      on_error=lambda e: messagebox.showerror("Error", f"Could not open cookies file: {e}"))
 
 def paste_cookies():
-    """Paste clipboard content to cookies.txt file"""
-    cookies_path = resource_path("cookies.txt")
+    """Import Netscape cookies from the clipboard into the cookie store"""
     clipboard_content = None
     
     # Try Windows API first (more reliable)
@@ -87,13 +229,20 @@ def paste_cookies():
         except tk.TclError:
             pass
     
+    def show_imported(result):
+        cookies, sites, skipped = result
+        if not cookies:
+            messagebox.showerror("Error", "No valid cookies found! Paste a cookies.txt export (Netscape format).")
+            return
+        message = f"Imported {cookies} cookies for {sites} site(s)."
+        if skipped:
+            message += f"\nSkipped {skipped} invalid line(s)."
+        messagebox.showinfo("Success", message)
+
     if clipboard_content:
-        try:
-            with open(cookies_path, "w", encoding="utf-8") as f:
-                f.write(clipboard_content)
-            messagebox.showinfo("Success", "Cookies pasted successfully!")
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not write cookies file: {e}")
+        # Parsing and rewriting the store happens off the Tk thread
+        run_in_background(cookie_store.import_text, clipboard_content, on_done=show_imported,
+                          on_error=lambda e: messagebox.showerror("Error", f"Could not write cookies file: {e}"))
     else:
         messagebox.showwarning("Warning", "No content found in clipboard!")
 
@@ -101,26 +250,147 @@ def paste_cookies():
 # Current version - update this when releasing new versions
 CURRENT_VERSION = "1.3.14"
 GITHUB_REPO = "Polykek2K/KirstGrab"
+# Overridable so release checks can be pointed at a local stand-in
+GITHUB_API = os.environ.get("KIRSTGRAB_GITHUB_API", "https://api.github.com")
+
+# Release checks are answered from release.json while it is fresh: the
+# manual button accepts an answer up to 5 minutes old, the start-up check
+# one up to 6 hours old
+RELEASE_CHECK_INTERVAL = 6 * 60 * 60
+RELEASE_MANUAL_INTERVAL = 5 * 60
+RELEASE_BACKOFF_BASE = 60
+RELEASE_BACKOFF_MAX = 12 * 60 * 60
 
 # Proxy configuration
 DEFAULT_PROXY = "socks5://93.100.160.168:1080"
 
-def get_latest_release_info():
-    """Get latest release information from GitHub API"""
+# User settings stored as settings.json in the app data directory
+SETTINGS_DEFAULTS = {
+    # Downloader backend per site, e.g. {"example.com": "aria2c"}
+    "site_downloaders": {},
+    "aria2c_connections": 16,
+    "concurrent_fragments": 8,
+    # Total download budget shared by all jobs and cap per job, "0" is unlimited
+    "bandwidth_limit": "0",
+    "job_rate_limit": "0",
+    # Time-of-day budgets, e.g. [{"from": "09:00", "to": "18:00", "limit": "2M"}]
+    "bandwidth_schedule": [],
+    # "auto" runs yt-dlp in persistent engine workers when the yt_dlp module
+    # is bundled, "subprocess" always spawns yt-dlp.exe per download
+    "engine": "auto",
+    # Localhost job API for browser extensions and scripts, see JobServer
+    "api_server": False,
+    "api_port": 9746,
+    # Destination of API jobs that do not name one, empty is ~/Downloads
+    "api_download_dir": "",
+    # Proxy pool used by "Use Proxy", empty is DEFAULT_PROXY alone
+    "proxies": [],
+    "proxy_max_jobs": 4,
+    "proxy_check_interval": 300,
+    # Prometheus text endpoint on 127.0.0.1, 0 is off
+    "metrics_port": 0,
+    # Extract the metadata of a URL as soon as it is pasted, see MetadataPrefetcher
+    "prefetch_metadata": True,
+}
+
+def load_settings():
+    """Read settings.json merged over SETTINGS_DEFAULTS"""
+    settings = json.loads(json.dumps(SETTINGS_DEFAULTS))
     try:
-        url = f"https://api.github.com/repos/{GITHUB_REPO}/releases/latest"
-        with urllib.request.urlopen(url, timeout=10) as response:
-            data = json.loads(response.read().decode())
-            return {
-                'tag_name': data.get('tag_name', ''),
-                'name': data.get('name', ''),
-                'body': data.get('body', ''),
-                'html_url': data.get('html_url', ''),
-                'assets': data.get('assets', [])
-            }
-    except Exception as e:
-        print(f"Error checking for updates: {e}")
-        return None
+        with open(os.path.join(app_data_dir(), "settings.json"), "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        if isinstance(stored, dict):
+            settings.update(stored)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not read settings: {e}")
+    return settings
+
+settings = load_settings()
+
+class ReleaseInfoCache:
+    """Last answer of the GitHub releases API with its ETag.
+
+    Requests within max_age are served from disk, later ones are
+    conditional so an unchanged release costs a 304 that does not count
+    against the rate limit. Failures back off exponentially, a rate limit
+    response waits until the reset time GitHub reports.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+
+    def get(self, url, max_age=RELEASE_CHECK_INTERVAL, now=None):
+        with self._lock:
+            now = time.time() if now is None else now
+            info = self.state.get("info")
+            if info and now - self.state.get("checked_at", 0) < max_age:
+                return info
+            if now < self.state.get("retry_at", 0):
+                return info
+            headers = {"Accept": "application/vnd.github+json"}
+            if info and self.state.get("etag"):
+                headers["If-None-Match"] = self.state["etag"]
+            try:
+                with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=10) as response:
+                    data = json.loads(response.read().decode())
+                info = {
+                    'tag_name': data.get('tag_name', ''),
+                    'name': data.get('name', ''),
+                    'body': data.get('body', ''),
+                    'html_url': data.get('html_url', ''),
+                    'assets': data.get('assets', [])
+                }
+                self.state.update(info=info, etag=response.headers.get("ETag"))
+            except urllib.error.HTTPError as e:
+                if e.code != 304:
+                    self._failed(now, e, e.headers)
+                    return info
+            except (OSError, ValueError) as e:
+                self._failed(now, e)
+                return info
+            self.state.update(checked_at=now, failures=0, retry_at=0)
+            self._save()
+            return info
+
+    def _failed(self, now, error, headers=None):
+        print(f"Error checking for updates: {error}")
+        failures = self.state.get("failures", 0) + 1
+        retry_at = now + min(RELEASE_BACKOFF_MAX, RELEASE_BACKOFF_BASE * 2 ** (failures - 1))
+        if headers is not None:
+            try:
+                if headers.get("Retry-After"):
+                    retry_at = max(retry_at, now + int(headers["Retry-After"]))
+                elif headers.get("X-RateLimit-Remaining") == "0" and headers.get("X-RateLimit-Reset"):
+                    retry_at = max(retry_at, int(headers["X-RateLimit-Reset"]))
+            except ValueError:
+                pass
+            # A bogus or far future reset time must not stop checks for good
+            retry_at = min(retry_at, now + RELEASE_BACKOFF_MAX)
+        self.state.update(failures=failures, retry_at=retry_at)
+        self._save()
+
+    def _save(self):
+        try:
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self.state, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Warning: Could not save release info: {e}")
+
+release_info_cache = ReleaseInfoCache(os.path.join(app_data_dir("cache"), "release.json"))
+
+def get_latest_release_info(max_age=RELEASE_CHECK_INTERVAL):
+    """Get latest release information from GitHub API, None when unknown"""
+    return release_info_cache.get(f"{GITHUB_API}/repos/{GITHUB_REPO}/releases/latest", max_age)
 
 def compare_versions(current, latest):
     """Compare version strings (simple numeric comparison)"""
@@ -149,362 +419,3902 @@ def compare_versions(current, latest):
     except Exception:
         return False
 
-def download_file(url, filepath, progress_callback=None):
-    """Download a file with progress callback"""
+# Release asset with the size and SHA-256 of every file of an update
+UPDATE_MANIFEST_ASSET = "manifest.json"
+UPDATE_CHUNK_SIZE = 256 * 1024
+UPDATE_RETRIES = 5
+
+def download_file(url, filepath, progress_callback=None, sha256=None):
+    """Download a file in chunks, resuming an interrupted download.
+
+    Data goes to filepath.part, which an HTTP Range request continues on the
+    next attempt or run. progress_callback gets (received, total) bytes and
+    sha256, when given, must match before the file is moved into place.
+    """
+    part_path = filepath + ".part"
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    if sha256 and os.path.exists(filepath) and file_sha256(filepath) == sha256:
+        return True
+    error = None
+    for attempt in range(UPDATE_RETRIES):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        request = urllib.request.Request(url, headers={"Range": f"bytes={offset}-"} if offset else {})
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                if offset and response.status != 206:
+                    # The server ignored the range, start over
+                    offset = 0
+                total = offset + int(response.headers.get("Content-Length") or 0)
+                with open(part_path, "ab" if offset else "wb") as f:
+                    received = offset
+                    for chunk in iter(lambda: response.read(UPDATE_CHUNK_SIZE), b""):
+                        f.write(chunk)
+                        received += len(chunk)
+                        if progress_callback:
+                            progress_callback(received, total)
+                if received < total:
+                    raise ConnectionError(f"connection closed at {received} of {total} bytes")
+            error = None
+            break
+        except urllib.error.HTTPError as e:
+            if e.code == 416:
+                # Range starts at the end, the .part file is complete
+                error = None
+                break
+            error = e
+            if 400 <= e.code < 500:
+                break
+        except (urllib.error.URLError, OSError) as e:
+            error = e
+        time.sleep(min(30, 2 ** attempt))
+    if error:
+        print(f"Error downloading file: {error}")
+        return False
+    if sha256 and file_sha256(part_path) != sha256:
+        print(f"Error downloading file: checksum mismatch for {os.path.basename(filepath)}")
+        os.remove(part_path)
+        return False
+    os.replace(part_path, filepath)
+    return True
+
+def release_asset(latest_info, name):
+    for asset in latest_info.get('assets', []):
+        if asset.get('name') == name:
+            return asset
+    return None
+
+def fetch_update_manifest(latest_info):
+    """Update manifest of the release, None for releases that do not publish one"""
+    asset = release_asset(latest_info, UPDATE_MANIFEST_ASSET)
+    if not asset:
+        return None
+    try:
+        with urllib.request.urlopen(asset['browser_download_url'], timeout=30) as response:
+            manifest = json.loads(response.read().decode("utf-8"))
+        return manifest if isinstance(manifest, dict) and manifest.get("app") else None
+    except (OSError, ValueError) as e:
+        print(f"Could not read update manifest: {e}")
+        return None
+
+def plan_update(manifest, installed_dir):
+    """Split the manifest binaries into local files to reuse and names to download"""
+    reuse, fetch = {}, []
+    for name, entry in manifest.get("binaries", {}).items():
+        local = os.path.join(installed_dir, name) if installed_dir else None
+        if (local and os.path.exists(local) and os.path.getsize(local) == entry.get("size")
+                and file_sha256(local) == entry.get("sha256")):
+            reuse[name] = local
+        else:
+            fetch.append(name)
+    return reuse, fetch
+
+def replace_executable(new_exe, current_exe):
+    """Swap new_exe in, a running exe can be renamed on Windows but not overwritten"""
+    staged = current_exe + ".new"
+    old = current_exe + ".old"
+    shutil.copy2(new_exe, staged)
+    if os.path.exists(old):
+        os.remove(old)
+    os.replace(current_exe, old)
+    try:
+        os.replace(staged, current_exe)
+    except OSError:
+        os.replace(old, current_exe)
+        raise
+
+def remove_replaced_executable():
+    """Delete the exe left behind by the last update"""
+    if getattr(sys, 'frozen', False):
+        try:
+            os.remove(sys.executable + ".old")
+        except OSError:
+            pass
+
+def show_update_dialog(latest_info):
+    """Show update dialog with latest version information"""
+    dialog = tk.Toplevel(root)
+    dialog.title("Update Available")
+    dialog.geometry("450x350")
+    dialog.resizable(False, False)
+    dialog.configure(bg="#2c3e50")
+    
+    # Center the dialog
+    dialog.transient(root)
+    dialog.grab_set()
+    
+    # Make dialog modal
+    dialog.focus_set()
+    
+    # Update info
+    latest_version = latest_info.get('tag_name', 'Unknown')
+    release_name = latest_info.get('name', 'Latest Release')
+    release_notes = latest_info.get('body', 'No release notes available.')
+    
+    # Title
+    title_label = tk.Label(dialog, text=f"🔄 Update Available!", 
+                          font=("Arial", 16, "bold"), 
+                          fg="#3498db", bg="#2c3e50")
+    title_label.pack(pady=20)
+    
+    # Version info
+    version_frame = tk.Frame(dialog, bg="#2c3e50")
+    version_frame.pack(pady=10)
+    
+    tk.Label(version_frame, text=f"Current Version: {CURRENT_VERSION}", 
+             font=("Arial", 12), fg="white", bg="#2c3e50").pack()
+    tk.Label(version_frame, text=f"Latest Version: {latest_version}", 
+             font=("Arial", 12, "bold"), fg="#2ecc71", bg="#2c3e50").pack()
+    
+    # Simple update message
+    message_label = tk.Label(dialog, text="A new version is available for download!", 
+                           font=("Arial", 12), fg="#ecf0f1", bg="#2c3e50")
+    message_label.pack(pady=20)
+    
+    # Progress bar (initially visible)
+    progress_frame = tk.Frame(dialog, bg="#2c3e50")
+    progress_frame.pack(pady=10)
+    
+    progress_label = tk.Label(progress_frame, text="", 
+                             font=("Arial", 10), fg="#f39c12", bg="#2c3e50")
+    progress_label.pack()
+    
+    progress_bar = tk.Frame(progress_frame, bg="#e74c3c", height=20, width=300)
+    progress_bar.pack(pady=5)
+    
+    # Buttons
+    button_frame = tk.Frame(dialog, bg="#2c3e50")
+    button_frame.pack(pady=20)
+    
+    update_button = tk.Button(button_frame, text="🔄 Update Now", 
+                             font=("Arial", 12, "bold"), 
+                             bg="#e74c3c", fg="white",
+                             activebackground="#c0392b",
+                             bd=0, padx=25, pady=12,
+                             width=12,
+                             command=lambda: start_update(dialog, latest_info, progress_label, progress_bar, progress_frame))
+    update_button.pack(side="left", padx=8)
+    
+    later_button = tk.Button(button_frame, text="⏰ Later", 
+                            font=("Arial", 12), 
+                            bg="#95a5a6", fg="white",
+                            activebackground="#7f8c8d",
+                            bd=0, padx=25, pady=12,
+                            width=8,
+                            command=dialog.destroy)
+    later_button.pack(side="left", padx=8)
+    
+    skip_button = tk.Button(button_frame, text="❌ Skip", 
+                           font=("Arial", 12), 
+                           bg="#95a5a6", fg="white",
+                           activebackground="#7f8c8d",
+                           bd=0, padx=25, pady=12,
+                           width=8,
+                           command=dialog.destroy)
+    skip_button.pack(side="left", padx=8)
+
+def start_update(dialog, latest_info, progress_label, progress_bar, progress_frame):
+    """Start the update process"""
+    def update_progress(received, total):
+        percent = min(100, received * 100 / total) if total else 0
+        progress_label.config(text=f"Downloading update... {percent:.1f}% "
+                                   f"({format_bytes(received)} of {format_bytes(total)})")
+        # Update progress bar width
+        progress_width = int(300 * (percent / 100))
+        progress_bar.config(width=progress_width)
+
+    def set_status(text):
+        call_in_ui(lambda: progress_label.config(text=text))
+
+    def show_error(title, text):
+        call_in_ui(messagebox.showerror, title, text)
+
+    def download_delta(manifest):
+        """Fetch the app and the binaries that changed, returns the new exe path"""
+        version = manifest.get("version", "").lstrip("v")
+        app = manifest.get("app") or {}
+        reuse, fetch = plan_update(manifest, binary_cache.ensure())
+        sources = {}
+        for name, entry in manifest["binaries"].items():
+            asset = release_asset(latest_info, name)
+            if asset:
+                sources[name] = {"url": asset['browser_download_url'], "sha256": entry.get("sha256")}
+        staging = app_data_dir("updates", version)
+        files = [(app.get("name"), app)] + [(name, manifest["binaries"][name]) for name in fetch]
+        total = sum(entry.get("size", 0) for _, entry in files)
+        done = 0
+        downloaded = {}
+        for name, entry in files:
+            asset = release_asset(latest_info, name)
+            if not asset:
+                raise ValueError(f"Release does not include {name}")
+            set_status(f"Downloading {name}...")
+            path = os.path.join(staging, name)
+            ok = download_file(asset['browser_download_url'], path,
+                               lambda received, _, base=done: call_in_ui(update_progress, base + received, total),
+                               sha256=entry.get("sha256"))
+            if not ok:
+                raise ValueError(f"Failed to download {name}")
+            downloaded[name] = path
+            done += entry.get("size", 0)
+        print(f"Update: reused {len(reuse)} unchanged files, downloaded {len(downloaded)}")
+        new_exe = downloaded.pop(app.get("name"))
+        binary_cache.install(version, {**reuse, **downloaded}, sources)
+        return new_exe, staging
+
+    def download_full():
+        """Older releases only publish the zip, fetch and unpack it whole.
+
+        Returns the new exe, the staging directory and the package's bin.zip,
+        which only replaces the current one once the exe was swapped.
+        """
+        zip_asset = None
+        for asset in latest_info.get('assets', []):
+            if asset['name'].endswith('.zip') and 'release' in asset['name']:
+                zip_asset = asset
+                break
+        if not zip_asset:
+            raise ValueError("Could not find release package in assets!")
+
+        staging = app_data_dir("updates", latest_info.get('tag_name', 'latest').lstrip("v"))
+        temp_zip = os.path.join(staging, zip_asset['name'])
+        set_status("Downloading update...")
+        if not download_file(zip_asset['browser_download_url'], temp_zip,
+                             lambda received, total: call_in_ui(update_progress, received, total)):
+            raise ValueError("Failed to download update!")
+
+        set_status("Extracting update...")
+        extract_dir = os.path.join(staging, "extract")
+        with zipfile.ZipFile(temp_zip, 'r') as zip_ref:
+            zip_ref.extractall(extract_dir)
+        archive = None
+        for root_dir, dirs, files in os.walk(extract_dir):
+            if BUNDLED_BINARIES_ARCHIVE in files:
+                archive = os.path.join(root_dir, BUNDLED_BINARIES_ARCHIVE)
+        for root_dir, dirs, files in os.walk(extract_dir):
+            for file in files:
+                if file.endswith('.exe') and 'KirstGrab' in file:
+                    return os.path.join(root_dir, file), staging, archive
+        raise ValueError("Could not find executable in release package!")
+
+    def download_and_replace():
+        staging = None
+        try:
+            manifest = fetch_update_manifest(latest_info)
+            version = latest_info.get('tag_name', '').lstrip("v")
+            if manifest and manifest.get("version", "").lstrip("v") != version:
+                # The new exe looks its binaries up under its own version, the
+                # release tag; installed under another one they'd never be found
+                print(f"Update manifest is for {manifest.get('version')}, not {version}, "
+                      f"downloading the full package")
+                manifest = None
+            archive = None
+            if manifest:
+                new_exe, staging = download_delta(manifest)
+            else:
+                new_exe, staging, archive = download_full()
+
+            set_status("Installing update...")
+
+            # Get current executable path
+            if getattr(sys, 'frozen', False):
+                # Running as compiled executable
+                current_exe = sys.executable
+            else:
+                # Running as script
+                current_exe = os.path.abspath(__file__)
+            replace_executable(new_exe, current_exe)
+            if archive:
+                # The new exe unpacks it from next to itself on its first start;
+                # the old exe must never see the new binaries, so it comes back
+                # when bin.zip can't be moved
+                try:
+                    os.replace(archive, bundled_archive_path())
+                except OSError:
+                    os.replace(current_exe + ".old", current_exe)
+                    raise
+            shutil.rmtree(staging, ignore_errors=True)
+            call_in_ui(finish_update, current_exe)
+        except PermissionError:
+            show_error("Update Error",
+                       "Permission denied! Please run the application as administrator to update.")
+            set_status("Update failed!")
+        except Exception as e:
+            # Partial downloads stay in the updates directory and are resumed
+            show_error("Update Error", f"Failed to update: {str(e)}")
+            set_status("Update failed!")
+
+    def finish_update(current_exe):
+        progress_label.config(text="Update completed! Restarting application...")
+        # Show restart message
+        messagebox.showinfo("Update Complete",
+                            "Update completed successfully!\nThe application will now restart.")
+        # Stop downloads, the journal resumes them after the restart
+        download_queue.shutdown()
+        if not getattr(sys, 'frozen', False):
+            # For script
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+        elif sys.platform.startswith("win"):
+            subprocess.Popen([current_exe] + sys.argv[1:], close_fds=True)
+            root.destroy()
+        else:
+            # For compiled executable
+            os.execv(current_exe, [current_exe] + sys.argv[1:])
+
+    # Start download in the background
+    run_in_background(download_and_replace)
+
+def check_for_updates():
+    """Check for updates on startup"""
+    def on_checked(latest_info):
+        if latest_info and compare_versions(CURRENT_VERSION, latest_info.get('tag_name', '')):
+            show_update_dialog(latest_info)
+
+    run_in_background(get_latest_release_info, on_done=on_checked,
+                      on_error=lambda e: print(f"Update check failed: {e}"))
+
+# Bundled executables and DLLs, packed into one archive by the release build
+BUNDLED_BINARIES_ARCHIVE = "bin.zip"
+
+def bundled_archive_path():
+    """bin.zip ships next to the exe, not inside it, so the onefile
+    bootloader does not extract it to a temp directory on every launch"""
+    if getattr(sys, 'frozen', False):
+        return os.path.join(os.path.dirname(sys.executable), BUNDLED_BINARIES_ARCHIVE)
+    return resource_path(BUNDLED_BINARIES_ARCHIVE)
+
+class BinaryCache:
+    """Bundled binaries unpacked once per build into a persistent directory.
+
+    The cache directory is named after the build version and a digest of
+    the archive contents, so an unchanged build reuses it on every launch
+    and an update unpacks next to the old one. Later starts only compare
+    size and mtime with the manifest, a mismatch re-checks the CRC.
+    """
+
+    def __init__(self, cache_root, version):
+        self.cache_root = cache_root
+        self.version = version
+        self.dir = None
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def path(self, name):
+        """Path of a bundled binary, None when the build does not include it"""
+        directory = self.ensure()
+        if directory:
+            p = os.path.join(directory, name)
+            if os.path.exists(p):
+                return p
+        # Source runs and older builds keep the binaries unpacked in bin
+        p = resource_path(os.path.join("bin", name))
+        return p if os.path.exists(p) else None
+
+    def ensure(self):
+        with self._lock:
+            if not self._ready:
+                self._ready = True
+                archive = bundled_archive_path()
+                if self._verify_installed(self.installed_dir(self.version)):
+                    # Placed by a delta update, a bin.zip next to the exe is
+                    # then still the one of the previous version
+                    self.dir = self.installed_dir(self.version)
+                    self._prune(self.dir)
+                    return self.dir
+                if os.path.exists(archive):
+                    try:
+                        self.dir = self._prepare(archive)
+                    except (OSError, zipfile.BadZipFile) as e:
+                        print(f"Warning: Could not unpack bundled binaries: {e}")
+                if os.path.exists(self.sources_file(self.version)):
+                    # Downloading takes a while, or forever when offline, the
+                    # callers go on with bin.zip until the repair is done
+                    threading.Thread(target=self._repair_installed, args=(self.version,), daemon=True).start()
+            return self.dir
+
+    def installed_dir(self, version):
+        return os.path.join(self.cache_root, f"{version}-update")
+
+    def sources_file(self, version):
+        """Download URLs and checksums of the binaries a delta update installed"""
+        return self.installed_dir(version) + ".json"
+
+    def install(self, version, files, sources=None):
+        """Place files (name -> path) as the binaries of version, hard linked when possible.
+
+        sources (name -> {"url", "sha256"}) is kept so binaries that later
+        go missing or get corrupted can be downloaded again.
+        """
+        if sources:
+            with open(self.sources_file(version), "w", encoding="utf-8") as f:
+                json.dump(sources, f)
+        staging = tempfile.mkdtemp(prefix=".unpack-", dir=self.cache_root)
+        try:
+            manifest = {}
+            for name, source in files.items():
+                p = os.path.join(staging, name)
+                try:
+                    os.link(source, p)
+                except OSError:
+                    shutil.copy2(source, p)
+                st = os.stat(p)
+                manifest[name] = [st.st_size, int(st.st_mtime)]
+            self._swap_in(staging, self.installed_dir(version), manifest)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def _repair_installed(self, version):
+        """Download the binaries of a delta update again and switch to them"""
+        try:
+            with open(self.sources_file(version), "r", encoding="utf-8") as f:
+                sources = json.load(f)
+        except (OSError, ValueError):
+            return False
+        print("Warning: Updated binaries are missing or damaged, downloading them again")
+        staging = tempfile.mkdtemp(prefix=".unpack-", dir=self.cache_root)
+        try:
+            files = {}
+            for name, source in sources.items():
+                path = os.path.join(staging, name)
+                if not download_file(source["url"], path, sha256=source.get("sha256")):
+                    return
+                files[name] = path
+            self.install(version, files)
+            with self._lock:
+                self.dir = self.installed_dir(version)
+        except (OSError, KeyError, TypeError) as e:
+            print(f"Warning: Could not download the binaries again: {e}")
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def _verify_installed(self, target):
+        try:
+            with open(os.path.join(target, "manifest.json"), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            return all([os.path.getsize(p), int(os.path.getmtime(p))] == entry
+                       for p, entry in ((os.path.join(target, name), entry)
+                                        for name, entry in manifest.items()))
+        except (OSError, ValueError, TypeError):
+            return False
+
+    def _prepare(self, archive):
+        with zipfile.ZipFile(archive) as zf:
+            members = [info for info in zf.infolist() if not info.is_dir()]
+            # The central directory already carries a CRC of every file
+            digest = hashlib.sha256(json.dumps(
+                sorted((m.filename, m.file_size, m.CRC) for m in members)).encode("utf-8")).hexdigest()
+            target = os.path.join(self.cache_root, f"{self.version}-{digest[:16]}")
+            if not self._verify(target, zf, members):
+                self._unpack(target, zf, members)
+        self._prune(target)
+        return target
+
+    def _verify(self, target, zf, members):
+        try:
+            with open(os.path.join(target, "manifest.json"), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+        for member in members:
+            p = os.path.join(target, member.filename)
+            try:
+                st = os.stat(p)
+            except OSError:
+                return False
+            if manifest.get(member.filename) == [st.st_size, int(st.st_mtime)]:
+                continue
+            if st.st_size != member.file_size or self._crc(p) != member.CRC:
+                return False
+        return True
+
+    @staticmethod
+    def _crc(path):
+        crc = 0
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                crc = zlib.crc32(chunk, crc)
+        return crc
+
+    def _unpack(self, target, zf, members):
+        # Unpack next to the target and swap it in, a half written
+        # directory is never picked up by another instance
+        staging = tempfile.mkdtemp(prefix=".unpack-", dir=self.cache_root)
+        try:
+            manifest = {}
+            for member in members:
+                p = zf.extract(member, staging)
+                st = os.stat(p)
+                manifest[member.filename] = [st.st_size, int(st.st_mtime)]
+            try:
+                self._swap_in(staging, target, manifest)
+            except OSError:
+                # Another instance finished first
+                if not self._verify(target, zf, members):
+                    raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    @staticmethod
+    def _swap_in(staging, target, manifest):
+        # The manifest is written last, it marks the directory complete
+        with open(os.path.join(staging, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(staging, target)
+
+    def _prune(self, keep):
+        """Remove caches of other builds, files still in use stay until the next launch"""
+        for name in os.listdir(self.cache_root):
+            p = os.path.join(self.cache_root, name)
+            if not os.path.isdir(p):
+                if name.endswith("-update.json") and p != self.sources_file(self.version):
+                    try:
+                        os.remove(p)
+                    except OSError:
+                        pass
+                continue
+            if p == keep:
+                continue
+            # Leave the unpacking directory of another instance alone
+            if name.startswith(".unpack-") and time.time() - os.path.getmtime(p) < 3600:
+                continue
+            shutil.rmtree(p, ignore_errors=True)
+
+binary_cache = BinaryCache(app_data_dir("bin"), CURRENT_VERSION)
+
+def find_embedded_exe(name):
+    # Builds without bin.zip (Linux, development) use the tools on PATH
+    return binary_cache.path(name) or shutil.which(os.path.splitext(name)[0]) or name
+
+# Extracted metadata cache, format URLs in it expire so entries are short lived
+INFO_CACHE_TTL = 30 * 60
+INFO_CACHE_MAX_ENTRIES = 500
+INFO_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# Query parameters that never change what a URL points to
+TRACKING_PARAMS = ("utm_source", "utm_medium", "utm_campaign", "utm_term", "utm_content",
+                   "si", "feature", "fbclid", "gclid")
+
+def normalize_url(url):
+    """Canonical form of a URL used as cache and index key"""
+    parts = urllib.parse.urlsplit(url.strip())
+    query = [(k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+             if k not in TRACKING_PARAMS]
+    netloc = parts.netloc.lower()
+    if netloc.startswith("www."):
+        netloc = netloc[4:]
+    return urllib.parse.urlunsplit((parts.scheme.lower() or "https", netloc, parts.path.rstrip("/"),
+                                    urllib.parse.urlencode(sorted(query)), ""))
+
+class InfoCache:
+    """On-disk cache of yt-dlp info JSON keyed by normalized URL.
+
+    Freshness is judged by the file mtime (time of extraction) and eviction is
+    least recently used by atime, which lookup() sets explicitly so it works
+    on volumes mounted with noatime too.
+    """
+
+    def __init__(self, directory, ttl=INFO_CACHE_TTL, max_entries=INFO_CACHE_MAX_ENTRIES,
+                 max_bytes=INFO_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, url):
+        return hashlib.sha1(normalize_url(url).encode("utf-8")).hexdigest()
+
+    def path_for(self, url):
+        """Where yt-dlp should write the info JSON of url (without extension)"""
+        return os.path.join(self.directory, self.key(url))
+
+    def lookup(self, url):
+        """Path of a fresh cached info JSON for url, or None"""
+        path = self.path_for(url) + ".info.json"
+        with self._lock:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+            if time.time() - st.st_mtime > self.ttl:
+                self._remove(path)
+                return None
+            os.utime(path, (time.time(), st.st_mtime))
+            return path
+
+    def invalidate(self, url):
+        with self._lock:
+            self._remove(self.path_for(url) + ".info.json")
+
+    def commit(self, url):
+        """Validate a freshly written entry and enforce the size limits.
+
+        Playlist entries all share the playlist URL key, so only single
+        videos are kept.
+        """
+        path = self.path_for(url) + ".info.json"
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+            if info.get("_type", "video") != "video" or info.get("playlist") is not None:
+                self.invalidate(url)
+        except (OSError, ValueError):
+            self.invalidate(url)
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_atime, st.st_size, path))
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            while entries and (len(entries) > self.max_entries or total > self.max_bytes):
+                _, size, path = entries.pop(0)
+                self._remove(path)
+                total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def network_options(use_proxy=False, proxy=None, cookies_file=None):
+    """yt-dlp proxy and cookie options shared by every command"""
+    options = []
+    # Add proxy if enabled, proxy is the one the pool picked for the job
+    if use_proxy:
+        options.extend(["--proxy", proxy or DEFAULT_PROXY])
+    
+    # Cookies of the job's site only, see CookieStore.job_file
+    if cookies_file:
+        options.extend(["--cookies", cookies_file])
+    return options
+
+def build_prefetch_command(url, info_json, use_proxy=False, proxy=None, cookies_file=None):
+    """Build a yt-dlp command that only writes the metadata of url to info_json (without extension)"""
+    cmd = [
+        find_embedded_exe("yt-dlp.exe"),
+        "--no-check-certificates",
+        "--quiet",
+        "--skip-download",
+        # Playlists are only listed, InfoCache keeps single videos anyway
+        "--flat-playlist",
+        "--write-info-json", "--no-write-playlist-metafiles",
+        "-P", f"infojson:{os.path.dirname(info_json)}",
+        "-o", f"infojson:{os.path.basename(info_json)}",
+        url,
+    ]
+    cmd.extend(network_options(use_proxy, proxy, cookies_file))
+    return cmd
+
+# One JSON object per playlist entry, printed as soon as the entry is listed
+PLAYLIST_ENTRY_TEMPLATE = "%(.{id,title,url,webpage_url,ie_key})j"
+
+def build_expand_command(url, use_proxy=False, proxy=None, cookies_file=None):
+    """Build a yt-dlp command that lists playlist entries without downloading"""
+    cmd = [
+        find_embedded_exe("yt-dlp.exe"),
+        "--no-check-certificates",
+        "--flat-playlist",   # Don't extract every entry, just list it
+        "--lazy-playlist",   # Print entries while the listing is still being fetched
+        "--ignore-errors",
+        "--print", PLAYLIST_ENTRY_TEMPLATE,
+        url,
+    ]
+    cmd.extend(network_options(use_proxy, proxy, cookies_file))
+    return cmd
+
+def parse_playlist_entry(text):
+    """Return (url, title, video_key) of a listed entry, or None"""
+    if not text.startswith("{"):
+        return None
+    try:
+        entry = json.loads(text)
+    except ValueError:
+        return None
+    url = entry.get("webpage_url") or entry.get("url")
+    if not isinstance(url, str) or not url.startswith(("http://", "https://")):
+        return None
+    video_key = None
+    if entry.get("ie_key") and entry.get("id"):
+        video_key = (entry["ie_key"], str(entry["id"]))
+    return url, entry.get("title"), video_key
+
+# Reported by yt-dlp for every file once it reached its final location
+FILE_REPORT_TEMPLATE = "%(.{id,extractor_key,webpage_url,filepath})j"
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ArchiveIndex:
+    """SQLite index of finished downloads keyed by extractor, video id and preset.
+
+    The preset is part of the key so the same video can still be fetched as
+    MP4 and as MP3. Content hashes of the finished files find byte-identical
+    copies in other folders, which are replaced by hard links.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS downloads (
+            extractor TEXT NOT NULL,
+            video_id TEXT NOT NULL,
+            preset TEXT NOT NULL,
+            url TEXT,
+            path TEXT NOT NULL,
+            size INTEGER,
+            sha256 TEXT,
+            finished_at REAL,
+            PRIMARY KEY (extractor, video_id, preset)
+        );
+        CREATE INDEX IF NOT EXISTS downloads_url ON downloads (url, preset);
+        CREATE INDEX IF NOT EXISTS downloads_hash ON downloads (sha256, size);
+    """
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(self.SCHEMA)
+
+    def find(self, url, preset, video_key=None):
+        """Path of an archived download that still exists, or None"""
+        with self._lock:
+            if video_key:
+                row = self._conn.execute(
+                    "SELECT path FROM downloads WHERE extractor = ? AND video_id = ? AND preset = ?",
+                    (video_key[0].lower(), video_key[1], preset)).fetchone()
+            else:
+                row = self._conn.execute(
+                    "SELECT path FROM downloads WHERE url = ? AND preset = ?",
+                    (normalize_url(url), preset)).fetchone()
+        if row and os.path.exists(row[0]):
+            return row[0]
+        return None
+
+    def record(self, url, preset, video_key, path, log=print):
+        """Hash a finished file, hard-link it to an identical copy and archive it"""
+        size = os.path.getsize(path)
+        digest = file_sha256(path)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM downloads WHERE sha256 = ? AND size = ? AND path != ?",
+                (digest, size, path)).fetchall()
+        for (existing,) in rows:
+            if self._link_duplicate(existing, path, size):
+                log(f"Identical file already archived, hard-linked to {existing}")
+                break
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (video_key[0].lower(), video_key[1], preset, normalize_url(url), path, size, digest, time.time()))
+
+    def _link_duplicate(self, existing, path, size):
+        try:
+            if os.path.samefile(existing, path) or os.path.getsize(existing) != size:
+                return False
+            temp_link = path + ".kglink"
+            os.link(existing, temp_link)
+            os.replace(temp_link, path)
+            return True
+        except OSError:
+            # Missing file, different volume or no hard link support
+            return False
+
+# Downloader backends selectable per job
+BACKEND_AUTO = "Auto"
+BACKEND_NATIVE = "Native"
+BACKEND_FRAGMENTS = "Parallel fragments"
+BACKEND_ARIA2C = "aria2c"
+DOWNLOADER_BACKENDS = [BACKEND_AUTO, BACKEND_NATIVE, BACKEND_FRAGMENTS, BACKEND_ARIA2C]
+
+def find_aria2c():
+    """Bundled or installed aria2c, None when it is not available"""
+    return binary_cache.path("aria2c.exe") or shutil.which("aria2c")
+
+def site_downloader(url):
+    """Backend configured for the host of url in settings, or None"""
+    host = urllib.parse.urlsplit(url).hostname or ""
+    for site, backend in settings.get("site_downloaders", {}).items():
+        if host == site or host.endswith("." + site):
+            return backend
+    return None
+
+def downloader_options(backend, url, use_proxy=False, log=print, proxy=None):
+    """yt-dlp options selecting the downloader backend for one job"""
+    if backend == BACKEND_AUTO:
+        backend = site_downloader(url) or BACKEND_NATIVE
+    fragments = str(settings.get("concurrent_fragments", 8))
+    if backend == BACKEND_ARIA2C:
+        aria2c = find_aria2c()
+        if not aria2c:
+            log("Warning: aria2c not found, using parallel fragments instead")
+            backend = BACKEND_FRAGMENTS
+        elif use_proxy and not (proxy or DEFAULT_PROXY).startswith(("http://", "https://")):
+            # aria2c only speaks HTTP proxies
+            log("Warning: aria2c can't use a SOCKS proxy, using parallel fragments instead")
+            backend = BACKEND_FRAGMENTS
+        else:
+            connections = int(settings.get("aria2c_connections", 16))
+            log(f"Downloader: aria2c with {connections} connections")
+            return [
+                "--downloader", aria2c,
+                # HLS/DASH stay with the native downloader fetching fragments in parallel
+                "--downloader", "dash,m3u8:native",
+                "--downloader-args", f"aria2c:-x{connections} -s{connections} -k1M --file-allocation=none",
+                "--concurrent-fragments", fragments,
+            ]
+    if backend == BACKEND_FRAGMENTS:
+        log(f"Downloader: native with {fragments} parallel fragments")
+        return ["--concurrent-fragments", fragments]
+    return []
+
+RATE_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*([KMG]?)I?B?(?:/S|PS)?")
+
+def parse_rate(value):
+    """Parse a rate such as 500K, 2.5M or 1 MiB/s into bytes per second.
+
+    0 is unlimited, None means the value is not a rate.
+    """
+    match = RATE_PATTERN.fullmatch(str(value or "0").strip().upper())
+    if not match:
+        return None
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ("_KMG".index(unit or "_")))
+
+# Seconds between bandwidth re-balancing passes
+REBALANCE_INTERVAL = 10
+# A running job is only restarted once it ran this long with its current limit
+REBALANCE_MIN_RUNTIME = 20
+# Relative difference between current and fair limit that justifies a restart
+REBALANCE_TOLERANCE = 0.25
+
+class BandwidthGovernor:
+    """Splits a global download budget among the running jobs.
+
+    yt-dlp only takes --limit-rate at start, so jobs whose share drifted too
+    far are restarted with --continue and pick up their new limit.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        # Last valid rate of every setting, kept while the setting is broken
+        self._rates = {}
+        self._warned = {}
+
+    def rate(self, name, value):
+        """Bytes per second of a rate setting, warns once about a bad value"""
+        rate = parse_rate(value)
+        if rate is not None:
+            self._rates[name] = rate
+            return rate
+        if self._warned.get(name) != value:
+            self._warned[name] = value
+            print(f"Warning: {name} {value!r} is not a rate such as 500K or 2.5M, "
+                  f"keeping the previous limit")
+        return self._rates.get(name, 0)
+
+    def budget(self, now=None):
+        """Total bytes per second allowed right now, 0 when unlimited"""
+        now = now or time.localtime()
+        minutes = now.tm_hour * 60 + now.tm_min
+        for profile in self.settings.get("bandwidth_schedule", []):
+            try:
+                start = [int(x) for x in profile["from"].split(":")]
+                end = [int(x) for x in profile["to"].split(":")]
+            except (KeyError, ValueError, AttributeError):
+                continue
+            start = start[0] * 60 + start[1]
+            end = end[0] * 60 + end[1]
+            # Profiles may wrap around midnight
+            if start <= minutes < end or (end < start and (minutes >= start or minutes < end)):
+                return self.rate(f"bandwidth_schedule {profile['from']}-{profile['to']}", profile.get("limit"))
+        return self.rate("bandwidth_limit", self.settings.get("bandwidth_limit"))
+
+    def limit_for(self, active_jobs):
+        """Rate limit of each of active_jobs running jobs, 0 when unlimited"""
+        budget = self.budget()
+        job_cap = self.rate("job_rate_limit", self.settings.get("job_rate_limit"))
+        share = budget // max(1, active_jobs) if budget else 0
+        limits = [limit for limit in (share, job_cap) if limit]
+        return min(limits) if limits else 0
+
+    def needs_restart(self, current, target):
+        if current == target:
+            return False
+        if not current or not target:
+            return True
+        return abs(current - target) > REBALANCE_TOLERANCE * current
+
+# A proxy that failed for a host is avoided for that host this long
+PROXY_HOST_PENALTY = 10 * 60
+PROXY_CHECK_TIMEOUT = 5
+# Proxies tried by one job before it fails
+PROXY_FAILOVER_ATTEMPTS = 3
+# Weight of a new latency or throughput sample in the running averages
+PROXY_SAMPLE_WEIGHT = 0.3
+# yt-dlp errors that blame the connection or the proxy rather than the video,
+# only these fail over to another proxy and count against this one
+PROXY_ERROR = re.compile(
+    r"proxy|socks|tunnel connection failed|timed out|connection (refused|reset|aborted)"
+    r"|remote end closed|network is unreachable|no route to host|name resolution|getaddrinfo"
+    r"|failed to establish a new connection|errno (101|104|110|111|113)|HTTP Error (407|502|503|504)",
+    re.IGNORECASE)
+
+def is_proxy_error(line):
+    """Whether a yt-dlp output line reports a network or proxy failure"""
+    return line.startswith("ERROR:") and PROXY_ERROR.search(line) is not None
+
+def check_proxy(proxy, timeout=PROXY_CHECK_TIMEOUT):
+    """Seconds to connect and complete the proxy handshake, raises OSError when down"""
+    parts = urllib.parse.urlsplit(proxy)
+    default_port = {"http": 80, "https": 443}.get(parts.scheme, 1080)
+    started = time.monotonic()
+    with socket.create_connection((parts.hostname, parts.port or default_port), timeout=timeout) as sock:
+        if parts.scheme.startswith("socks5"):
+            # Greeting offering no authentication, or user/password when configured
+            methods = b"\x00\x02" if parts.username else b"\x00"
+            sock.sendall(b"\x05" + bytes([len(methods)]) + methods)
+            reply = sock.recv(2)
+            if len(reply) < 2 or reply[0] != 5 or reply[1] == 0xFF:
+                raise ConnectionError("SOCKS5 handshake refused")
+    return time.monotonic() - started
+
+class ProxyStats:
+    def __init__(self, url):
+        self.url = url
+        self.healthy = True
+        self.latency = None
+        self.throughput = None
+        self.active = 0
+        # host -> bytes per second seen through this proxy
+        self.host_throughput = {}
+        # host -> time of the last failed job
+        self.host_failed = {}
+
+class ProxyPool:
+    """Proxies of the "proxies" setting, ranked by health, latency and throughput.
+
+    A background thread checks every proxy's handshake latency, finished
+    jobs report their throughput per host. acquire() hands out the healthy
+    proxy with the lowest expected cost and blocks while every healthy proxy
+    is at proxy_max_jobs; proxies that are down are only used once no proxy
+    is healthy.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.proxies = [ProxyStats(url) for url in settings.get("proxies") or [DEFAULT_PROXY]]
+        self._condition = threading.Condition()
+        self._checking = False
+        self.closed = False
+
+    def acquire(self, host, exclude=()):
+        """Reserve the best proxy for host, None once the pool is closed"""
+        self._start_checks()
+        cap = max(1, int(self.settings.get("proxy_max_jobs", 4)))
+        with self._condition:
+            while not self.closed:
+                healthy = [p for p in self.proxies if p.healthy]
+                usable = [p for p in healthy or self.proxies if p.url not in exclude]
+                if not usable:
+                    # Every other proxy was tried, go round again
+                    exclude = ()
+                    continue
+                candidates = [p for p in usable if p.active < cap]
+                if candidates:
+                    proxy = min(candidates, key=lambda p: self._cost(p, host))
+                    proxy.active += 1
+                    return proxy.url
+                self._condition.wait(1)
+        return None
+
+    def pick(self, host):
+        """Best proxy for host without reserving a slot, for short requests"""
+        self._start_checks()
+        with self._condition:
+            return min(self.proxies, key=lambda p: self._cost(p, host)).url
+
+    def release(self, url, host, ok, throughput=None):
+        with self._condition:
+            for proxy in self.proxies:
+                if proxy.url != url:
+                    continue
+                proxy.active -= 1
+                if ok:
+                    proxy.host_failed.pop(host, None)
+                else:
+                    proxy.host_failed[host] = time.monotonic()
+                if throughput:
+                    proxy.throughput = self._average(proxy.throughput, throughput)
+                    proxy.host_throughput[host] = self._average(proxy.host_throughput.get(host), throughput)
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def _cost(self, proxy, host):
+        """Expected seconds to fetch one megabyte, lower is better"""
+        throughput = proxy.host_throughput.get(host) or proxy.throughput or 1024 * 1024
+        cost = (proxy.latency or 1.0) + 1024 * 1024 / throughput
+        cost *= 1 + proxy.active
+        if not proxy.healthy:
+            cost += 3600
+        if time.monotonic() - proxy.host_failed.get(host, -PROXY_HOST_PENALTY) < PROXY_HOST_PENALTY:
+            cost += 600
+        return cost
+
+    @staticmethod
+    def _average(current, sample):
+        return sample if current is None else current + PROXY_SAMPLE_WEIGHT * (sample - current)
+
+    def _start_checks(self):
+        # Proxies are only probed once something actually uses them
+        with self._condition:
+            if self._checking:
+                return
+            self._checking = True
+        threading.Thread(target=self._check_loop, daemon=True).start()
+
+    def _check_loop(self):
+        while not self.closed:
+            for proxy in list(self.proxies):
+                try:
+                    latency = check_proxy(proxy.url)
+                except (OSError, ValueError) as e:
+                    if proxy.healthy:
+                        print(f"Proxy {proxy.url} is down: {e}")
+                    with self._condition:
+                        proxy.healthy = False
+                    continue
+                with self._condition:
+                    proxy.healthy = True
+                    proxy.latency = self._average(proxy.latency, latency)
+                    self._condition.notify_all()
+            time.sleep(max(10, int(self.settings.get("proxy_check_interval", 300))))
+
+# Format presets understood by build_command
+FORMAT_PRESETS = [
+    "Best Quality (MP4)",
+    "Best Quality (Any Format)",
+    "1080p (MP4)",
+    "720p (MP4)",
+    "480p (MP4)",
+    "Audio only (MP3)",
+    "Audio only (original)",
+]
+
+def build_command(url, download_path, format_choice, use_proxy=False, log=print,
+                  info_json=None, write_info_json=None, files_report=None, resume=False,
+                  downloader=BACKEND_NATIVE, rate_limit=0, staging_dir=None, proxy=None,
+                  cookies_file=None):
+    """Build the yt-dlp command line for one download.
+
+    info_json starts from previously extracted metadata instead of url,
+    write_info_json is a path (without extension) to save the metadata to,
+    files_report a file that receives one JSON line per finished file,
+    resume continues partially downloaded .part files, downloader picks
+    one of DOWNLOADER_BACKENDS and rate_limit caps bytes per second.
+    staging_dir only downloads into that directory and leaves the
+    conversion of the preset to the post-processing queue. proxy replaces
+    DEFAULT_PROXY when use_proxy is set, cookies_file is passed as --cookies.
+    """
+    yt = find_embedded_exe("yt-dlp.exe")
+    ffmpeg_path = find_ffmpeg()
+    ffprobe_path = find_ffprobe()
+    
+    cmd = [
+        yt,
+        "--no-check-certificates",  # Skip SSL certificate verification
+        "--prefer-free-formats",    # Prefer free formats when available
+        "--merge-output-format", "mp4",  # Merge to MP4 when possible
+        "-P", staging_dir or download_path,
+        # One JSON progress object per line, parsed into JobProgress
+        "--newline",
+        "--progress-template", f"download:{PROGRESS_MARKER}%(progress)j",
+        "--progress-template", f"postprocess:{PROGRESS_MARKER}%(progress)j",
+    ]
+
+    if info_json:
+        # Skip extraction, formats are resolved from the cached metadata
+        cmd.extend(["--load-info-json", info_json])
+    else:
+        cmd.append(url)
+        if write_info_json:
+            cmd.extend([
+                "--write-info-json", "--no-write-playlist-metafiles",
+                "-P", f"infojson:{os.path.dirname(write_info_json)}",
+                "-o", f"infojson:{os.path.basename(write_info_json)}",
+            ])
+    if files_report:
+        # --print would imply --quiet, --print-to-file keeps the normal log
+        cmd.extend(["--print-to-file", f"after_move:{FILE_REPORT_TEMPLATE}", files_report])
+    if resume:
+        cmd.append("--continue")
+    if rate_limit:
+        cmd.extend(["--limit-rate", str(rate_limit)])
+    
+    cmd.extend(network_options(use_proxy, proxy, cookies_file))
+    cmd.extend(downloader_options(downloader, url, use_proxy, log, proxy))
+    
+    # Set format based on choice
+    if format_choice == "Best Quality (MP4)":
+        # Download best video+audio, prefer MP4, fallback to best available
+        cmd.extend(["-f", "best[ext=mp4]/bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best"])
+    elif format_choice == "Best Quality (Any Format)":
+        # Download best available quality in any format
+        cmd.extend(["-f", "bestvideo+bestaudio/best"])
+    elif format_choice == "1080p (MP4)":
+        # Download 1080p video, fallback to best available
+        cmd.extend(["-f", "best[height<=1080][ext=mp4]/bestvideo[height<=1080]+bestaudio[ext=m4a]/best[height<=1080]/best"])
+    elif format_choice == "720p (MP4)":
+        # Download 720p video, fallback to best available
+        cmd.extend(["-f", "best[height<=720][ext=mp4]/bestvideo[height<=720]+bestaudio[ext=m4a]/best[height<=720]/best"])
+    elif format_choice == "480p (MP4)":
+        # Download 480p video, fallback to best available
+        cmd.extend(["-f", "best[height<=480][ext=mp4]/bestvideo[height<=480]+bestaudio[ext=m4a]/best[height<=480]/best"])
+    elif format_choice == "Audio only (MP3)" and staging_dir:
+        # Converted to MP3 by the post-processing queue
+        cmd.extend(["-f", "bestaudio"])
+    elif format_choice == "Audio only (MP3)":
+        # Download best audio and convert to MP3
+        cmd.extend(["-f", "bestaudio", "-x", "--audio-format", "mp3", "--audio-quality", "0"])
+    elif format_choice == "Audio only (original)" and staging_dir:
+        cmd.extend(["-f", "bestaudio"])
+    elif format_choice == "Audio only (original)":
+        # Keep the source codec, only the container changes
+        cmd.extend(["-f", "bestaudio", "-x"])
+    else:
+        # Fallback to best available
+        cmd.extend(["-f", "best"])
+    
+    # Check for ffmpeg and ffprobe
+    if ffmpeg_path and ffprobe_path:
+        # yt-dlp looks for both in the given directory, or on PATH without it
+        if os.path.dirname(ffmpeg_path) == os.path.dirname(ffprobe_path):
+            cmd.extend(["--ffmpeg-location", os.path.dirname(ffmpeg_path)])
+        # Debug: Add ffmpeg path to output
+        log(f"Using ffmpeg: {ffmpeg_path}")
+        log(f"Using ffprobe: {ffprobe_path}")
+    else:
+        if not ffmpeg_path:
+            log("Warning: ffmpeg not found in the bundled binaries or on PATH")
+        if not ffprobe_path:
+            log("Warning: ffprobe not found in the bundled binaries or on PATH")
+    return cmd
+
+def hidden_startupinfo():
+    """Create startup info to hide console window on Windows"""
+    startupinfo = None
+    if sys.platform.startswith("win"):
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        startupinfo.wShowWindow = subprocess.SW_HIDE
+    return startupinfo
+
+# Conversions run by PostProcessQueue instead of inside yt-dlp, per preset:
+# "copy" maps audio codecs that already fit to the extension they are kept
+# in, anything else is transcoded with "args" into an "ext" file
+DEFERRED_POSTPROCESSING = {
+    "Audio only (MP3)": {
+        "copy": {"mp3": "mp3"},
+        "ext": "mp3", "args": ["-vn", "-c:a", "libmp3lame", "-q:a", "0"],
+    },
+    "Audio only (original)": {
+        "copy": {"aac": "m4a", "alac": "m4a", "mp3": "mp3", "opus": "opus", "vorbis": "ogg", "flac": "flac"},
+        "ext": "m4a", "args": ["-vn", "-c:a", "aac", "-b:a", "192k"],
+    },
+}
+COPY_AUDIO = ["-vn", "-map", "0:a:0", "-c:a", "copy"]
+# Leave one core to the UI and the downloads
+POSTPROCESS_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+def find_ffmpeg():
+    return binary_cache.path("ffmpeg.exe") or shutil.which("ffmpeg")
+
+def find_ffprobe():
+    return binary_cache.path("ffprobe.exe") or shutil.which("ffprobe")
+
+def probe_audio_codec(path):
+    """Codec name of the first audio stream according to ffprobe, None if unknown"""
+    ffprobe = find_ffprobe()
+    if not ffprobe:
+        return None
+    try:
+        result = subprocess.run([ffprobe, "-v", "error", "-select_streams", "a:0",
+                                 "-show_entries", "stream=codec_name", "-of", "json", path],
+                                capture_output=True, timeout=60, startupinfo=hidden_startupinfo())
+        streams = json.loads(result.stdout.decode("utf-8", "replace")).get("streams") or []
+        return streams[0].get("codec_name") if streams else None
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+
+def plan_conversion(codec, spec):
+    """(extension, ffmpeg options) for the preset spec, COPY_AUDIO when no re-encode is needed"""
+    if codec in spec["copy"]:
+        return spec["copy"][codec], COPY_AUDIO
+    return spec["ext"], spec["args"]
+
+def start_low_priority(cmd, **kwargs):
+    """Start a CPU heavy child below normal priority.
+
+    The priority is lowered after the start, preexec_fn is not safe in a
+    process with threads.
+    """
+    if sys.platform.startswith("win"):
+        return subprocess.Popen(cmd, creationflags=subprocess.BELOW_NORMAL_PRIORITY_CLASS, **kwargs)
+    proc = subprocess.Popen(cmd, **kwargs)
+    try:
+        os.setpriority(os.PRIO_PROCESS, proc.pid, 10)
+    except OSError:
+        # Already exited, or not permitted, the conversion runs at normal priority
+        pass
+    return proc
+
+class PostTask:
+    """Conversions of one job's downloaded files, run by PostProcessQueue.
+
+    steps is a list of (files report entry, DEFERRED_POSTPROCESSING spec),
+    the entries' filepath is updated to the converted file. emit(text)
+    receives log lines and on_done(ok) is called from the post-processing
+    thread.
+    """
+
+    def __init__(self, job, steps, emit, on_done):
+        self.job = job
+        self.steps = steps
+        self.emit = emit
+        self.on_done = on_done
+
+class PostProcessQueue:
+    """Merges and transcodes of finished downloads on a pool sized to the core count.
+
+    Download workers hand their files over and pick up the next download,
+    so network and CPU work overlap and conversions of many jobs never use
+    more than POSTPROCESS_WORKERS cores.
+    """
+
+    def __init__(self, workers=POSTPROCESS_WORKERS):
+        self._pending = queue.Queue()
+        self._stopping = False
+        for _ in range(max(1, workers)):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, task):
+        self._pending.put(task)
+
+    def shutdown(self):
+        self._stopping = True
+
+    def _worker(self):
+        while not self._stopping:
+            try:
+                task = self._pending.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                ok = all(self._run_step(task, *step) for step in task.steps)
+            except Exception as e:
+                task.emit(f"❌ Ошибка: {e}")
+                ok = False
+            task.on_done(ok and not self._stopping)
+
+    def _run_step(self, task, entry, spec):
+        if self._stopping:
+            return False
+        source = entry["filepath"]
+        codec = probe_audio_codec(source)
+        ext, options = plan_conversion(codec, spec)
+        target = os.path.join(task.job.download_path, f"{os.path.splitext(os.path.basename(source))[0]}.{ext}")
+        # The result is written next to the target and renamed when complete
+        temp_path = f"{os.path.splitext(target)[0]}.part.{ext}"
+        if options is COPY_AUDIO and source.lower().endswith("." + ext):
+            task.emit(f"Keeping {codec} audio as is: {os.path.basename(target)}")
+            shutil.move(source, temp_path)
+            os.replace(temp_path, target)
+            entry["filepath"] = target
+            return True
+        ffmpeg = find_ffmpeg()
+        if not ffmpeg:
+            task.emit("❌ ffmpeg not found, cannot convert")
+            return False
+        cmd = [ffmpeg, "-hide_banner", "-nostdin", "-loglevel", "error", "-y", "-i", source,
+               *options, temp_path]
+        action = "Remuxing" if options is COPY_AUDIO else f"Transcoding {codec or 'unknown codec'}"
+        task.emit(f"{action}: {os.path.basename(source)} → {os.path.basename(target)}")
+        task.job.proc = start_low_priority(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                           startupinfo=hidden_startupinfo())
+
+        def emit_output(events):
+            for _, text in events:
+                task.emit(text)
+
+        code = read_process_output(task.job.proc, emit_output)
+        task.job.proc = None
+        if code != 0:
+            task.emit(f"❌ ffmpeg failed (code {code})")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return False
+        os.replace(temp_path, target)
+        entry["filepath"] = target
+        return True
+
+# Download queue job states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_SKIPPED = "skipped"
+JOB_STATES = (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_SKIPPED)
+FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_SKIPPED)
+# Finished jobs the window and the daemon keep, older ones leave the list
+MAX_FINISHED_JOBS = 300
+PRUNE_BATCH = 50
+
+DEFAULT_WORKERS = 3
+MAX_WORKERS = 16
+
+# Prefix of the machine-readable progress lines requested from yt-dlp
+PROGRESS_MARKER = "[kirstgrab-progress] "
+
+# Job progress stages
+STAGE_STARTING = "starting"
+STAGE_LISTING = "listing"
+STAGE_DOWNLOAD = "download"
+STAGE_MERGE = "merge"
+STAGE_POSTPROCESS = "postprocess"
+
+def format_bytes(num):
+    """Format a byte count with binary units"""
+    if num is None:
+        return "?"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(num) < 1024:
+            return f"{num:.1f}{unit}" if unit != "B" else f"{int(num)}B"
+        num /= 1024
+    return f"{num:.1f}TiB"
+
+def parse_progress_line(text):
+    """Return the progress dict of a yt-dlp JSON progress line, or None"""
+    if not text.startswith(PROGRESS_MARKER):
+        return None
+    try:
+        data = json.loads(text[len(PROGRESS_MARKER):])
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+class JobProgress:
+    """Structured download progress of a job built from yt-dlp progress dicts"""
+
+    def __init__(self):
+        self.stage = STAGE_STARTING
+        self.filename = None
+        self.downloaded_bytes = 0
+        self.total_bytes = None
+        self.speed = None
+        self.eta = None
+        self.fragment_index = None
+        self.fragment_count = None
+        # Entries found so far when listing a playlist
+        self.entries = 0
+        # Bytes of files already finished (video and audio are separate files)
+        self.finished_bytes = 0
+        self._file_counted = False
+
+    def update(self, data):
+        if "postprocessor" in data:
+            self.stage = STAGE_MERGE if data.get("postprocessor") == "Merger" else STAGE_POSTPROCESS
+            self.speed = None
+            self.eta = None
+            return
+        self.stage = STAGE_DOWNLOAD
+        filename = data.get("filename")
+        if filename != self.filename:
+            if self.filename and not self._file_counted:
+                self.finished_bytes += self.downloaded_bytes
+            self.filename = filename
+            self._file_counted = False
+        self.downloaded_bytes = data.get("downloaded_bytes") or 0
+        self.total_bytes = data.get("total_bytes") or data.get("total_bytes_estimate")
+        self.speed = data.get("speed")
+        self.eta = data.get("eta")
+        self.fragment_index = data.get("fragment_index")
+        self.fragment_count = data.get("fragment_count")
+        if data.get("status") == "finished" and not self._file_counted:
+            self.finished_bytes += self.downloaded_bytes
+            self._file_counted = True
+            self.speed = None
+            self.eta = None
+
+    def total_downloaded(self):
+        """Bytes downloaded so far across all files of the job"""
+        return self.finished_bytes + (0 if self._file_counted else self.downloaded_bytes)
+
+    def percent(self):
+        """Percent of the current file, None when the size is unknown"""
+        if not self.total_bytes:
+            return None
+        return min(100.0, self.downloaded_bytes * 100.0 / self.total_bytes)
+
+    def summary(self):
+        if self.stage == STAGE_LISTING:
+            return f"{self.stage}: {self.entries} entries"
+        if self.stage != STAGE_DOWNLOAD:
+            return self.stage
+        parts = [self.stage]
+        percent = self.percent()
+        if percent is not None:
+            parts.append(f"{percent:.1f}% of {format_bytes(self.total_bytes)}")
+        else:
+            parts.append(format_bytes(self.downloaded_bytes))
+        if self.speed:
+            parts.append(f"at {format_bytes(self.speed)}/s")
+        if self.eta is not None:
+            parts.append(f"ETA {int(self.eta) // 60:02d}:{int(self.eta) % 60:02d}")
+        if self.fragment_count:
+            parts.append(f"(frag {self.fragment_index}/{self.fragment_count})")
+        return " ".join(parts)
+
+# Output lines kept in memory per job; older lines are spilled to disk
+LOG_CAPACITY = 500
+# Lines a finished job keeps in memory once its log is spilled
+FINISHED_LOG_LINES = 50
+SPILL_JOB_LOGS = True
+JOB_LOG_MAX_BYTES = 5 * 1024 * 1024
+JOB_LOG_BACKUPS = 3
+
+_job_log_spill = None
+_job_log_spill_lock = threading.Lock()
+
+def get_job_log_spill():
+    """Rotating on-disk log receiving lines that leave the in-memory buffers"""
+    global _job_log_spill
+    with _job_log_spill_lock:
+        if _job_log_spill is None:
+            logger = logging.getLogger("kirstgrab.jobs")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            try:
+                handler = logging.handlers.RotatingFileHandler(
+                    os.path.join(app_data_dir("logs"), "jobs.log"),
+                    maxBytes=JOB_LOG_MAX_BYTES, backupCount=JOB_LOG_BACKUPS,
+                    encoding="utf-8", delay=True)
+                handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+                logger.addHandler(handler)
+            except Exception as e:
+                print(f"Warning: Could not open job log file: {e}")
+                logger.addHandler(logging.NullHandler())
+            _job_log_spill = logger
+        return _job_log_spill
+
+class JobLog:
+    """Fixed-capacity ring buffer of a job's output lines"""
+
+    def __init__(self, job_id, capacity=LOG_CAPACITY, spill=SPILL_JOB_LOGS):
+        self.job_id = job_id
+        self.lines = collections.deque(maxlen=capacity)
+        self.spill = get_job_log_spill() if spill else None
+        self._progress_open = False
+        # Lines at the front that flush() already wrote to the spill
+        self._spilled = 0
+        self._lock = threading.Lock()
+
+    def append(self, events):
+        with self._lock:
+            for kind, text in events:
+                if kind == "progress" and self._progress_open:
+                    self.lines[-1] = text
+                    continue
+                if len(self.lines) == self.lines.maxlen and self.spill:
+                    if self._spilled:
+                        self._spilled -= 1
+                    else:
+                        self.spill.info("job#%s %s", self.job_id, self.lines[0])
+                self.lines.append(text)
+                self._progress_open = kind == "progress"
+
+    def flush(self):
+        """Spill the lines still in memory and keep only a short tail, used once the job is finished"""
+        if not self.spill:
+            return
+        with self._lock:
+            for line in list(self.lines)[self._spilled:]:
+                self.spill.info("job#%s %s", self.job_id, line)
+            self.lines = collections.deque(list(self.lines)[-FINISHED_LOG_LINES:], maxlen=FINISHED_LOG_LINES)
+            self._spilled = len(self.lines)
+
+    def tail(self, count):
+        with self._lock:
+            return list(self.lines)[-count:]
+
+class DownloadJob:
+    """A single URL download tracked by the download queue"""
+    _ids = itertools.count(1)
+
+    def __init__(self, url, download_path, format_choice, use_proxy=False, expand_playlist=False,
+                 label=None, video_key=None, parent_id=None, journal_id=None, resume=False,
+                 downloader=BACKEND_AUTO):
+        self.id = next(DownloadJob._ids)
+        # Stable across restarts, unlike the per-session id
+        self.journal_id = journal_id or uuid.uuid4().hex
+        self.parent_id = parent_id
+        self.resume = resume
+        self.url = url
+        self.download_path = download_path
+        self.format_choice = format_choice
+        self.use_proxy = use_proxy
+        self.downloader = downloader
+        # Playlist jobs only list entries and queue one job per entry
+        self.expand_playlist = expand_playlist
+        self.label = label
+        # (extractor, video id) when known before extraction, e.g. from a playlist listing
+        self.video_key = video_key
+        self.state = JOB_QUEUED
+        self.returncode = None
+        self.proc = None
+        self.progress = JobProgress()
+        self.log = JobLog(self.id)
+        self.uses_cookies = False
+        self.journaled_at = 0
+        # Set while the post-processing queue converts the downloaded files
+        self.postprocessing = False
+        # Proxy of the current attempt, picked by the proxy pool
+        self.proxy = None
+        # Set when the current attempt failed with a network or proxy error
+        self.proxy_failed = False
+        self.metrics = JobMetrics()
+        # Current --limit-rate of the running process, set by the governor
+        self.rate_limit = 0
+        self.rate_limit_since = 0
+        self.restart_requested = False
+
+    def to_record(self):
+        """Everything needed to queue the job again after a restart"""
+        return {
+            "id": self.journal_id,
+            "parent": self.parent_id,
+            "url": self.url,
+            "download_path": self.download_path,
+            "format_choice": self.format_choice,
+            "use_proxy": self.use_proxy,
+            "downloader": self.downloader,
+            "uses_cookies": self.uses_cookies,
+            "expand_playlist": self.expand_playlist,
+            "label": self.label,
+            "video_key": self.video_key,
+        }
+
+    @classmethod
+    def from_record(cls, record, resume=True):
+        job = cls(record["url"], record["download_path"], record["format_choice"], record.get("use_proxy", False),
+                  expand_playlist=record.get("expand_playlist", False), label=record.get("label"),
+                  video_key=tuple(record["video_key"]) if record.get("video_key") else None,
+                  parent_id=record.get("parent"), journal_id=record["id"], resume=resume,
+                  downloader=record.get("downloader", BACKEND_AUTO))
+        job.uses_cookies = record.get("uses_cookies", False)
+        return job
+
+    def title(self, width=40):
+        """Short human readable label for job lists"""
+        label = self.label or self.url
+        if self.expand_playlist:
+            label = "☰ " + label
+        if len(label) > width:
+            label = label[:width - 1] + "…"
+        status = self.state
+        percent = self.progress.percent()
+        if self.expand_playlist and self.progress.entries:
+            status = f"{self.state} {self.progress.entries}"
+        elif self.state == JOB_RUNNING and self.progress.stage != STAGE_DOWNLOAD:
+            status = self.progress.stage
+        elif self.state == JOB_RUNNING and percent is not None:
+            status = f"{percent:.0f}%"
+        return f"#{self.id} [{status}] {label}"
+
+# Seconds between journaled progress records of a running job
+JOURNAL_PROGRESS_INTERVAL = 5
+# The journal is rewritten with only the live jobs once it holds more than
+# this many records, and more than JOURNAL_COMPACT_FACTOR per live job
+JOURNAL_COMPACT_MIN = 1000
+JOURNAL_COMPACT_FACTOR = 4
+
+class JobJournal:
+    """Append-only write-ahead journal of queue jobs.
+
+    Every submit and state change is appended as one JSON line and fsynced
+    before the queue acts on it, progress is appended without syncing. After
+    a crash, load() replays the file and returns the jobs that never finished.
+    The unfinished jobs are also tracked in memory, so a long session can
+    compact the file without reading it back.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # journal id -> [job record, state, downloaded bytes] of unfinished jobs
+        self._live = {}
+        self._records = 0
+
+    def append(self, record, sync=True):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+                    if sync:
+                        f.flush()
+                        os.fsync(f.fileno())
+            except OSError as e:
+                print(f"Warning: Could not write job journal: {e}")
+                return
+            self._track(record)
+            self._records += 1
+            if self._records > max(JOURNAL_COMPACT_MIN, JOURNAL_COMPACT_FACTOR * len(self._live)):
+                self._compact()
+
+    def _track(self, record):
+        if record.get("op") == "submit":
+            self._live[record["job"]["id"]] = [record["job"], JOB_QUEUED, 0]
+        elif record.get("id") in self._live:
+            if record.get("op") == "state":
+                if record["state"] in (JOB_QUEUED, JOB_RUNNING):
+                    self._live[record["id"]][1] = record["state"]
+                else:
+                    del self._live[record["id"]]
+            elif record.get("op") == "progress":
+                self._live[record["id"]][2] = record.get("bytes", 0)
+
+    def _compact(self):
+        """Rewrite the journal with the live jobs only, called with the lock held"""
+        lines = []
+        for job_id, (record, state, downloaded) in self._live.items():
+            lines.append({"op": "submit", "job": record})
+            if state != JOB_QUEUED:
+                lines.append({"op": "state", "id": job_id, "state": state})
+            if downloaded:
+                lines.append({"op": "progress", "id": job_id, "bytes": downloaded})
+        self._rewrite(lines)
+
+    def _rewrite(self, records):
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            self._records = len(records)
+        except OSError as e:
+            print(f"Warning: Could not compact job journal: {e}")
+
+    def load(self):
+        """Unfinished jobs of the previous session, compacting the journal.
+
+        Returns (record, last_state, downloaded_bytes) tuples in submit order.
+        Unfinished children of an unfinished playlist are dropped because
+        listing the playlist again queues them anew.
+        """
+        jobs = {}
+        with self._lock:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    lines = f.readlines()
+            except OSError:
+                lines = []
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn write from a crash
+                    continue
+                if record.get("op") == "submit":
+                    jobs[record["job"]["id"]] = [record["job"], JOB_QUEUED, 0]
+                elif record.get("id") in jobs:
+                    if record.get("op") == "state":
+                        jobs[record["id"]][1] = record["state"]
+                    elif record.get("op") == "progress":
+                        jobs[record["id"]][2] = record.get("bytes", 0)
+            unfinished = {job_id: entry for job_id, entry in jobs.items()
+                          if entry[1] in (JOB_QUEUED, JOB_RUNNING)}
+            unfinished = [tuple(entry) for entry in unfinished.values()
+                          if entry[0].get("parent") not in unfinished]
+            self._rewrite([{"op": "submit", "job": record} for record, _, _ in unfinished])
+            self._live = {record["id"]: [record, JOB_QUEUED, 0] for record, _, _ in unfinished}
+        return unfinished
+
+ENGINE_WORKER_FLAG = "--engine-worker"
+
+def engine_available():
+    """Whether the yt_dlp module can be imported by engine workers"""
+    import importlib.util
+    try:
+        return importlib.util.find_spec("yt_dlp") is not None
+    except (ImportError, ValueError):
+        return False
+
+def program_command(*args):
+    """Command line that starts this program again with args"""
+    if getattr(sys, 'frozen', False):
+        return [sys.executable, *args]
+    return [sys.executable, os.path.abspath(__file__), *args]
+
+def engine_worker_command():
+    return program_command(ENGINE_WORKER_FLAG)
+
+def run_engine_worker():
+    """Entry point of a long-lived yt-dlp engine process.
+
+    Reads one JSON job per stdin line, {"argv": [...]} with the same options
+    build_command produces, and runs it through yt_dlp.main in this process so
+    interpreter start-up and extractor imports are paid once. Everything yt-dlp
+    prints is framed as {"out": text} lines on stdout, followed by {"exit": code}.
+    """
+    import yt_dlp
+
+    stdin = sys.__stdin__ if sys.__stdin__ else os.fdopen(0, "r", encoding="utf-8")
+    channel = sys.__stdout__.buffer if sys.__stdout__ else os.fdopen(1, "wb")
+    channel_lock = threading.Lock()
+
+    def send(message):
+        data = (json.dumps(message) + "\n").encode("utf-8")
+        with channel_lock:
+            channel.write(data)
+            channel.flush()
+
+    class FrameWriter:
+        """Stands in for stdout/stderr so yt-dlp output reaches the parent"""
+        encoding = "utf-8"
+
+        def write(self, text):
+            if text:
+                send({"out": text})
+            return len(text)
+
+        def flush(self):
+            pass
+
+        def isatty(self):
+            return False
+
+    sys.stdout = sys.stderr = FrameWriter()
+    for line in stdin:
+        try:
+            argv = json.loads(line)["argv"]
+        except (ValueError, KeyError, TypeError):
+            continue
+        try:
+            yt_dlp.main(argv)
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception as e:
+            send({"out": f"ERROR: {e}\n"})
+            code = 1
+        send({"exit": code})
+
+class EngineRun:
+    """One job running in an engine worker, shaped like a Popen for the queue"""
+    output_encoding = "utf-8"
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.returncode = None
+        # read_process_output reads proc.stdout.read1()
+        self.stdout = self
+
+    def read1(self, size=-1):
+        if self.returncode is not None:
+            return b""
+        # Empty bytes mean end of output, only a dead worker or the exit
+        # message return them; stray lines on the worker's stdout are skipped
+        while True:
+            line = self.engine.proc.stdout.readline()
+            if not line:
+                # Worker died or was killed by terminate()
+                self.returncode = -1
+                return b""
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(message, dict):
+                continue
+            if "exit" in message:
+                self.returncode = message["exit"]
+                return b""
+            out = message.get("out")
+            if out:
+                return out.encode("utf-8")
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        while self.returncode is None:
+            self.read1()
+        return self.returncode
+
+    def terminate(self):
+        # A job can't be stopped inside a shared interpreter, the worker goes with it
+        self.engine.kill()
+
+class EngineProcess:
+    """Parent side of one long-lived engine worker"""
+
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            engine_worker_command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            startupinfo=hidden_startupinfo()
+        )
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def start(self, argv):
+        self.proc.stdin.write((json.dumps({"argv": argv}) + "\n").encode("utf-8"))
+        self.proc.stdin.flush()
+        return EngineRun(self)
+
+    def kill(self):
+        try:
+            self.proc.kill()
+        except OSError:
+            pass
+
+class EnginePool:
+    """Keeps idle engine workers around between jobs, one per busy queue worker"""
+
+    def __init__(self):
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def run(self, cmd):
+        """Start cmd (a build_command list) in an idle or new engine worker"""
+        with self._lock:
+            engine = None
+            while self._idle and engine is None:
+                candidate = self._idle.pop()
+                if candidate.alive():
+                    engine = candidate
+        if engine is None:
+            engine = EngineProcess()
+        # cmd[0] is the yt-dlp executable, the engine takes only the options
+        return engine.start(cmd[1:])
+
+    def release(self, run):
+        """Return the worker of a finished run to the pool"""
+        if run.returncode is not None and run.returncode >= 0 and run.engine.alive():
+            with self._lock:
+                self._idle.append(run.engine)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for engine in idle:
+            engine.kill()
+
+OUTPUT_CHUNK_SIZE = 64 * 1024
+OUTPUT_SEPARATOR = re.compile(r"\r\n|\r|\n")
+
+def coalesce_output(events):
+    """Drop progress updates that are immediately overwritten by the next one"""
+    coalesced = []
+    for event in events:
+        if coalesced and coalesced[-1][0] == "progress" and event[0] == "progress":
+            coalesced[-1] = event
+        else:
+            coalesced.append(event)
+    return coalesced
+
+class OutputSplitter:
+    """Incrementally split subprocess bytes into (kind, text) events.
+
+    kind is "line" for finished lines and "progress" for carriage-return
+    updates that should overwrite the previous progress line.
+    """
+
+    def __init__(self, encoding=None):
+        encoding = encoding or locale.getpreferredencoding(False)
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self._tail = ""
+
+    def feed(self, data, final=False):
+        text = self._tail + self._decoder.decode(data, final)
+        # A trailing \r may be the first half of a \r\n split across chunks
+        keep_cr = not final and text.endswith("\r")
+        if keep_cr:
+            text = text[:-1]
+        events = []
+        start = 0
+        for match in OUTPUT_SEPARATOR.finditer(text):
+            # перезаписываем последнюю строку (для прогресса)
+            kind = "progress" if match.group() == "\r" else "line"
+            events.append((kind, text[start:match.start()]))
+            start = match.end()
+        self._tail = text[start:] + ("\r" if keep_cr else "")
+        if final and self._tail:
+            events.append(("line", self._tail))
+            self._tail = ""
+        return coalesce_output(events)
+
+def read_process_output(proc, emit):
+    """Read a binary stdout pipe in large chunks and emit batches of events.
+
+    read1 blocks until data is available and returns b"" only at EOF, so the
+    reader never spins while yt-dlp is quiet.
+    """
+    splitter = OutputSplitter(getattr(proc, "output_encoding", None))
+    while True:
+        try:
+            chunk = proc.stdout.read1(OUTPUT_CHUNK_SIZE)
+        except Exception:
+            chunk = b""
+        if not chunk:
+            break
+        events = splitter.feed(chunk)
+        if events:
+            emit(events)
+    events = splitter.feed(b"", final=True)
+    if events:
+        emit(events)
+    return proc.wait()
+
+# Job phases timed by JobMetrics besides the progress stages
+PHASE_QUEUED = "queued"
+PHASE_EXTRACT = "extract"
+PHASE_CONVERT = "convert"
+# Finished jobs read back for the statistics window
+METRICS_HISTORY = 5000
+
+class JobMetrics:
+    """Phase durations and counters of one job.
+
+    Phases follow each other: queued, extract (metadata and format
+    selection until the first progress line), then the progress stages and
+    convert in the post-processing queue. enter() closes the current phase.
+    """
+
+    def __init__(self):
+        self.phase = PHASE_QUEUED
+        self.phase_started = time.monotonic()
+        self.phases = {}
+        self.started_at = None
+        self.process_started = None
+        self.ttfb = None
+        self.peak_speed = 0
+        self.retries = 0
+
+    def enter(self, phase):
+        now = time.monotonic()
+        if self.phase:
+            self.phases[self.phase] = self.phases.get(self.phase, 0) + now - self.phase_started
+        self.phase = phase
+        self.phase_started = now
+
+    def sample(self, progress):
+        """Update first byte and peak speed from a progress update"""
+        if self.ttfb is None and self.process_started and progress.downloaded_bytes:
+            self.ttfb = time.monotonic() - self.process_started
+        if progress.speed and progress.speed > self.peak_speed:
+            self.peak_speed = progress.speed
+
+def metrics_record(job):
+    """One line of metrics.jsonl for a finished job"""
+    metrics = job.metrics
+    downloaded = job.progress.total_downloaded()
+    download_time = metrics.phases.get(STAGE_DOWNLOAD, 0)
+    return {
+        "job": job.journal_id,
+        "site": cookie_site(urllib.parse.urlsplit(job.url).hostname or ""),
+        "url": job.url,
+        "preset": job.format_choice,
+        "downloader": job.downloader,
+        "proxy": job.proxy or "",
+        "state": job.state,
+        "returncode": job.returncode,
+        "started_at": metrics.started_at,
+        "phases": {phase: round(seconds, 3) for phase, seconds in metrics.phases.items()},
+        "ttfb": round(metrics.ttfb, 3) if metrics.ttfb is not None else None,
+        "bytes": downloaded,
+        "avg_speed": round(downloaded / download_time) if download_time > 0 else None,
+        "peak_speed": metrics.peak_speed or None,
+        "retries": metrics.retries,
+    }
+
+def prometheus_labels(**labels):
+    escape = lambda value: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}"
+
+class MetricsRecorder:
+    """Appends a metrics_record() per finished job to metrics.jsonl and keeps
+    running totals for the Prometheus endpoint"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def record(self, job):
+        record = metrics_record(job)
+        with self._lock:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"Warning: Could not write metrics: {e}")
+            key = (record["site"], record["preset"], record["proxy"])
+            totals = self._totals.setdefault(key, {"states": {}, "bytes": 0, "retries": 0, "phases": {}})
+            totals["states"][record["state"]] = totals["states"].get(record["state"], 0) + 1
+            totals["bytes"] += record["bytes"]
+            totals["retries"] += record["retries"]
+            for phase, seconds in record["phases"].items():
+                totals["phases"][phase] = totals["phases"].get(phase, 0) + seconds
+
+    def history(self, limit=METRICS_HISTORY):
+        """The last limit records of metrics.jsonl"""
+        with self._lock:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    lines = collections.deque(f, maxlen=limit)
+            except OSError:
+                return []
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        return records
+
+    def prometheus_text(self, download_queue=None):
+        lines = [
+            "# HELP kirstgrab_jobs_total Finished jobs by final state.",
+            "# TYPE kirstgrab_jobs_total counter",
+        ]
+        with self._lock:
+            totals = [(key, dict(total, states=dict(total["states"]), phases=dict(total["phases"])))
+                      for key, total in self._totals.items()]
+        for (site, preset, proxy), total in totals:
+            for state, count in total["states"].items():
+                lines.append(f"kirstgrab_jobs_total{prometheus_labels(site=site, preset=preset, proxy=proxy, state=state)} {count}")
+        lines += ["# HELP kirstgrab_downloaded_bytes_total Bytes downloaded by finished jobs.",
+                  "# TYPE kirstgrab_downloaded_bytes_total counter"]
+        for (site, preset, proxy), total in totals:
+            lines.append(f"kirstgrab_downloaded_bytes_total{prometheus_labels(site=site, preset=preset, proxy=proxy)} {total['bytes']}")
+        lines += ["# HELP kirstgrab_retries_total Restarts, re-extractions and proxy failovers.",
+                  "# TYPE kirstgrab_retries_total counter"]
+        for (site, preset, proxy), total in totals:
+            lines.append(f"kirstgrab_retries_total{prometheus_labels(site=site, preset=preset, proxy=proxy)} {total['retries']}")
+        lines += ["# HELP kirstgrab_phase_seconds_total Time finished jobs spent in each phase.",
+                  "# TYPE kirstgrab_phase_seconds_total counter"]
+        for (site, preset, proxy), total in totals:
+            for phase, seconds in total["phases"].items():
+                lines.append(f"kirstgrab_phase_seconds_total{prometheus_labels(site=site, preset=preset, proxy=proxy, phase=phase)} {seconds:.3f}")
+        if download_queue:
+            lines += ["# HELP kirstgrab_queue_jobs Jobs in the queue by state.", "# TYPE kirstgrab_queue_jobs gauge"]
+            for state, count in download_queue.counts().items():
+                lines.append(f"kirstgrab_queue_jobs{prometheus_labels(state=state)} {count}")
+            lines += ["# HELP kirstgrab_download_speed_bytes Combined speed of running downloads.",
+                      "# TYPE kirstgrab_download_speed_bytes gauge",
+                      f"kirstgrab_download_speed_bytes {download_queue.throughput():.0f}"]
+        return "\n".join(lines) + "\n"
+
+class MetricsServer:
+    """Serves MetricsRecorder.prometheus_text() at http://127.0.0.1:<port>/metrics"""
+
+    def __init__(self, download_queue, port):
+        queue_ref = download_queue
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if urllib.parse.urlsplit(self.path).path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = queue_ref.metrics.prometheus_text(queue_ref).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def summarize_metrics(records, field):
+    """Per value of field: jobs, failures, mean speed, first byte and phase times"""
+    groups = {}
+    for record in records:
+        groups.setdefault(record.get(field) or "-", []).append(record)
+    rows = []
+    for value, group in groups.items():
+        mean = lambda values: sum(values) / len(values) if values else None
+        phases = {}
+        for record in group:
+            for phase, seconds in (record.get("phases") or {}).items():
+                phases.setdefault(phase, []).append(seconds)
+        rows.append({
+            field: value,
+            "jobs": len(group),
+            "failed": sum(1 for record in group if record.get("state") == JOB_FAILED),
+            "avg_speed": mean([record["avg_speed"] for record in group if record.get("avg_speed")]),
+            "ttfb": mean([record["ttfb"] for record in group if record.get("ttfb") is not None]),
+            "phases": {phase: mean(values) for phase, values in phases.items()},
+        })
+    rows.sort(key=lambda row: -row["jobs"])
+    return rows
+
+class DownloadQueue:
+    """Job queue that runs yt-dlp downloads on a bounded pool of worker threads.
+
+    The queue knows nothing about Tk: listeners are plain callables invoked
+    from worker threads, on_state(job) whenever a job changes state,
+    on_output(job, events) with batches of (kind, text) output events and
+    on_progress(job) when job.progress was updated from yt-dlp.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, on_state=None, on_output=None, on_progress=None,
+                 info_cache=None, archive=None, journal=None, governor=None, engines=None,
+                 postprocessor=None, proxies=None, cookies=None, metrics=None, prefetcher=None,
+                 max_finished=None, on_removed=None):
+        self.jobs = []
+        # Finished jobs beyond max_finished are dropped, oldest first, and
+        # reported to on_removed; counts() still includes them
+        self.max_finished = max_finished
+        self.on_removed = on_removed
+        self.removed_counts = collections.Counter()
+        self._finished = 0
+        self.metrics = metrics
+        self.prefetcher = prefetcher
+        self.cookies = cookies
+        self.proxies = proxies
+        self.postprocessor = postprocessor
+        self.engines = engines
+        self.governor = governor
+        self.info_cache = info_cache
+        self.archive = archive
+        self.journal = journal
+        self._stopping = False
+        self.on_state = on_state
+        self.on_output = on_output
+        self.on_progress = on_progress
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self._target_workers = 0
+        self._running_workers = 0
+        self.set_workers(workers)
+        if governor:
+            threading.Thread(target=self._rebalance_loop, daemon=True).start()
+
+    def set_workers(self, count):
+        """Resize the worker pool; surplus workers exit after their current job"""
+        with self._lock:
+            self._target_workers = max(1, min(MAX_WORKERS, int(count)))
+            while self._running_workers < self._target_workers:
+                self._running_workers += 1
+                threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, job):
+        if self.journal:
+            self.journal.append({"op": "submit", "job": job.to_record()})
+        with self._lock:
+            self.jobs.append(job)
+        self._notify_state(job)
+        if job.expand_playlist:
+            # Listing runs beside the pool so every worker is free for entries
+            threading.Thread(target=self._expand_playlist, args=(job,), daemon=True).start()
+        else:
+            self._pending.put(job)
+        return job
+
+    def restore(self):
+        """Queue the jobs a previous session left unfinished, returns them"""
+        if not self.journal:
+            return []
+        restored = []
+        for record, state, downloaded in self.journal.load():
+            job = DownloadJob.from_record(record)
+            job.log.append([("line", f"♻ Restored unfinished job ({state}, {format_bytes(downloaded)} downloaded)")])
+            restored.append(self.submit(job))
+        return restored
+
+    def shutdown(self):
+        """Stop running downloads without journaling them as failed.
+
+        yt-dlp leaves .part files behind which the next session continues.
+        """
+        self._stopping = True
+        if self.prefetcher:
+            self.prefetcher.cancel()
+        if self.postprocessor:
+            self.postprocessor.shutdown()
+        with self._lock:
+            jobs = list(self.jobs)
+        for job in jobs:
+            proc = job.proc
+            if proc is not None and proc.poll() is None:
+                try:
+                    proc.terminate()
+                except OSError:
+                    pass
+        if self.engines:
+            self.engines.close()
+        if self.proxies:
+            self.proxies.close()
+
+    def snapshot(self):
+        """Copy of the job list, safe to iterate from other threads"""
+        with self._lock:
+            return list(self.jobs)
+
+    def counts(self):
+        """Number of jobs in each state"""
+        jobs = self.snapshot()
+        counts = {state: self.removed_counts[state] for state in JOB_STATES}
+        for job in jobs:
+            counts[job.state] += 1
+        return counts
+
+    def throughput(self):
+        """Combined download speed of all running jobs in bytes per second"""
+        with self._lock:
+            jobs = list(self.jobs)
+        return sum(job.progress.speed or 0 for job in jobs if job.state == JOB_RUNNING)
+
+    def _notify_state(self, job):
+        if self.journal and not self._stopping:
+            self.journal.append({"op": "state", "id": job.journal_id, "state": job.state})
+        if self.on_state:
+            self.on_state(job)
+
+    def _emit(self, job, events):
+        job.log.append(events)
+        if self.on_output:
+            self.on_output(job, events)
+
+    def _handle_output(self, job, events):
+        """Route JSON progress lines into job.progress, pass the rest through"""
+        output = []
+        updated = False
+        for kind, text in events:
+            data = parse_progress_line(text)
+            if data is None:
+                if job.proxy and is_proxy_error(text):
+                    job.proxy_failed = True
+                output.append((kind, text))
+                continue
+            stage = job.progress.stage
+            job.progress.update(data)
+            job.metrics.sample(job.progress)
+            if job.progress.stage != job.metrics.phase:
+                job.metrics.enter(job.progress.stage)
+            updated = True
+            if job.progress.stage != stage:
+                output.append(("line", f"[{job.progress.stage}]"))
+        if output:
+            self._emit(job, output)
+        if updated and self.journal and time.monotonic() - job.journaled_at > JOURNAL_PROGRESS_INTERVAL:
+            job.journaled_at = time.monotonic()
+            self.journal.append({"op": "progress", "id": job.journal_id,
+                                 "bytes": job.progress.total_downloaded()}, sync=False)
+        if updated and self.on_progress:
+            self.on_progress(job)
+
+    def _worker(self):
+        while True:
+            if self._stopping:
+                return
+            with self._lock:
+                if self._running_workers > self._target_workers:
+                    self._running_workers -= 1
+                    return
+            try:
+                job = self._pending.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self._run_job(job)
+            except Exception as e:
+                self._emit(job, [("line", f"❌ Ошибка: {e}")])
+                self._finish(job, JOB_FAILED)
+
+    def _run_job(self, job):
+        job.state = JOB_RUNNING
+        job.metrics.started_at = time.time()
+        job.metrics.enter(PHASE_EXTRACT)
+        self._notify_state(job)
+        emit_line = lambda text: self._emit(job, [("line", text)])
+
+        if self.archive:
+            archived = self.archive.find(job.url, job.format_choice, job.video_key)
+            if archived:
+                emit_line(f"⏭ Already downloaded: {archived}")
+                self._finish(job, JOB_SKIPPED)
+                return
+
+        cache = self.info_cache
+        if self.prefetcher and self.prefetcher.claim(job.url, job.use_proxy):
+            emit_line("Metadata was prefetched when the URL was pasted")
+        info_json = cache.lookup(job.url) if cache else None
+        if info_json:
+            emit_line(f"Using cached metadata: {info_json}")
+        fd, files_report = tempfile.mkstemp(prefix=f"kirstgrab_job{job.id}_", suffix=".jsonl")
+        os.close(fd)
+        staging_dir = None
+        if self.postprocessor and job.format_choice in DEFERRED_POSTPROCESSING and find_ffmpeg():
+            # Named after the journal id so a resumed job finds its files again
+            staging_dir = app_data_dir("staging", job.journal_id)
+        extracted = False
+        retried = False
+        handed_over = False
+        tried_proxies = []
+        try:
+            while True:
+                extracted = extracted or not info_json
+                code = self._run_yt_dlp(job, info_json, files_report, staging_dir, tried_proxies)
+                if job.restart_requested and not self._stopping:
+                    # Stopped by the governor, continue the .part file with the new limit
+                    job.restart_requested = False
+                    job.metrics.retries += 1
+                    job.resume = True
+                    info_json = cache.lookup(job.url) if cache else None
+                    continue
+                if code not in (0, None) and info_json and not retried:
+                    # Cached format URLs may have expired, retry with a fresh extraction
+                    emit_line("Cached metadata failed, extracting again...")
+                    cache.invalidate(job.url)
+                    job.progress = JobProgress()
+                    info_json = None
+                    retried = True
+                    job.metrics.retries += 1
+                    continue
+                if (code not in (0, None) and job.proxy and job.proxy_failed and not self._stopping
+                        and len(tried_proxies) + 1 < min(PROXY_FAILOVER_ATTEMPTS, len(self.proxies.proxies))):
+                    # Fail over, the pool now ranks this proxy last for the host
+                    tried_proxies.append(job.proxy)
+                    job.metrics.retries += 1
+                    emit_line(f"Proxy {job.proxy} failed, retrying through another proxy...")
+                    job.resume = True
+                    continue
+                break
+            if cache and extracted:
+                cache.commit(job.url)
+            if code == 0 and staging_dir:
+                handed_over = self._hand_over(job, self._read_files_report(job, files_report), staging_dir)
+                if not handed_over:
+                    code = 1
+            elif code == 0 and self.archive:
+                self._archive_entries(job, self._read_files_report(job, files_report))
+        finally:
+            try:
+                os.remove(files_report)
+            except OSError:
+                pass
+        if handed_over:
+            return
+        if code is None:
+            self._finish(job, JOB_FAILED)
+            return
+
+        job.returncode = code
+        emit_line("✅ COMPLETED!" if code == 0 else f"❌ ERROR (code {code})")
+        self._finish(job, JOB_DONE if code == 0 else JOB_FAILED)
+
+    def _read_files_report(self, job, files_report):
+        """Entries yt-dlp printed for every finished file"""
+        try:
+            with open(files_report, "r", encoding="utf-8") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError) as e:
+            self._emit(job, [("line", f"Warning: Could not read finished files: {e}")])
+            return []
+
+    def _hand_over(self, job, entries, staging_dir):
+        """Queue the conversion of the staged files, the worker moves on to the next download"""
+        spec = DEFERRED_POSTPROCESSING[job.format_choice]
+        steps = [(entry, spec) for entry in entries if entry.get("filepath") and os.path.exists(entry["filepath"])]
+        if not steps:
+            self._emit(job, [("line", "❌ yt-dlp did not report any downloaded file")])
+            return False
+
+        def on_done(ok):
+            job.postprocessing = False
+            if ok:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                if self.archive:
+                    self._archive_entries(job, entries)
+            elif self._stopping:
+                # Staged files stay, the resumed job converts them again
+                return
+            job.returncode = 0 if ok else 1
+            self._emit(job, [("line", "✅ COMPLETED!" if ok else "❌ ERROR (post-processing)")])
+            self._finish(job, JOB_DONE if ok else JOB_FAILED)
+
+        job.postprocessing = True
+        job.metrics.enter(PHASE_CONVERT)
+        job.progress.stage = STAGE_POSTPROCESS
+        job.progress.speed = None
+        job.progress.eta = None
+        self._emit(job, [("line", f"[{STAGE_POSTPROCESS}] queued {len(steps)} conversion(s)")])
+        if self.on_progress:
+            self.on_progress(job)
+        self.postprocessor.submit(PostTask(job, steps, lambda text: self._emit(job, [("line", text)]), on_done))
+        return True
+
+    def _archive_entries(self, job, entries):
+        """Record every file yt-dlp reported as finished in the archive index"""
+        emit_line = lambda text: self._emit(job, [("line", text)])
+        for entry in entries:
+            path = entry.get("filepath")
+            if not path or not entry.get("extractor_key") or not os.path.exists(path):
+                continue
+            # A single video is archived under the URL the user gave as well
+            url = job.url if len(entries) == 1 else entry.get("webpage_url") or job.url
+            try:
+                self.archive.record(url, job.format_choice, (entry["extractor_key"], str(entry["id"])),
+                                    path, log=emit_line)
+            except (OSError, sqlite3.Error) as e:
+                emit_line(f"Warning: Could not archive {path}: {e}")
+
+    def _run_yt_dlp(self, job, info_json, files_report=None, staging_dir=None, tried_proxies=()):
+        """Run one yt-dlp process for job, returns its exit code or None"""
+        if self._stopping:
+            return None
+        emit_line = lambda text: self._emit(job, [("line", text)])
+        job.proxy = None
+        if job.use_proxy and self.proxies:
+            host = urllib.parse.urlsplit(job.url).hostname or ""
+            job.proxy = self.proxies.acquire(host, exclude=tried_proxies)
+            job.proxy_failed = False
+            if job.proxy is None:
+                return None
+            emit_line(f"Proxy: {job.proxy}")
+            started = time.monotonic()
+            downloaded = job.progress.total_downloaded()
+            code = None
+            try:
+                code = self._run_process(job, info_json, files_report, staging_dir)
+            finally:
+                elapsed = time.monotonic() - started
+                fetched = job.progress.total_downloaded() - downloaded
+                # Only network and proxy errors count against the proxy, not a 404
+                self.proxies.release(job.proxy, host, not job.proxy_failed,
+                                     fetched / elapsed if fetched > 0 and elapsed > 1 else None)
+            return code
+        return self._run_process(job, info_json, files_report, staging_dir)
+
+    def _run_process(self, job, info_json, files_report=None, staging_dir=None):
+        emit_line = lambda text: self._emit(job, [("line", text)])
+        cookies_file = None
+        # The cookie file holds session secrets, it goes away however the job ends
+        try:
+            cookies_file = self.cookies.job_file(job.url, job.id) if self.cookies else None
+            write_info_json = self.info_cache.path_for(job.url) if self.info_cache and not info_json else None
+            if self.governor:
+                job.rate_limit = self.governor.limit_for(self._running_downloads(extra=job))
+                job.rate_limit_since = time.monotonic()
+                if job.rate_limit:
+                    emit_line(f"Bandwidth limit: {format_bytes(job.rate_limit)}/s")
+            cmd = build_command(job.url, job.download_path, job.format_choice, job.use_proxy, log=emit_line,
+                                info_json=info_json, write_info_json=write_info_json, files_report=files_report,
+                                resume=job.resume, downloader=job.downloader, rate_limit=job.rate_limit,
+                                staging_dir=staging_dir, proxy=job.proxy, cookies_file=cookies_file)
+            if job.uses_cookies and not cookies_file:
+                emit_line("Warning: this job used cookies, paste them again if the site needs a login")
+            emit_line(f"Format: {job.format_choice}")
+            emit_line(f"Command: {' '.join(cmd)}")
+            return self._run_command(job, cmd)
+        finally:
+            if cookies_file:
+                try:
+                    os.remove(cookies_file)
+                except OSError:
+                    pass
+
+    def _run_command(self, job, cmd):
+        emit_line = lambda text: self._emit(job, [("line", text)])
+        job.proc = None
+        if self.engines:
+            try:
+                job.proc = self.engines.run(cmd)
+                emit_line("Engine: persistent yt-dlp worker")
+            except Exception as e:
+                # Fall back to spawning yt-dlp.exe for this job
+                emit_line(f"Warning: engine worker unavailable ({e}), starting yt-dlp")
+        if job.proc is None:
+            try:
+                job.proc = subprocess.Popen(
+                    cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    startupinfo=hidden_startupinfo()
+                )
+            except Exception as e:
+                emit_line(f"❌ Не удалось запустить yt-dlp: {e}")
+                return None
+
+        emit_line(f"Загрузка: {job.url}")
+        if job.metrics.process_started is None:
+            job.metrics.process_started = time.monotonic()
+        proc = job.proc
+        code = read_process_output(proc, lambda events: self._handle_output(job, events))
+        if isinstance(proc, EngineRun):
+            self.engines.release(proc)
+        return code
+
+    def _running_downloads(self, extra=None):
+        """Running download jobs (playlist listings don't use the budget)"""
+        with self._lock:
+            jobs = [job for job in self.jobs
+                    if job.state == JOB_RUNNING and not job.expand_playlist and not job.postprocessing
+                    and job is not extra]
+        return len(jobs) + (1 if extra is not None else 0)
+
+    def _rebalance_loop(self):
+        """Restart downloads whose rate limit no longer matches their fair share"""
+        while not self._stopping:
+            time.sleep(REBALANCE_INTERVAL)
+            target = self.governor.limit_for(self._running_downloads())
+            with self._lock:
+                jobs = [job for job in self.jobs
+                        if job.state == JOB_RUNNING and not job.expand_playlist and not job.postprocessing]
+            for job in jobs:
+                proc = job.proc
+                if (proc is None or job.restart_requested or job.progress.stage != STAGE_DOWNLOAD
+                        or time.monotonic() - job.rate_limit_since < REBALANCE_MIN_RUNTIME
+                        or not self.governor.needs_restart(job.rate_limit, target)):
+                    continue
+                describe = lambda limit: f"{format_bytes(limit)}/s" if limit else "unlimited"
+                self._emit(job, [("line", f"Re-balancing bandwidth: {describe(job.rate_limit)} → {describe(target)}")])
+                job.restart_requested = True
+                try:
+                    proc.terminate()
+                except OSError:
+                    pass
+
+    def _expand_playlist(self, job):
+        """List a playlist lazily and queue a download job per entry as it arrives"""
+        job.state = JOB_RUNNING
+        job.progress.stage = STAGE_LISTING
+        job.metrics.started_at = time.time()
+        job.metrics.enter(STAGE_LISTING)
+        self._notify_state(job)
+        emit_line = lambda text: self._emit(job, [("line", text)])
+        if self.prefetcher:
+            # Entries are extracted by their own jobs, the single-video prefetch is of no use
+            self.prefetcher.cancel(job.url)
+
+        proxy = self.proxies.pick(urllib.parse.urlsplit(job.url).hostname or "") if job.use_proxy and self.proxies else None
+        cookies_file = self.cookies.job_file(job.url, job.id) if self.cookies else None
+        cmd = build_expand_command(job.url, job.use_proxy, proxy, cookies_file)
+        emit_line(f"Command: {' '.join(cmd)}")
+        try:
+            job.proc = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                startupinfo=hidden_startupinfo()
+            )
+        except Exception as e:
+            emit_line(f"❌ Не удалось запустить yt-dlp: {e}")
+            self._finish(job, JOB_FAILED)
+            return
+
+        def handle_listing(events):
+            output = []
+            for kind, text in events:
+                entry = parse_playlist_entry(text)
+                if entry is None:
+                    output.append((kind, text))
+                    continue
+                url, title, video_key = entry
+                child = DownloadJob(url, job.download_path, job.format_choice, job.use_proxy,
+                                    label=title, video_key=video_key, parent_id=job.journal_id,
+                                    downloader=job.downloader)
+                child.uses_cookies = job.uses_cookies
+                self.submit(child)
+                job.progress.entries += 1
+            if output:
+                self._emit(job, output)
+            if self.on_progress:
+                self.on_progress(job)
+
+        code = read_process_output(job.proc, handle_listing)
+        if cookies_file:
+            try:
+                os.remove(cookies_file)
+            except OSError:
+                pass
+        job.returncode = code
+        emit_line(f"Found {job.progress.entries} entries")
+        # --ignore-errors exits non-zero when single entries failed to list
+        self._finish(job, JOB_DONE if code == 0 or job.progress.entries else JOB_FAILED)
+
+    def _finish(self, job, state):
+        job.state = state
+        job.proc = None
+        job.log.flush()
+        job.metrics.enter(None)
+        if self.metrics:
+            self.metrics.record(job)
+        self._notify_state(job)
+        self._prune()
+
+    def _prune(self):
+        """Drop the oldest finished jobs once more than max_finished pile up.
+
+        Jobs are dropped in batches of PRUNE_BATCH so the scan and the
+        listbox rebuild it causes stay rare.
+        """
+        if not self.max_finished:
+            return
+        with self._lock:
+            self._finished += 1
+            if self._finished <= self.max_finished + PRUNE_BATCH:
+                return
+            finished = [job for job in self.jobs if job.state in FINISHED_STATES]
+            removed = finished[:len(finished) - self.max_finished]
+            removed_ids = {job.id for job in removed}
+            self.jobs = [job for job in self.jobs if job.id not in removed_ids]
+            self._finished = len(finished) - len(removed)
+            for job in removed:
+                self.removed_counts[job.state] += 1
+        if removed and self.on_removed:
+            self.on_removed(removed)
+
+# Seconds a job waits for the running prefetch of its URL before extracting itself
+PREFETCH_WAIT = 60
+
+class PrefetchRun:
+    """One metadata extraction started by MetadataPrefetcher"""
+
+    def __init__(self, url, use_proxy):
+        self.url = url
+        self.key = normalize_url(url)
+        self.use_proxy = use_proxy
+        self.proc = None
+        self.cancelled = False
+        self.ok = False
+        # The run extracted the cache entry itself rather than finding it there
+        self.wrote = False
+        self.done = threading.Event()
+
+class MetadataPrefetcher:
+    """Extracts the metadata of a pasted URL into the InfoCache before its job exists.
+
+    While the user picks a folder, yt-dlp already resolves the page and the
+    formats; the job then starts from the cached info JSON. Only the latest
+    URL is prefetched, starting another one or cancel() stops the running
+    extraction. With engine workers the prefetch also leaves a warm worker
+    behind for the download.
+    """
+
+    def __init__(self, info_cache, engines=None, proxies=None, cookies=None):
+        self.info_cache = info_cache
+        self.engines = engines
+        self.proxies = proxies
+        self.cookies = cookies
+        self._lock = threading.Lock()
+        self._current = None
+
+    def prefetch(self, url, use_proxy=False):
+        """Start extracting url unless it is already being prefetched"""
+        run = PrefetchRun(url, use_proxy)
+        with self._lock:
+            current = self._current
+            if current and current.key == run.key and current.use_proxy == use_proxy and not current.cancelled:
+                return
+            self._current = run
+        if current:
+            self._cancel(current)
+        threading.Thread(target=self._run, args=(run,), daemon=True).start()
+
+    def cancel(self, url=None):
+        """Stop the running prefetch, only if it is for url when given"""
+        with self._lock:
+            run = self._current
+            if run is None or (url is not None and run.key != normalize_url(url)):
+                return
+            self._current = None
+        self._cancel(run)
+
+    def claim(self, url, use_proxy):
+        """Wait for the prefetch of url, True when it left fresh metadata in the cache.
+
+        Metadata extracted over the other network path (proxy or direct) is
+        dropped, format URLs of some sites are bound to the client address.
+        """
+        key = normalize_url(url)
+        with self._lock:
+            run = self._current
+            if run is None or run.key != key:
+                return False
+            self._current = None
+        if run.use_proxy != use_proxy or not run.done.wait(PREFETCH_WAIT):
+            self._cancel(run)
+            run.done.wait()
+            if run.wrote:
+                # Only what this run extracted, an entry cached before stays
+                self.info_cache.invalidate(url)
+            return False
+        return run.ok
+
+    def _cancel(self, run):
+        with self._lock:
+            run.cancelled = True
+            proc = run.proc
+        if proc is not None and proc.poll() is None:
+            try:
+                proc.terminate()
+            except OSError:
+                pass
+
+    def _run(self, run):
+        cookies_file = None
+        try:
+            if self.info_cache.lookup(run.url):
+                run.ok = True
+                return
+            host = urllib.parse.urlsplit(run.url).hostname or ""
+            proxy = self.proxies.pick(host) if run.use_proxy and self.proxies else None
+            cookies_file = self.cookies.job_file(run.url, "prefetch") if self.cookies else None
+            cmd = build_prefetch_command(run.url, self.info_cache.path_for(run.url), run.use_proxy, proxy,
+                                         cookies_file)
+            with self._lock:
+                if run.cancelled:
+                    return
+                run.proc = self._start(cmd)
+            code = read_process_output(run.proc, lambda events: None)
+            if isinstance(run.proc, EngineRun):
+                self.engines.release(run.proc)
+            if code == 0 and not run.cancelled:
+                self.info_cache.commit(run.url)
+                run.wrote = True
+                run.ok = self.info_cache.lookup(run.url) is not None
+            else:
+                self.info_cache.invalidate(run.url)
+        except Exception as e:
+            print(f"Warning: Could not prefetch {run.url}: {e}")
+        finally:
+            if cookies_file:
+                try:
+                    os.remove(cookies_file)
+                except OSError:
+                    pass
+            run.done.set()
+
+    def _start(self, cmd):
+        if self.engines:
+            try:
+                return self.engines.run(cmd)
+            except Exception:
+                pass
+        return subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                startupinfo=hidden_startupinfo())
+
+# Lines shown in the output pane, the rest stays in the job's ring buffer
+PANE_MAX_LINES = 200
+
+selected_job = None
+
+def show_job(job):
+    """Show the log tail of the given job in the output pane"""
+    global selected_job
+    selected_job = job
+    output_text.render(job.log.tail(PANE_MAX_LINES))
+    draw_job_progress()
+
+def draw_job_progress():
+    """Draw the progress bar of the selected job"""
+    progress_canvas.delete("all")
+    if selected_job is None:
+        return
+    width = int(progress_canvas.cget("width"))
+    height = int(progress_canvas.cget("height"))
+    progress = selected_job.progress
+    percent = progress.percent()
+    if selected_job.state == JOB_DONE or progress.stage in (STAGE_MERGE, STAGE_POSTPROCESS):
+        percent = 100.0
+    colors = {JOB_FAILED: "#e74c3c", JOB_DONE: "#2ecc71"}
+    if percent:
+        progress_canvas.create_rectangle(0, 0, int(width * percent / 100), height,
+                                         fill=colors.get(selected_job.state, "#3498db"), width=0)
+    text = progress.summary() if selected_job.state == JOB_RUNNING else selected_job.state
+    progress_canvas.create_text(width // 2, height // 2, text=text, fill="white", font=("Arial", 8))
+
+JOB_COLORS = {JOB_QUEUED: "#bdc3c7", JOB_RUNNING: "#f39c12", JOB_DONE: "#2ecc71", JOB_FAILED: "#e74c3c",
+              JOB_SKIPPED: "#95a5a6"}
+# Listbox rows: job id -> row index and row index -> job
+job_rows = {}
+row_jobs = []
+
+def refresh_job_row(job):
+    index = job_rows.get(job.id)
+    if index is None:
+        # A job gets its row with its first state callback
+        index = job_rows[job.id] = len(row_jobs)
+        row_jobs.append(job)
+        jobs_listbox.insert(tk.END, job.title())
+    else:
+        selected = jobs_listbox.curselection()
+        jobs_listbox.delete(index)
+        jobs_listbox.insert(index, job.title())
+        if selected and selected[0] == index:
+            jobs_listbox.selection_set(index)
+    jobs_listbox.itemconfig(index, fg=JOB_COLORS[job.state])
+    update_queue_status()
+
+def rebuild_job_rows():
+    """Redraw the whole list after the queue dropped old finished jobs"""
+    global row_jobs
+    row_jobs = download_queue.snapshot()
+    job_rows.clear()
+    job_rows.update((job.id, index) for index, job in enumerate(row_jobs))
+    jobs_listbox.delete(0, tk.END)
+    if row_jobs:
+        jobs_listbox.insert(tk.END, *[job.title() for job in row_jobs])
+    for index, job in enumerate(row_jobs):
+        jobs_listbox.itemconfig(index, fg=JOB_COLORS[job.state])
+    if selected_job is not None and selected_job.id in job_rows:
+        jobs_listbox.selection_set(job_rows[selected_job.id])
+    update_queue_status()
+
+def update_queue_status():
+    counts = download_queue.counts()
+    status = " · ".join(f"{counts[state]} {state}" for state in JOB_STATES if counts[state]) or "idle"
+    if counts[JOB_RUNNING]:
+        status += f" · ↓ {format_bytes(download_queue.throughput())}/s"
+        budget = download_queue.governor.budget()
+        if budget:
+            status += f" of {format_bytes(budget)}/s"
+    queue_status_label.config(text=status)
+
+# Worker threads never touch Tk; they post here and the UI drains on a fixed frame
+UI_FRAME_MS = 50
+UI_FRAME_BUDGET = 0.015
+ui_events = queue.Queue()
+
+# Blocking work started from Tk callbacks: files, network, external programs
+BACKGROUND_WORKERS = 4
+background_executor = concurrent.futures.ThreadPoolExecutor(BACKGROUND_WORKERS, thread_name_prefix="kirstgrab-io")
+# A call made on the Tk thread through the bridge that takes longer is logged
+UI_CALLBACK_BUDGET = 0.005
+# The Tk loop missing its frame by this long is logged as a stall
+UI_STALL_THRESHOLD = 0.25
+UI_LOG_MAX_BYTES = 1024 * 1024
+
+def call_in_ui(func, *args):
+    """Run func(*args) on the Tk thread at the next frame, safe from any thread"""
+    ui_events.put(("call", None, (func, args)))
+
+def run_in_background(func, *args, on_done=None, on_error=None):
+    """Run func(*args) on the background executor.
+
+    on_done(result) or on_error(exception) is then called on the Tk thread,
+    failures without on_error are printed.
+    """
+    def task():
+        try:
+            result = func(*args)
+        except Exception as e:
+            if on_error:
+                call_in_ui(on_error, e)
+            else:
+                print(f"Warning: {getattr(func, '__name__', func)} failed: {e}")
+            return
+        if on_done:
+            call_in_ui(on_done, result)
+
+    return background_executor.submit(task)
+
+def open_ui_log():
+    """Logger of UI stalls and slow callbacks, written to logs/ui.log"""
+    logger = logging.getLogger("kirstgrab.ui")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    try:
+        handler = logging.handlers.RotatingFileHandler(
+            os.path.join(app_data_dir("logs"), "ui.log"), maxBytes=UI_LOG_MAX_BYTES, backupCount=1,
+            encoding="utf-8", delay=True)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        logger.addHandler(handler)
+    except Exception as e:
+        print(f"Warning: Could not open UI log file: {e}")
+        logger.addHandler(logging.NullHandler())
+    return logger
+
+class UiLagMonitor:
+    """Watches the Tk loop from a helper thread and logs stalls.
+
+    drain_ui_events calls beat() every frame. When a beat is late by more
+    than UI_STALL_THRESHOLD the stack of the Tk thread is logged, showing
+    what blocks it, and the stall's full length once the loop is back.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.thread = threading.current_thread()
+        self.last_beat = time.monotonic()
+        self.stalled = False
+        self.stalls = 0
+        self._lock = threading.Lock()
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def beat(self):
+        now = time.monotonic()
+        with self._lock:
+            if self.stalled:
+                self.stalled = False
+                self.logger.warning("UI thread was blocked for %.0f ms", (now - self.last_beat) * 1000)
+            self.last_beat = now
+
+    def timed_call(self, func, args):
+        started = time.perf_counter()
+        try:
+            func(*args)
+        except Exception:
+            self.logger.exception("UI callback %s failed", getattr(func, "__qualname__", func))
+            traceback.print_exc()
+        elapsed = time.perf_counter() - started
+        if elapsed > UI_CALLBACK_BUDGET:
+            self.logger.warning("Slow UI callback %s: %.1f ms", getattr(func, "__qualname__", func), elapsed * 1000)
+
+    def _watch(self):
+        while True:
+            time.sleep(UI_STALL_THRESHOLD / 2)
+            with self._lock:
+                late = time.monotonic() - self.last_beat - UI_FRAME_MS / 1000
+                if self.stalled or late < UI_STALL_THRESHOLD:
+                    continue
+                self.stalled = True
+                self.stalls += 1
+            frame = sys._current_frames().get(self.thread.ident)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            self.logger.warning("UI thread blocked for %.0f ms so far in:\n%s", late * 1000, stack)
+
+ui_monitor = None
+
+# Set when the local job API is enabled, it sees the same events as the UI
+job_server = None
+
+def on_job_state(job):
+    ui_events.put(("state", job, None))
+    if job_server:
+        job_server.on_state(job)
+
+def on_job_output(job, events):
+    ui_events.put(("output", job, events))
+
+def on_job_progress(job):
+    ui_events.put(("progress", job, None))
+    if job_server:
+        job_server.on_progress(job)
+
+def on_jobs_removed(jobs):
+    ui_events.put(("removed", None, jobs))
+
+def drain_ui_events():
+    """Apply queued worker events, coalesced per job, at most once per frame"""
+    deadline = time.perf_counter() + UI_FRAME_BUDGET
+    updated_logs = set()
+    states = {}
+    removed = False
+    while time.perf_counter() < deadline:
+        try:
+            kind, job, payload = ui_events.get_nowait()
+        except queue.Empty:
+            break
+        if kind == "output":
+            updated_logs.add(job.id)
+        elif kind == "call":
+            # Its own Tk callback, a dialog it opens keeps the frames running
+            root.after_idle(ui_monitor.timed_call, *payload)
+        elif kind == "removed":
+            removed = True
+            for job in payload:
+                states.pop(job.id, None)
+        else:
+            states[job.id] = job
+    # Output is already in the jobs' ring buffers, only the selected one is drawn
+    if selected_job is not None and selected_job.id in updated_logs:
+        output_text.render(selected_job.log.tail(PANE_MAX_LINES))
+    if removed:
+        rebuild_job_rows()
+    for job in states.values():
+        refresh_job_row(job)
+    if selected_job is not None and selected_job.id in states:
+        draw_job_progress()
+    ui_monitor.beat()
+    root.after(UI_FRAME_MS, drain_ui_events)
+
+def on_job_selected(event):
+    selection = jobs_listbox.curselection()
+    if selection:
+        show_job(row_jobs[selection[0]])
+
+def on_workers_changed():
+    try:
+        download_queue.set_workers(int(workers_var.get()))
+    except (ValueError, tk.TclError):
+        pass
+
+def start_download(url, download_path, format_choice):
+    """Queue a download and show its output pane"""
+    job = DownloadJob(url, download_path, format_choice, proxy_var.get(), expand_playlist=playlist_var.get(),
+                      downloader=downloader_var.get())
+
+    def submit():
+        # The journal fsyncs every submit, keep it off the Tk thread
+        job.uses_cookies = cookie_store.covers(url)
+        download_queue.submit(job)
+
+    def show(_):
+        refresh_job_row(job)
+        show_job(job)
+        index = job_rows[job.id]
+        jobs_listbox.selection_clear(0, tk.END)
+        jobs_listbox.selection_set(index)
+        jobs_listbox.see(index)
+
+    run_in_background(submit, on_done=show)
+    return job
+
+def on_download_clicked():
+    url = entry.get().strip()
+    if not url:
+        messagebox.showerror("Ошибка", "Введите URL видео!")
+        return
+    download_path = filedialog.askdirectory()
+    if not download_path:
+        return
+    start_download(url, download_path, format_var.get())
+
+STARTUP_PROFILE_FLAG = "--startup-profile"
+# Closes the window right after the first paint, used to time the start-up
+EXIT_AFTER_PAINT_FLAG = "--exit-after-paint"
+# The update check waits until the window is up and idle
+UPDATE_CHECK_DELAY_MS = 3000
+
+class StartupProfile:
+    """Durations of named start-up phases, measured from process start"""
+
+    def __init__(self, started):
+        self.started = started
+        self.last = started
+        self.phases = []
+
+    def mark(self, name):
+        """Close the phase that ran since the previous mark"""
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self):
+        lines = [f"{name:<28}{duration * 1000:8.1f} ms" for name, duration in self.phases]
+        lines.append(f"{'total':<28}{(self.last - self.started) * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"phases": [{"name": name, "ms": round(duration * 1000, 1)}
+                                  for name, duration in self.phases],
+                       "total_ms": round((self.last - self.started) * 1000, 1)}, f, indent=2)
+
+def startup_cache_path():
+    return os.path.join(app_data_dir("cache"), "startup.json")
+
+def load_startup_cache():
+    """Results of expensive start-up steps, keyed by the source file signature"""
+    try:
+        with open(startup_cache_path(), "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_startup_cache(cache):
+    try:
+        with open(startup_cache_path(), "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+    except OSError as e:
+        print(f"Warning: Could not write start-up cache: {e}")
+
+def file_signature(path):
+    st = os.stat(path)
+    return f"{st.st_size}:{int(st.st_mtime)}"
+
+def scale_background(source, target, size):
+    """Resize the background once with Pillow and store it as PNG"""
+    pil = load_pil()
+    if not pil:
+        return False
+    Image, _ = pil
+    resized = Image.open(source).resize(size, Image.Resampling.LANCZOS)
+    temp_path = target + ".tmp"
+    resized.save(temp_path, format="PNG")
+    os.replace(temp_path, target)
+    return True
+
+def create_download_queue(workers, on_state=None, on_output=None, on_progress=None, journal=None,
+                          max_finished=None, on_removed=None):
+    """DownloadQueue wired to the shared caches, archive, governor and engines"""
+    info_cache = InfoCache(app_data_dir("info_cache"))
+    engines = EnginePool() if settings.get("engine") == "auto" and engine_available() else None
+    proxies = ProxyPool(settings)
+    return DownloadQueue(workers, on_state=on_state, on_output=on_output, on_progress=on_progress,
+                         info_cache=info_cache,
+                         archive=ArchiveIndex(os.path.join(app_data_dir(), "archive.db")),
+                         journal=journal,
+                         governor=BandwidthGovernor(settings),
+                         engines=engines,
+                         postprocessor=PostProcessQueue(),
+                         proxies=proxies,
+                         cookies=cookie_store,
+                         metrics=MetricsRecorder(os.path.join(app_data_dir("logs"), "metrics.jsonl")),
+                         prefetcher=MetadataPrefetcher(info_cache, engines, proxies, cookie_store),
+                         max_finished=max_finished, on_removed=on_removed)
+
+def start_metrics_server(download_queue):
+    """Prometheus endpoint when metrics_port is set, None otherwise"""
+    if not settings.get("metrics_port"):
+        return None
+    try:
+        return MetricsServer(download_queue, int(settings["metrics_port"]))
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not start the metrics endpoint: {e}")
+        return None
+
+def progress_fields(progress):
+    """JSON friendly snapshot of a JobProgress"""
+    return {"stage": progress.stage, "percent": progress.percent(),
+            "downloaded": progress.total_downloaded(), "total": progress.total_bytes,
+            "speed": progress.speed, "eta": progress.eta, "entries": progress.entries}
+
+API_TOKEN_HEADER = "X-KirstGrab-Token"
+API_MAX_BODY = 64 * 1024
+# Seconds between progress events of one job and between keep-alive comments
+API_PROGRESS_INTERVAL = 0.5
+API_KEEPALIVE = 15
+API_SUBSCRIBER_BACKLOG = 1000
+
+def api_token():
+    """Secret API clients must send, created on first use next to the settings"""
+    path = os.path.join(app_data_dir(), "api_token")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            token = f.read().strip()
+        if token:
+            if not sys.platform.startswith("win"):
+                # Tokens written by earlier versions were readable by everyone
+                os.chmod(path, 0o600)
+            return token
+    except OSError:
+        pass
+    token = secrets.token_urlsafe(24)
+    # mkstemp creates the file readable by its owner only
+    fd, temp_path = tempfile.mkstemp(prefix=".api_token-", dir=os.path.dirname(path))
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token)
+    os.replace(temp_path, path)
+    return token
+
+def job_status(job):
+    return {"id": job.id, "journal_id": job.journal_id, "parent": job.parent_id, "url": job.url,
+            "title": job.label, "state": job.state, "preset": job.format_choice,
+            "destination": job.download_path, **progress_fields(job.progress)}
+
+class JobServer:
+    """Localhost HTTP/JSON API that queues jobs on a DownloadQueue.
+
+    POST /jobs queues a download, GET /jobs and GET /jobs/<id> report status
+    and GET /events streams state and progress as server-sent events, for
+    one job with ?job=<id>. Requests must carry the api_token() secret in
+    the X-KirstGrab-Token header; web pages cannot set it cross-origin, so
+    they cannot queue downloads through the user's browser.
+    """
+
+    def __init__(self, download_queue, port, token, default_dir):
+        self.download_queue = download_queue
+        self.token = token
+        self.default_dir = default_dir
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._published_at = {}
+        self._closed = False
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        self._closed = True
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def on_state(self, job):
+        if job.state in FINISHED_STATES:
+            # No more progress, forget when it was last published
+            self._published_at.pop(job.id, None)
+        self.publish({"event": "state", **job_status(job)})
+
+    def on_progress(self, job):
+        now = time.monotonic()
+        if now - self._published_at.get(job.id, 0) < API_PROGRESS_INTERVAL:
+            return
+        self._published_at[job.id] = now
+        self.publish({"event": "progress", "id": job.id, **progress_fields(job.progress)})
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for events in subscribers:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                # A client that stopped reading loses events instead of memory
+                pass
+
+    def find(self, job_id):
+        for job in self.download_queue.snapshot():
+            if str(job.id) == job_id:
+                return job
+        return None
+
+    def submit(self, request):
+        """Queue a job from a POST /jobs body, returns it or raises ValueError"""
+        if not isinstance(request, dict):
+            raise ValueError("expected a JSON object")
+        url = request.get("url")
+        if not isinstance(url, str) or urllib.parse.urlsplit(url).scheme not in ("http", "https"):
+            raise ValueError("url must be an http(s) URL")
+        preset = request.get("preset", FORMAT_PRESETS[0])
+        if preset not in FORMAT_PRESETS:
+            raise ValueError(f"preset must be one of {FORMAT_PRESETS}")
+        downloader = request.get("downloader", BACKEND_AUTO)
+        if downloader not in DOWNLOADER_BACKENDS:
+            raise ValueError(f"downloader must be one of {DOWNLOADER_BACKENDS}")
+        destination = request.get("destination") or self.default_dir
+        if not isinstance(destination, str) or not os.path.isabs(destination):
+            raise ValueError("destination must be an absolute path")
+        os.makedirs(destination, exist_ok=True)
+        job = DownloadJob(url, destination, preset, bool(request.get("proxy")),
+                          expand_playlist=bool(request.get("playlist")), downloader=downloader)
+        job.uses_cookies = cookie_store.covers(url)
+        return self.download_queue.submit(job)
+
+    def stream_events(self, handler, job_id=None):
+        events = queue.Queue(maxsize=API_SUBSCRIBER_BACKLOG)
+        with self._lock:
+            self._subscribers.add(events)
+        try:
+            handler.send_response(200)
+            handler.send_header("Content-Type", "text/event-stream")
+            handler.send_header("Cache-Control", "no-cache")
+            handler.end_headers()
+
+            def send(event):
+                if job_id and str(event["id"]) != job_id:
+                    return
+                handler.wfile.write(f"event: {event['event']}\ndata: {json.dumps(event)}\n\n".encode("utf-8"))
+
+            # Current state first, then changes as they happen. The snapshot
+            # is written directly, a long queue would not fit the backlog;
+            # changes it already shows are sent again, never lost
+            for job in self.download_queue.snapshot():
+                send({"event": "state", **job_status(job)})
+            handler.wfile.flush()
+            while not self._closed:
+                try:
+                    event = events.get(timeout=API_KEEPALIVE)
+                except queue.Empty:
+                    handler.wfile.write(b": keep-alive\n\n")
+                    handler.wfile.flush()
+                    continue
+                send(event)
+                handler.wfile.flush()
+        except OSError:
+            # Client went away
+            pass
+        finally:
+            with self._lock:
+                self._subscribers.discard(events)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status, data):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def authorized(self):
+                if secrets.compare_digest(self.headers.get(API_TOKEN_HEADER, ""), server.token):
+                    return True
+                self.send_json(401, {"error": f"missing or wrong {API_TOKEN_HEADER} header"})
+                return False
+
+            def do_GET(self):
+                if not self.authorized():
+                    return
+                parts = urllib.parse.urlsplit(self.path)
+                path = parts.path.rstrip("/")
+                if path == "/jobs":
+                    self.send_json(200, {"jobs": [job_status(job) for job in server.download_queue.snapshot()]})
+                elif path.startswith("/jobs/"):
+                    job = server.find(path[len("/jobs/"):])
+                    if job:
+                        self.send_json(200, job_status(job))
+                    else:
+                        self.send_json(404, {"error": "no such job"})
+                elif path == "/events":
+                    job_id = urllib.parse.parse_qs(parts.query).get("job", [None])[0]
+                    server.stream_events(self, job_id)
+                else:
+                    self.send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                if not self.authorized():
+                    return
+                if urllib.parse.urlsplit(self.path).path.rstrip("/") != "/jobs":
+                    self.send_json(404, {"error": "not found"})
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                    if length > API_MAX_BODY:
+                        raise ValueError("request body too large")
+                    job = server.submit(json.loads(self.rfile.read(length).decode("utf-8")))
+                except (ValueError, OSError) as e:
+                    self.send_json(400, {"error": str(e)})
+                    return
+                self.send_json(201, job_status(job))
+
+        return Handler
+
+def api_download_dir():
+    return settings.get("api_download_dir") or os.path.join(os.path.expanduser("~"), "Downloads")
+
+SERVE_FLAG = "--serve"
+
+def run_server(argv):
+    """Headless job daemon, runs until interrupted"""
+    parser = argparse.ArgumentParser(prog="KirstGrab", description="Serve the local job API without the window.")
+    parser.add_argument(SERVE_FLAG, dest="serve", action="store_true", required=True)
+    parser.add_argument("--port", type=int, default=settings.get("api_port", 9746))
+    parser.add_argument("--jobs", type=int, default=DEFAULT_WORKERS, help=f"parallel downloads (1-{MAX_WORKERS})")
+    parser.add_argument("--out", default=api_download_dir(), help="default download directory")
+    args = parser.parse_args([arg for arg in argv if arg != STARTUP_PROFILE_FLAG])
+
+    server = None
+    download_queue = create_download_queue(
+        args.jobs,
+        on_state=lambda job: server and server.on_state(job),
+        on_progress=lambda job: server and server.on_progress(job),
+        journal=JobJournal(os.path.join(app_data_dir(), "daemon-journal.jsonl")),
+        max_finished=MAX_FINISHED_JOBS)
+    try:
+        server = JobServer(download_queue, args.port, api_token(), os.path.abspath(args.out))
+    except OSError as e:
+        print(f"Could not listen on port {args.port}: {e}", file=sys.stderr)
+        return 1
+    restored = download_queue.restore()
+    server.start()
+    metrics_server = start_metrics_server(download_queue)
+    print(f"Serving on http://127.0.0.1:{server.port}, token in {os.path.join(app_data_dir(), 'api_token')}"
+          + (f", resumed {len(restored)} job(s)" if restored else ""), flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    server.close()
+    if metrics_server:
+        metrics_server.close()
+    download_queue.shutdown()
+    return 0
+
+BATCH_FLAG = "--batch"
+# Seconds between progress lines of one job in batch mode
+BATCH_PROGRESS_INTERVAL = 1.0
+
+def parse_batch_args(argv):
+    parser = argparse.ArgumentParser(prog="KirstGrab", description="Download a list of URLs without the window.")
+    parser.add_argument(BATCH_FLAG, dest="batch", required=True, metavar="FILE",
+                        help="text file with one URL per line, - reads standard input")
+    parser.add_argument("--preset", default=FORMAT_PRESETS[0], choices=FORMAT_PRESETS)
+    parser.add_argument("--jobs", type=int, default=DEFAULT_WORKERS, help=f"parallel downloads (1-{MAX_WORKERS})")
+    parser.add_argument("--out", default=".", help="download directory")
+    parser.add_argument("--proxy", action="store_true", help="download through the configured proxy")
+    parser.add_argument("--cookies", metavar="FILE", help="Netscape cookies file to use")
+    parser.add_argument("--downloader", default=BACKEND_AUTO, choices=DOWNLOADER_BACKENDS)
+    parser.add_argument("--playlist", action="store_true", help="queue every entry of playlist URLs")
+    return parser.parse_args([arg for arg in argv if arg != STARTUP_PROFILE_FLAG])
+
+def read_batch_urls(path):
+    """URLs of a batch file, blank lines and # comments are skipped"""
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8-sig")
+    try:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def run_batch(argv):
+    """Headless entry point, prints one JSON object per line and returns the exit code"""
+    args = parse_batch_args(argv)
+    try:
+        urls = read_batch_urls(args.batch)
+    except OSError as e:
+        print(f"Could not read {args.batch}: {e}", file=sys.stderr)
+        return 2
+    os.makedirs(args.out, exist_ok=True)
+    if args.cookies:
+        # Merged into the same store the Paste Cookies button fills
+        try:
+            with open(args.cookies, "r", encoding="utf-8", errors="replace") as f:
+                cookies, sites, skipped = cookie_store.import_text(f.read())
+        except OSError as e:
+            print(f"Could not read {args.cookies}: {e}", file=sys.stderr)
+            return 2
+        print(f"Imported {cookies} cookies for {sites} site(s), skipped {skipped} invalid line(s)", file=sys.stderr)
+
+    print_lock = threading.Lock()
+    printed_at = {}
+
+    def emit(event, **fields):
+        with print_lock:
+            print(json.dumps({"event": event, **fields}), flush=True)
+
+    def on_state(job):
+        emit("state", job=job.id, url=job.url, title=job.label, state=job.state, parent=job.parent_id)
+        if job.state == JOB_FAILED:
+            with print_lock:
+                for line in job.log.tail(20):
+                    print(f"[job {job.id}] {line}", file=sys.stderr)
+
+    def on_progress(job):
+        now = time.monotonic()
+        if now - printed_at.get(job.id, 0) < BATCH_PROGRESS_INTERVAL:
+            return
+        printed_at[job.id] = now
+        emit("progress", job=job.id, **progress_fields(job.progress))
+
+    started = time.monotonic()
+    download_queue = create_download_queue(args.jobs, on_state=on_state, on_progress=on_progress)
+    for url in urls:
+        job = DownloadJob(url, os.path.abspath(args.out), args.preset, args.proxy,
+                          expand_playlist=args.playlist, downloader=args.downloader)
+        job.uses_cookies = cookie_store.covers(url)
+        download_queue.submit(job)
+    try:
+        while True:
+            counts = download_queue.counts()
+            if not counts[JOB_QUEUED] and not counts[JOB_RUNNING]:
+                break
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        download_queue.shutdown()
+        emit("interrupted", **download_queue.counts())
+        return 130
+    download_queue.shutdown()
+    counts = download_queue.counts()
+    downloaded = sum(job.progress.total_downloaded() for job in download_queue.jobs)
+    emit("summary", urls=len(urls), jobs=len(download_queue.jobs), done=counts[JOB_DONE],
+         failed=counts[JOB_FAILED], skipped=counts[JOB_SKIPPED], downloaded=downloaded,
+         elapsed=round(time.monotonic() - started, 1))
+    return 1 if counts[JOB_FAILED] else 0
+
+BENCHMARK_FLAG = "--benchmark"
+# A result this much worse than the baseline is reported as a regression
+BENCHMARK_TOLERANCE = 0.2
+# name, path on the synthetic media server, preset, playlist
+BENCHMARK_CASES = [
+    ("progressive", "clip.mp4", "720p (MP4)", False),
+    ("hls", "hls/index.m3u8", "Best Quality (MP4)", False),
+    ("dash", "dash/manifest.mpd", "Best Quality (MP4)", False),
+    # Separate audio stream, like the sites the audio presets are used with
+    ("audio-mp3", "dash/manifest.mpd", "Audio only (MP3)", False),
+    ("playlist", "playlist.html", "480p (MP4)", True),
+]
+BENCHMARK_PLAYLIST_ENTRIES = 3
+# Metrics compared with the baseline and whether a larger value is better
+BENCHMARK_METRICS = {"throughput": True, "ttfb_s": False, "postprocess_s": False, "wall_s": False,
+                     "p95_ms": False, "gui_ms": False, "headless_ms": False}
+
+class MediaRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Static files with Range support, enough for yt-dlp's http, HLS and DASH downloaders"""
+
+    extensions_map = {**http.server.SimpleHTTPRequestHandler.extensions_map,
+                      ".m3u8": "application/vnd.apple.mpegurl", ".mpd": "application/dash+xml",
+                      ".m4s": "video/iso.segment", ".ts": "video/mp2t"}
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        match = re.match(r"bytes=(\d*)-(\d*)$", self.headers.get("Range", ""))
+        path = self.translate_path(self.path)
+        if not match or not any(match.groups()) or not os.path.isfile(path):
+            return super().send_head()
+        size = os.path.getsize(path)
+        first, last = match.groups()
+        start = int(first) if first else max(0, size - int(last))
+        end = min(int(last), size - 1) if first and last else size - 1
+        if start >= size or start > end:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.end_headers()
+            return None
+        with open(path, "rb") as f:
+            f.seek(start)
+            body = f.read(end - start + 1)
+        self.send_response(206)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        return io.BytesIO(body)
+
+class SyntheticMediaServer:
+    """Serves a directory of generated media on 127.0.0.1"""
+
+    def __init__(self, directory):
+        handler = lambda *args, **kwargs: MediaRequestHandler(*args, directory=directory, **kwargs)
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def generate_benchmark_media(ffmpeg, directory, duration):
+    """Progressive MP4, HLS and DASH renditions of one clip and a page with a small playlist"""
+    run = lambda *args: subprocess.run([ffmpeg, "-hide_banner", "-loglevel", "error", "-y", *args],
+                                       check=True, capture_output=True, startupinfo=hidden_startupinfo())
+
+    def clip(path, size, seconds, frequency):
+        run("-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30:duration={seconds}",
+            "-f", "lavfi", "-i", f"sine=frequency={frequency}:sample_rate=48000:duration={seconds}",
+            # A key frame every 2 seconds so HLS and DASH segments match -hls_time and -seg_duration
+            "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-g", "60",
+            "-b:v", "4M", "-maxrate", "4M", "-bufsize", "8M",
+            "-c:a", "aac", "-b:a", "128k", "-shortest", "-movflags", "+faststart", path)
+
+    clip_path = os.path.join(directory, "clip.mp4")
+    clip(clip_path, "1280x720", duration, 440)
+    os.makedirs(os.path.join(directory, "hls"))
+    run("-i", clip_path, "-c", "copy", "-f", "hls", "-hls_time", "2", "-hls_playlist_type", "vod",
+        "-hls_segment_filename", os.path.join(directory, "hls", "seg%03d.ts"),
+        os.path.join(directory, "hls", "index.m3u8"))
+    os.makedirs(os.path.join(directory, "dash"))
+    run("-i", clip_path, "-map", "0:v", "-map", "0:a", "-c", "copy", "-f", "dash", "-seg_duration", "2",
+        os.path.join(directory, "dash", "manifest.mpd"))
+    sources = []
+    for index in range(1, BENCHMARK_PLAYLIST_ENTRIES + 1):
+        clip(os.path.join(directory, f"entry-{index}.mp4"), "854x480", max(1, duration // 6), 220 * index)
+        sources.append(f'<video controls><source src="entry-{index}.mp4" type="video/mp4"></video>')
+    with open(os.path.join(directory, "playlist.html"), "w", encoding="utf-8") as f:
+        f.write(f"<!DOCTYPE html><html><head><title>KirstGrab benchmark playlist</title></head>"
+                f"<body>{''.join(sources)}</body></html>")
+
+def tool_version(cmd):
     try:
-        def download_progress(block_num, block_size, total_size):
-            if progress_callback and total_size > 0:
-                downloaded = block_num * block_size
-                percent = min(100, (downloaded / total_size) * 100)
-                progress_callback(percent)
-        
-        urllib.request.urlretrieve(url, filepath, reporthook=download_progress)
-        return True
-    except Exception as e:
-        print(f"Error downloading file: {e}")
-        return False
+        result = subprocess.run(cmd, capture_output=True, timeout=30, startupinfo=hidden_startupinfo())
+        return result.stdout.decode("utf-8", "replace").splitlines()[0].strip()
+    except (OSError, IndexError, subprocess.SubprocessError):
+        return None
 
-def show_update_dialog(latest_info):
-    """Show update dialog with latest version information"""
-    dialog = tk.Toplevel(root)
-    dialog.title("Update Available")
-    dialog.geometry("450x350")
-    dialog.resizable(False, False)
-    dialog.configure(bg="#2c3e50")
-    
-    # Center the dialog
-    dialog.transient(root)
-    dialog.grab_set()
-    
-    # Make dialog modal
-    dialog.focus_set()
-    
-    # Update info
-    latest_version = latest_info.get('tag_name', 'Unknown')
-    release_name = latest_info.get('name', 'Latest Release')
-    release_notes = latest_info.get('body', 'No release notes available.')
-    
-    # Title
-    title_label = tk.Label(dialog, text=f"🔄 Update Available!", 
-                          font=("Arial", 16, "bold"), 
-                          fg="#3498db", bg="#2c3e50")
-    title_label.pack(pady=20)
-    
-    # Version info
-    version_frame = tk.Frame(dialog, bg="#2c3e50")
-    version_frame.pack(pady=10)
-    
-    tk.Label(version_frame, text=f"Current Version: {CURRENT_VERSION}", 
-             font=("Arial", 12), fg="white", bg="#2c3e50").pack()
-    tk.Label(version_frame, text=f"Latest Version: {latest_version}", 
-             font=("Arial", 12, "bold"), fg="#2ecc71", bg="#2c3e50").pack()
-    
-    # Simple update message
-    message_label = tk.Label(dialog, text="A new version is available for download!", 
-                           font=("Arial", 12), fg="#ecf0f1", bg="#2c3e50")
-    message_label.pack(pady=20)
-    
-    # Progress bar (initially visible)
-    progress_frame = tk.Frame(dialog, bg="#2c3e50")
-    progress_frame.pack(pady=10)
-    
-    progress_label = tk.Label(progress_frame, text="", 
-                             font=("Arial", 10), fg="#f39c12", bg="#2c3e50")
-    progress_label.pack()
-    
-    progress_bar = tk.Frame(progress_frame, bg="#e74c3c", height=20, width=300)
-    progress_bar.pack(pady=5)
-    
-    # Buttons
-    button_frame = tk.Frame(dialog, bg="#2c3e50")
-    button_frame.pack(pady=20)
-    
-    update_button = tk.Button(button_frame, text="🔄 Update Now", 
-                             font=("Arial", 12, "bold"), 
-                             bg="#e74c3c", fg="white",
-                             activebackground="#c0392b",
-                             bd=0, padx=25, pady=12,
-                             width=12,
-                             command=lambda: start_update(dialog, latest_info, progress_label, progress_bar, progress_frame))
-    update_button.pack(side="left", padx=8)
-    
-    later_button = tk.Button(button_frame, text="⏰ Later", 
-                            font=("Arial", 12), 
-                            bg="#95a5a6", fg="white",
-                            activebackground="#7f8c8d",
-                            bd=0, padx=25, pady=12,
-                            width=8,
-                            command=dialog.destroy)
-    later_button.pack(side="left", padx=8)
-    
-    skip_button = tk.Button(button_frame, text="❌ Skip", 
-                           font=("Arial", 12), 
-                           bg="#95a5a6", fg="white",
-                           activebackground="#7f8c8d",
-                           bd=0, padx=25, pady=12,
-                           width=8,
-                           command=dialog.destroy)
-    skip_button.pack(side="left", padx=8)
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
 
-def start_update(dialog, latest_info, progress_label, progress_bar, progress_frame):
-    """Start the update process"""
-    def update_progress(percent):
-        progress_label.config(text=f"Downloading update... {percent:.1f}%")
-        # Update progress bar width
-        progress_width = int(300 * (percent / 100))
-        progress_bar.config(width=progress_width)
-        dialog.update()
-    
-    def download_and_replace():
+def median_of(values):
+    values = [value for value in values if value is not None]
+    return round(statistics.median(values), 3) if values else None
+
+def run_benchmark_case(url, preset, playlist, out_dir, downloader):
+    """Download url through a fresh DownloadQueue, returns the metrics records of its jobs"""
+    metrics = MetricsRecorder(os.path.join(out_dir, "metrics.jsonl"))
+    download_queue = DownloadQueue(1, postprocessor=PostProcessQueue(), metrics=metrics)
+    started = time.monotonic()
+    download_queue.submit(DownloadJob(url, out_dir, preset, expand_playlist=playlist, downloader=downloader))
+    while True:
+        counts = download_queue.counts()
+        if not counts[JOB_QUEUED] and not counts[JOB_RUNNING]:
+            break
+        time.sleep(0.1)
+    wall = time.monotonic() - started
+    failed = [job for job in download_queue.jobs if job.state == JOB_FAILED]
+    download_queue.shutdown()
+    for job in failed:
+        for line in job.log.tail(20):
+            print(f"[{job.url}] {line}", file=sys.stderr)
+    return wall, metrics.history(), not failed
+
+def measure_output_latency(lines):
+    """Delay between a progress line written by a child process and the queue's progress callback.
+
+    The child stores its wall clock time in downloaded_bytes, the GUI adds up
+    to UI_FRAME_MS on top of this before the line is drawn.
+    """
+    latencies = []
+    download_queue = DownloadQueue(1, on_progress=lambda job: latencies.append(
+        time.time() - job.progress.downloaded_bytes / 1e6))
+    job = DownloadJob("benchmark://output", tempfile.gettempdir(), FORMAT_PRESETS[0])
+    # The same reader and progress routing a yt-dlp process goes through
+    download_queue._run_command(job, program_command(BENCHMARK_FLAG, "--emit", str(lines)))
+    download_queue.shutdown()
+    latencies = [latency * 1000 for latency in latencies]
+    if not latencies:
+        return {"lines": lines, "error": "no progress received"}
+    return {"lines": lines, "callbacks": len(latencies), "p50_ms": round(percentile(latencies, 0.5), 3),
+            "p95_ms": round(percentile(latencies, 0.95), 3), "max_ms": round(max(latencies), 3),
+            "ui_frame_ms": UI_FRAME_MS}
+
+def emit_benchmark_output(lines):
+    """Child side of measure_output_latency, progress lines mixed with ordinary log lines"""
+    for index in range(lines):
+        print(f"[download] Destination: fragment {index}")
+        print(PROGRESS_MARKER + json.dumps({"status": "downloading", "filename": "benchmark",
+                                            "downloaded_bytes": int(time.time() * 1e6)}), flush=True)
+        time.sleep(0.005)
+
+def measure_startup(runs):
+    """Window start-up from the start-up profile and the wall time of an empty headless batch"""
+    result = {}
+    gui = []
+    profile_path = os.path.join(app_data_dir("logs"), "startup-profile.json")
+    for _ in range(runs):
         try:
-            # Find the ZIP asset (release package)
-            assets = latest_info.get('assets', [])
-            zip_asset = None
-            
-            for asset in assets:
-                if asset['name'].endswith('.zip') and 'release' in asset['name']:
-                    zip_asset = asset
-                    break
-            
-            if not zip_asset:
-                messagebox.showerror("Error", "Could not find release package in assets!")
-                return
-            
-            # Download ZIP to temporary file
-            temp_dir = tempfile.gettempdir()
-            temp_zip = os.path.join(temp_dir, f"KirstGrab_update_{zip_asset['name']}")
-            
-            progress_label.config(text="Downloading update...")
-            
-            if not download_file(zip_asset['browser_download_url'], temp_zip, update_progress):
-                messagebox.showerror("Error", "Failed to download update!")
-                return
-            
-            progress_label.config(text="Extracting update...")
-            
-            # Extract the ZIP file
-            extract_dir = os.path.join(temp_dir, "KirstGrab_extract")
-            os.makedirs(extract_dir, exist_ok=True)
-            
-            with zipfile.ZipFile(temp_zip, 'r') as zip_ref:
-                zip_ref.extractall(extract_dir)
-            
-            # Find the executable in the extracted files
-            exe_files = []
-            for root, dirs, files in os.walk(extract_dir):
-                for file in files:
-                    if file.endswith('.exe') and 'KirstGrab' in file:
-                        exe_files.append(os.path.join(root, file))
-            
-            if not exe_files:
-                messagebox.showerror("Error", "Could not find executable in release package!")
-                # Clean up
-                os.remove(temp_zip)
-                shutil.rmtree(extract_dir, ignore_errors=True)
-                return
-            
-            # Use the first (and likely only) executable found
-            temp_exe = exe_files[0]
-            
-            progress_label.config(text="Installing update...")
-            
-            # Get current executable path
-            if getattr(sys, 'frozen', False):
-                # Running as compiled executable
-                current_exe = sys.executable
-            else:
-                # Running as script
-                current_exe = os.path.abspath(__file__)
-            
-            # Create backup
-            backup_path = current_exe + ".backup"
-            shutil.copy2(current_exe, backup_path)
-            
-            # On Windows, we need to use a different approach to replace the running executable
-            if sys.platform.startswith("win"):
-                # Create a batch script to replace the executable after exit
-                batch_script = os.path.join(temp_dir, "update_kirstgrab.bat")
-                with open(batch_script, 'w') as f:
-                    f.write(f'''@echo off
-setlocal enabledelayedexpansion
-echo KirstGrab Update Script Started
-echo ================================
-
-echo Waiting for KirstGrab to close...
-timeout /t 3 /nobreak
-
-echo Terminating any remaining KirstGrab processes...
-taskkill /f /im KirstGrab.exe 2>nul
-taskkill /f /im python.exe 2>nul
-
-echo Waiting for processes to terminate...
-timeout /t 2 /nobreak
-
-echo.
-echo File Information:
-echo Source: {temp_exe}
-echo Destination: {current_exe}
-echo Backup: {backup_path}
-echo.
-
-if not exist "{temp_exe}" (
-    echo ERROR: New executable not found at {temp_exe}
-    echo Press any key to exit...
-    pause >nul
-    exit /b 1
-)
-
-echo Checking if destination is writable...
-if exist "{current_exe}" (
-    echo Destination file exists, checking permissions...
-    echo test > "{current_exe}.test" 2>nul
-    if exist "{current_exe}.test" (
-        del "{current_exe}.test" 2>nul
-        echo Destination is writable.
-    ) else (
-        echo ERROR: Cannot write to destination file!
-        echo Please run as administrator or close any antivirus software.
-        echo Press any key to exit...
-        pause >nul
-        exit /b 1
-    )
-)
-
-echo Replacing executable...
-copy /Y "{temp_exe}" "{current_exe}"
-if %errorlevel% neq 0 (
-    echo Copy failed! Trying move...
-    move /Y "{temp_exe}" "{current_exe}"
-    if %errorlevel% neq 0 (
-        echo Move also failed!
-        echo This might be due to file permissions or antivirus interference.
-        echo Please try running as administrator.
-        echo Press any key to exit...
-        pause >nul
-        exit /b 1
-    )
-)
-
-echo Verifying update...
-if exist "{current_exe}" (
-    echo Update successful!
-) else (
-    echo ERROR: Update verification failed!
-    echo Press any key to exit...
-    pause >nul
-    exit /b 1
-)
-
-echo.
-echo Cleaning up temporary files...
-del "{backup_path}" 2>nul
-del "{temp_zip}" 2>nul
-rmdir /s /q "{extract_dir}" 2>nul
-
-echo Starting new version...
-start "" "{current_exe}"
-
-echo.
-echo Update completed successfully!
-echo This window will close in 2 seconds...
-timeout /t 2 >nul
-del "{batch_script}" 2>nul
-''')
-                
-                progress_label.config(text="Update completed! Restarting application...")
-                dialog.update()
-                
-                # Show restart message
-                messagebox.showinfo("Update Complete", 
-                                  "Update completed successfully!\nThe application will now restart.")
-                
-                # Execute the batch script and exit
-                print(f"Executing batch script: {batch_script}")
-                print(f"Temp exe: {temp_exe}")
-                print(f"Current exe: {current_exe}")
-                
-                # Try to run the batch script with more visibility
-                try:
-                    # Use subprocess.run with proper error handling
-                    result = subprocess.run([batch_script], 
-                                          shell=True, 
-                                          capture_output=False,
-                                          text=True,
-                                          timeout=60)  # 60 second timeout
-                    print(f"Batch script completed with return code: {result.returncode}")
-                except subprocess.TimeoutExpired:
-                    print("Batch script timed out, but update may have succeeded")
-                except Exception as e:
-                    print(f"Failed to start batch script: {e}")
-                    # Try alternative method
-                    try:
-                        os.startfile(batch_script)
-                    except Exception as e2:
-                        print(f"Alternative start method also failed: {e2}")
-                
-                # Properly close the application
-                try:
-                    root.quit()
-                    root.destroy()
-                except:
-                    pass
-                sys.exit(0)
+            proc = subprocess.run(program_command(STARTUP_PROFILE_FLAG, EXIT_AFTER_PAINT_FLAG),
+                                  capture_output=True, timeout=120)
+        except (OSError, subprocess.SubprocessError) as e:
+            result["gui_error"] = str(e)
+            break
+        if proc.returncode != 0:
+            lines = proc.stderr.decode("utf-8", "replace").strip().splitlines()
+            result["gui_error"] = lines[-1] if lines else f"exit code {proc.returncode}"
+            break
+        with open(profile_path, "r", encoding="utf-8") as f:
+            gui.append(json.load(f))
+    if gui:
+        result["gui_ms"] = median_of([profile["total_ms"] for profile in gui])
+        phases = [{phase["name"]: phase["ms"] for phase in profile["phases"]} for profile in gui]
+        result["gui_phases"] = {name: median_of([profile.get(name) for profile in phases]) for name in phases[0]}
+    empty = tempfile.mkdtemp(prefix="kirstgrab_benchmark_")
+    batch_file = os.path.join(empty, "urls.txt")
+    open(batch_file, "w").close()
+    headless = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(program_command(BATCH_FLAG, batch_file, "--out", empty), capture_output=True, timeout=120)
+        headless.append((time.perf_counter() - started) * 1000)
+    shutil.rmtree(empty, ignore_errors=True)
+    result["headless_ms"] = median_of(headless)
+    return result
+
+def compare_benchmarks(results, baseline, tolerance=BENCHMARK_TOLERANCE):
+    """Metrics of results that are worse than in baseline by more than tolerance"""
+    sections = [(f"cases.{name}", case, baseline.get("cases", {}).get(name) or {})
+                for name, case in results["cases"].items()]
+    sections.append(("output_latency", results["output_latency"], baseline.get("output_latency") or {}))
+    sections.append(("startup", results["startup"], baseline.get("startup") or {}))
+    regressions = []
+    for section, current, previous in sections:
+        for metric, higher_is_better in BENCHMARK_METRICS.items():
+            now, before = current.get(metric), previous.get(metric)
+            if not now or not before:
+                continue
+            change = (now - before) / before
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append({"metric": f"{section}.{metric}", "baseline": before, "current": now,
+                                    "change": round(change, 3)})
+    return regressions
+
+def parse_benchmark_args(argv):
+    parser = argparse.ArgumentParser(prog="KirstGrab", description="Time downloads from a local synthetic media server.")
+    parser.add_argument(BENCHMARK_FLAG, dest="benchmark", action="store_true", required=True)
+    parser.add_argument("--runs", type=int, default=3, help="repetitions of every case")
+    parser.add_argument("--duration", type=int, default=30, help="seconds of the generated clip")
+    parser.add_argument("--cases", default=",".join(case[0] for case in BENCHMARK_CASES),
+                        help="comma separated subset of " + ", ".join(case[0] for case in BENCHMARK_CASES))
+    parser.add_argument("--downloader", default=BACKEND_AUTO, choices=DOWNLOADER_BACKENDS)
+    parser.add_argument("--results", default=app_data_dir("benchmarks"), help="directory of the result files")
+    parser.add_argument("--baseline", metavar="FILE", help="result file to compare with, default the latest one")
+    parser.add_argument("--no-startup", action="store_true", help="skip the start-up measurement")
+    parser.add_argument("--emit", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args([arg for arg in argv if arg != STARTUP_PROFILE_FLAG])
+
+def run_benchmark(argv):
+    """Offline benchmark, writes one JSON result file and returns the exit code"""
+    args = parse_benchmark_args(argv)
+    if args.emit is not None:
+        emit_benchmark_output(args.emit)
+        return 0
+    ffmpeg = find_ffmpeg()
+    yt = find_embedded_exe("yt-dlp.exe")
+    if not ffmpeg:
+        print("ffmpeg is needed to generate the benchmark media", file=sys.stderr)
+        return 2
+    selected = args.cases.split(",")
+    work_dir = tempfile.mkdtemp(prefix="kirstgrab_benchmark_")
+    server = None
+    try:
+        print("Generating media...", file=sys.stderr)
+        media_dir = os.path.join(work_dir, "media")
+        os.makedirs(media_dir)
+        try:
+            generate_benchmark_media(ffmpeg, media_dir, args.duration)
+        except subprocess.CalledProcessError as e:
+            print(f"ffmpeg failed: {e.stderr.decode('utf-8', 'replace').strip()}", file=sys.stderr)
+            return 2
+        server = SyntheticMediaServer(media_dir)
+        results = {
+            "version": CURRENT_VERSION,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "tools": {"yt-dlp": tool_version([yt, "--version"]), "ffmpeg": tool_version([ffmpeg, "-version"])},
+            "clip_seconds": args.duration,
+            "cases": {},
+        }
+        failed = False
+        for name, path, preset, playlist in BENCHMARK_CASES:
+            if name not in selected:
+                continue
+            print(f"Running {name}...", file=sys.stderr)
+            walls, sizes, throughput, ttfb, extract, postprocess, ok = [], [], [], [], [], [], True
+            for run in range(args.runs):
+                out_dir = os.path.join(work_dir, f"{name}-{run}")
+                os.makedirs(out_dir)
+                wall, records, run_ok = run_benchmark_case(server.base_url + path, preset, playlist,
+                                                           out_dir, args.downloader)
+                ok = ok and run_ok
+                walls.append(wall)
+                # Playlist parents only list entries, their children carry the downloads
+                downloads = [record for record in records if record["bytes"]]
+                total = sum(record["bytes"] for record in downloads)
+                download_time = sum(record["phases"].get(STAGE_DOWNLOAD, 0) for record in downloads)
+                sizes.append(total)
+                throughput.append(total / download_time if download_time else None)
+                ttfb.extend(record["ttfb"] for record in downloads)
+                extract.extend(record["phases"].get(PHASE_EXTRACT) for record in downloads)
+                postprocess.append(sum(record["phases"].get(phase, 0) for record in downloads
+                                       for phase in (STAGE_MERGE, STAGE_POSTPROCESS, PHASE_CONVERT)))
+                shutil.rmtree(out_dir, ignore_errors=True)
+            failed = failed or not ok
+            results["cases"][name] = {
+                "url": path, "preset": preset, "runs": args.runs, "ok": ok,
+                "wall_s": median_of(walls), "bytes": median_of(sizes), "throughput": median_of(throughput),
+                "ttfb_s": median_of(ttfb), "extract_s": median_of(extract), "postprocess_s": median_of(postprocess),
+            }
+        print("Measuring output latency...", file=sys.stderr)
+        results["output_latency"] = measure_output_latency(500)
+        if args.no_startup:
+            results["startup"] = {}
+        else:
+            print("Measuring start-up...", file=sys.stderr)
+            results["startup"] = measure_startup(args.runs)
+    finally:
+        if server:
+            server.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    os.makedirs(args.results, exist_ok=True)
+    baseline_path = args.baseline
+    if not baseline_path:
+        previous = sorted((entry for entry in os.scandir(args.results) if entry.name.endswith(".json")),
+                          key=lambda entry: entry.stat().st_mtime)
+        baseline_path = previous[-1].path if previous else None
+    if baseline_path:
+        try:
+            with open(baseline_path, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+            if baseline.get("clip_seconds") == results["clip_seconds"]:
+                results["baseline"] = os.path.basename(baseline_path)
+                results["regressions"] = compare_benchmarks(results, baseline)
             else:
-                # For non-Windows systems, try direct replacement
-                try:
-                    shutil.copy2(temp_exe, current_exe)
-                    
-                    # Clean up temporary files
-                    os.remove(temp_zip)
-                    shutil.rmtree(extract_dir, ignore_errors=True)
-                    
-                    progress_label.config(text="Update completed! Restarting application...")
-                    dialog.update()
-                    
-                    # Show restart message
-                    messagebox.showinfo("Update Complete", 
-                                      "Update completed successfully!\nThe application will now restart.")
-                    
-                    # Restart the application
-                    if getattr(sys, 'frozen', False):
-                        # For compiled executable
-                        os.execv(current_exe, [current_exe] + sys.argv[1:])
-                    else:
-                        # For script
-                        os.execv(sys.executable, [sys.executable] + sys.argv)
-                except PermissionError:
-                    # If permission denied, show error and clean up
-                    messagebox.showerror("Update Error", 
-                                       "Permission denied! Please run the application as administrator to update.")
-                    os.remove(temp_zip)
-                    shutil.rmtree(extract_dir, ignore_errors=True)
-                
-        except Exception as e:
-            messagebox.showerror("Update Error", f"Failed to update: {str(e)}")
-            progress_label.config(text="Update failed!")
-    
-    # Start download in separate thread
-    threading.Thread(target=download_and_replace, daemon=True).start()
+                print(f"Baseline {baseline_path} used a different clip length, not comparing", file=sys.stderr)
+        except (OSError, ValueError) as e:
+            print(f"Could not read baseline {baseline_path}: {e}", file=sys.stderr)
+    result_path = os.path.join(args.results, f"{CURRENT_VERSION}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
 
-def check_for_updates():
-    """Check for updates on startup"""
-    def check_thread():
-        try:
-            latest_info = get_latest_release_info()
-            if latest_info:
-                latest_version = latest_info.get('tag_name', '')
-                if compare_versions(CURRENT_VERSION, latest_version):
-                    # Update available - show dialog in main thread
-                    root.after(0, lambda: show_update_dialog(latest_info))
-        except Exception as e:
-            print(f"Update check failed: {e}")
-    
-    # Check for updates in background thread
-    threading.Thread(target=check_thread, daemon=True).start()
+    for name, case in results["cases"].items():
+        speed = f"{format_bytes(case['throughput'])}/s" if case["throughput"] else "-"
+        print(f"{name:<12} {'ok' if case['ok'] else 'FAILED':<7} {speed:>12}  ttfb {case['ttfb_s'] or '-'} s"
+              f"  post {case['postprocess_s'] or '-'} s  wall {case['wall_s']} s")
+    latency = results["output_latency"]
+    print(f"{'output':<12} p50 {latency.get('p50_ms')} ms  p95 {latency.get('p95_ms')} ms")
+    startup = results["startup"]
+    if startup:
+        window = f"{startup['gui_ms']} ms" if "gui_ms" in startup else f"not measured ({startup.get('gui_error')})"
+        print(f"{'startup':<12} window {window}  headless {startup.get('headless_ms')} ms")
+    for regression in results.get("regressions", []):
+        print(f"Regression: {regression['metric']} {regression['baseline']} -> {regression['current']}"
+              f" ({regression['change']:+.0%})")
+    print(f"Results saved to {result_path}")
+    return 1 if failed else 0
 
-def find_embedded_exe(name):
-    p = resource_path(os.path.join("bin", name))
-    return p if os.path.exists(p) else name
+# Engine workers re-launch this program, they never build the window
+if ENGINE_WORKER_FLAG in sys.argv:
+    run_engine_worker()
+    sys.exit(0)
+
+if BATCH_FLAG in sys.argv:
+    sys.exit(run_batch(sys.argv[1:]))
+
+if SERVE_FLAG in sys.argv:
+    sys.exit(run_server(sys.argv[1:]))
+
+if BENCHMARK_FLAG in sys.argv:
+    sys.exit(run_benchmark(sys.argv[1:]))
+
+if tk is None:
+    print(f"Tkinter is not installed, only {BATCH_FLAG} mode is available.", file=sys.stderr)
+    sys.exit(1)
 
 class ImageButton(tk.Canvas):
     def __init__(self, master=None, normal_img=None, pressed_img=None, command=None, **kwargs):
@@ -525,172 +4335,28 @@ class ImageButton(tk.Canvas):
         if self.command and 0 <= event.x <= self.winfo_width() and 0 <= event.y <= self.winfo_height():
             self.command()
 
-def build_command(url, download_path, format_choice, use_proxy=False):
-    yt = find_embedded_exe("yt-dlp.exe")
-    ffmpeg_path = resource_path(os.path.join("bin", "ffmpeg.exe"))
-    ffprobe_path = resource_path(os.path.join("bin", "ffprobe.exe"))
-    ffmpeg_dir = os.path.dirname(ffmpeg_path)
-    
-    cmd = [
-        yt,
-        "--no-check-certificates",  # Skip SSL certificate verification
-        "--prefer-free-formats",    # Prefer free formats when available
-        "--merge-output-format", "mp4",  # Merge to MP4 when possible
-        url,
-        "-P", download_path,
-        "--progress-template", "%(progress._percent_str)s %(progress._eta_str)s",
-    ]
-    
-    # Add proxy if enabled
-    if use_proxy:
-        cmd.extend(["--proxy", DEFAULT_PROXY])
-    
-    # Handle cookies - only use cookies.txt file
-    cookies_path = resource_path("cookies.txt")
-    ensure_cookies_file(cookies_path)
-    # Only use cookies if the file is not empty
-    if os.path.getsize(cookies_path) > 0:
-        cmd.extend(["--cookies", cookies_path])
-    
-    # Set format based on choice
-    if format_choice == "Best Quality (MP4)":
-        # Download best video+audio, prefer MP4, fallback to best available
-        cmd.extend(["-f", "best[ext=mp4]/bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best"])
-    elif format_choice == "Best Quality (Any Format)":
-        # Download best available quality in any format
-        cmd.extend(["-f", "bestvideo+bestaudio/best"])
-    elif format_choice == "1080p (MP4)":
-        # Download 1080p video, fallback to best available
-        cmd.extend(["-f", "best[height<=1080][ext=mp4]/bestvideo[height<=1080]+bestaudio[ext=m4a]/best[height<=1080]/best"])
-    elif format_choice == "720p (MP4)":
-        # Download 720p video, fallback to best available
-        cmd.extend(["-f", "best[height<=720][ext=mp4]/bestvideo[height<=720]+bestaudio[ext=m4a]/best[height<=720]/best"])
-    elif format_choice == "480p (MP4)":
-        # Download 480p video, fallback to best available
-        cmd.extend(["-f", "best[height<=480][ext=mp4]/bestvideo[height<=480]+bestaudio[ext=m4a]/best[height<=480]/best"])
-    elif format_choice == "Audio only (MP3)":
-        # Download best audio and convert to MP3
-        cmd.extend(["-f", "bestaudio", "-x", "--audio-format", "mp3", "--audio-quality", "0"])
-    else:
-        # Fallback to best available
-        cmd.extend(["-f", "best"])
-    
-    # Check for ffmpeg and ffprobe
-    if os.path.exists(ffmpeg_path) and os.path.exists(ffprobe_path):
-        cmd.extend(["--ffmpeg-location", ffmpeg_dir])
-        # Debug: Add ffmpeg path to output
-        output_text.config(state=tk.NORMAL)
-        output_text.insert(tk.END, f"Using ffmpeg: {ffmpeg_path}\n")
-        output_text.insert(tk.END, f"Using ffprobe: {ffprobe_path}\n")
-        output_text.config(state=tk.DISABLED)
-    else:
-        output_text.config(state=tk.NORMAL)
-        if not os.path.exists(ffmpeg_path):
-            output_text.insert(tk.END, f"Warning: ffmpeg not found at {ffmpeg_path}\n")
-        if not os.path.exists(ffprobe_path):
-            output_text.insert(tk.END, f"Warning: ffprobe not found at {ffprobe_path}\n")
-        output_text.config(state=tk.DISABLED)
-    return cmd
-
-def start_download(url, download_path, format_choice):
-    use_proxy = proxy_var.get()
-    cmd = build_command(url, download_path, format_choice, use_proxy)
-    
-    # Debug: Show the command being executed
-    output_text.config(state=tk.NORMAL)
-    output_text.insert(tk.END, f"Format: {format_choice}\n")
-    output_text.insert(tk.END, f"Command: {' '.join(cmd)}\n")
-    output_text.config(state=tk.DISABLED)
-    
-    try:
-        # Create startup info to hide console window on Windows
-        startupinfo = None
-        if sys.platform.startswith("win"):
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            startupinfo.wShowWindow = subprocess.SW_HIDE
-        
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            startupinfo=startupinfo
-        )
-    except Exception as e:
-        messagebox.showerror("Ошибка", f"Не удалось запустить yt-dlp: {e}")
-        output_text.config(state=tk.NORMAL)
-        output_text.insert(tk.END, "\n❌ Ошибка: " + str(e))
-        output_text.config(state=tk.DISABLED)
-        return
+class JobPane(tk.Text):
+    """Read-only output pane showing the tail of one job's log"""
 
-    output_text.config(state=tk.NORMAL)
-    output_text.delete(1.0, tk.END)
-    output_text.insert(tk.END, f"Загрузка: {url}\n")
-    output_text.config(state=tk.DISABLED)
+    def __init__(self, master=None, **kwargs):
+        super().__init__(master, state=tk.DISABLED, **kwargs)
 
-    def read_output():
-        buffer_line = ""
-        progress_line_created = [False]  # Track if progress line exists
-        
-        while True:
-            try:
-                ch = proc.stdout.read(1)
-            except Exception:
-                ch = ""
-            if not ch:
-                if proc.poll() is not None:
-                    code = proc.returncode
-                    def show_completion():
-                        output_text.config(state=tk.NORMAL)
-                        output_text.insert(tk.END, "\n✅ COMPLETED!" if code == 0 else f"\n❌ ERROR (code {code})")
-                        output_text.config(state=tk.DISABLED)
-                    root.after(0, show_completion)
-                    break
-                continue
+    def render(self, lines):
+        """Replace the pane content with the given lines.
 
-            if ch == "\r":
-                # перезаписываем последнюю строку (для прогресса)
-                def replace_line(line=buffer_line):
-                    output_text.config(state=tk.NORMAL)
-                    if progress_line_created[0]:
-                        # Удаляем последнюю строку и заменяем её
-                        last_line = output_text.index(tk.END + "-1l")
-                        output_text.delete(last_line, tk.END)
-                        output_text.insert(tk.END, line)
-                    else:
-                        # Создаем новую строку прогресса
-                        output_text.insert(tk.END, line)
-                        progress_line_created[0] = True
-                    output_text.see(tk.END)
-                    output_text.config(state=tk.DISABLED)
-                root.after(0, replace_line)
-                buffer_line = ""
-            elif ch == "\n":
-                def append_line(line=buffer_line):
-                    output_text.config(state=tk.NORMAL)
-                    output_text.insert(tk.END, line + "\n")
-                    # Сбрасываем флаг строки прогресса при добавлении новой строки
-                    progress_line_created[0] = False
-                    output_text.see(tk.END)
-                    output_text.config(state=tk.DISABLED)
-                root.after(0, append_line)
-                buffer_line = ""
-            else:
-                buffer_line += ch
+        Only the last PANE_MAX_LINES lines are ever inserted, so the redraw cost
+        does not depend on how much output the job produced.
+        """
+        self.config(state=tk.NORMAL)
+        self.delete(1.0, tk.END)
+        self.insert(tk.END, "\n".join(lines[-PANE_MAX_LINES:]))
+        self.see(tk.END)
+        self.config(state=tk.DISABLED)
 
-    threading.Thread(target=read_output, daemon=True).start()
 
-def on_download_clicked():
-    url = entry.get().strip()
-    if not url:
-        messagebox.showerror("Ошибка", "Введите URL видео!")
-        return
-    download_path = filedialog.askdirectory()
-    if not download_path:
-        return
-    start_download(url, download_path, format_var.get())
+startup_profile = StartupProfile(STARTUP_STARTED)
+startup_profile.mark("imports and definitions")
+startup_cache = load_startup_cache()
 
 root = tk.Tk()
 root.title("KirstGrab")
@@ -713,16 +4379,22 @@ root.geometry(f"{default_width}x{default_height}")
 root.resizable(False, False)  # Disable window resizing
 default_bg = "#2c3e50"
 root.config(bg=default_bg)
+startup_profile.mark("tk root")
 
-# Clear cookies file on startup
-clear_cookies_file()
 
 tk_custom_font = ("Arial", 12)
 font_file = resource_path(os.path.join("fonts", "m6x11plus.ttf"))
-if os.path.exists(font_file) and PIL_AVAILABLE:
+if os.path.exists(font_file):
     try:
-        pil_font = ImageFont.truetype(font_file, size=12)
-        family_name = pil_font.getname()[0]
+        # Pillow is only needed to read the family name, which is cached
+        font_signature = file_signature(font_file)
+        family_name = startup_cache.get("font", {}).get(font_signature)
+        if not family_name and load_pil():
+            family_name = load_pil()[1].truetype(font_file, size=12).getname()[0]
+            startup_cache["font"] = {font_signature: family_name}
+            save_startup_cache(startup_cache)
+        if not family_name:
+            raise ValueError("font family unknown")
         if sys.platform.startswith("win"):
             FR_PRIVATE = 0x10
             try:
@@ -735,22 +4407,50 @@ if os.path.exists(font_file) and PIL_AVAILABLE:
             tk_custom_font = (family_name, 12)
     except Exception:
         tk_custom_font = ("Arial", 12)
+startup_profile.mark("font")
 
 bg_photo = None
 frame_bg = default_bg
 bg_path = resource_path(os.path.join("images", "background.png"))
-if os.path.exists(bg_path) and PIL_AVAILABLE:
+# Background pre-scaled to the window size, Tk loads the PNG without Pillow
+bg_cache_path = os.path.join(app_data_dir("cache"), f"background_{default_width}x{default_height}.png")
+
+def place_background():
+    global bg_photo
+    bg_photo = tk.PhotoImage(file=bg_cache_path)
+    bg_label = tk.Label(root, image=bg_photo)
+    bg_label.image = bg_photo
+    bg_label.place(x=0, y=0, relwidth=1, relheight=1)
+    bg_label.lower()
+
+def prepare_background():
+    """Scale the background in the background after the first paint"""
+    signature = file_signature(bg_path)
+
+    def finish(scaled):
+        if not scaled:
+            return
+        startup_cache["background"] = signature
+        run_in_background(save_startup_cache, dict(startup_cache))
+        try:
+            place_background()
+        except tk.TclError:
+            pass
+
+    run_in_background(scale_background, bg_path, bg_cache_path, (default_width, default_height), on_done=finish,
+                      on_error=lambda e: print(f"Warning: Could not scale background: {e}"))
+
+background_pending = False
+if os.path.exists(bg_path):
     try:
-        bg_image = Image.open(bg_path)
-        # Resize background to match the increased window size (50% wider)
-        resized_bg = bg_image.resize((default_width, default_height), Image.Resampling.LANCZOS)
-        bg_photo = ImageTk.PhotoImage(resized_bg)
-        bg_label = tk.Label(root, image=bg_photo)
-        bg_label.image = bg_photo
-        bg_label.place(x=0, y=0, relwidth=1, relheight=1)
-        frame_bg = ""
+        if startup_cache.get("background") == file_signature(bg_path) and os.path.exists(bg_cache_path):
+            place_background()
+            frame_bg = ""
+        else:
+            background_pending = True
     except Exception:
         frame_bg = default_bg
+startup_profile.mark("background")
 
 settings_frame = tk.Frame(root, bg=frame_bg if frame_bg else default_bg, bd=0)
 settings_frame.pack(pady=5)
@@ -759,14 +4459,7 @@ format_var = tk.StringVar(value="Best Quality (MP4)")
 format_label = tk.Label(settings_frame, text="Format:", bg=frame_bg if frame_bg else default_bg, fg="white", font=tk_custom_font)
 format_label.pack(side=tk.LEFT, padx=5)
 
-format_options = [
-    "Best Quality (MP4)",
-    "Best Quality (Any Format)", 
-    "1080p (MP4)",
-    "720p (MP4)",
-    "480p (MP4)",
-    "Audio only (MP3)"
-]
+format_options = FORMAT_PRESETS
 
 format_menu = tk.OptionMenu(settings_frame, format_var, *format_options)
 format_menu.config(bg="#2c3e50", fg="white", highlightthickness=0, font=tk_custom_font)
@@ -799,10 +4492,12 @@ proxy_checkbox.pack(side=tk.LEFT, padx=(10, 0))
 
 # Add manual update check button
 def manual_update_check():
-    """Manually check for updates"""
-    try:
-        latest_info = get_latest_release_info()
-        if latest_info:
+    """Manually check for updates in the background"""
+    def show_result(latest_info, error=None):
+        update_check_btn.config(state=tk.NORMAL)
+        if error:
+            messagebox.showerror("Update Check Error", f"Error checking for updates: {error}")
+        elif latest_info:
             latest_version = latest_info.get('tag_name', '')
             if compare_versions(CURRENT_VERSION, latest_version):
                 # Update available - show dialog
@@ -811,8 +4506,10 @@ def manual_update_check():
                 messagebox.showinfo("No Updates", f"You are running the latest version ({CURRENT_VERSION})!")
         else:
             messagebox.showerror("Update Check Failed", "Could not check for updates. Please check your internet connection.")
-    except Exception as e:
-        messagebox.showerror("Update Check Error", f"Error checking for updates: {str(e)}")
+
+    update_check_btn.config(state=tk.DISABLED)
+    run_in_background(get_latest_release_info, RELEASE_MANUAL_INTERVAL, on_done=show_result,
+                      on_error=lambda error: show_result(None, error))
 
 update_check_btn = tk.Button(settings_frame, text="🔄 Check Updates", command=manual_update_check,
                             font=tk_custom_font, bg="#27ae60", fg="white", 
@@ -862,10 +4559,39 @@ def handle_paste(event):
         # Clear current selection and insert clipboard content
         entry.delete(0, tk.END)
         entry.insert(0, clipboard_content)
+        schedule_prefetch()
         return "break"  # Prevent default behavior
     
     return None
 
+# A paste settles for this long before the URL is prefetched
+PREFETCH_DELAY_MS = 300
+prefetch_after = None
+# (url, use proxy) handed to the prefetcher last, leaving the entry again does not restart it
+prefetch_request = None
+# Only complete URLs are prefetched: a host with a dot and a path
+PREFETCH_URL = re.compile(r"https?://[^/\s]+\.[^/\s]+/\S+$")
+
+def schedule_prefetch(event=None):
+    """Prefetch the entry's URL after a paste or when the entry loses focus"""
+    global prefetch_after
+    if prefetch_after:
+        root.after_cancel(prefetch_after)
+    prefetch_after = root.after(PREFETCH_DELAY_MS, start_prefetch)
+
+def start_prefetch():
+    global prefetch_after, prefetch_request
+    prefetch_after = None
+    url = entry.get().strip()
+    if not settings.get("prefetch_metadata") or playlist_var.get() or not PREFETCH_URL.match(url):
+        prefetch_request = None
+        download_queue.prefetcher.cancel()
+        return
+    if prefetch_request == (url, proxy_var.get()):
+        return
+    prefetch_request = (url, proxy_var.get())
+    download_queue.prefetcher.prefetch(url, proxy_var.get())
+
 def handle_ctrl_v(event):
     """Handle Ctrl+V specifically"""
     return handle_paste(event)
@@ -949,21 +4675,138 @@ entry.bind("<KP_Enter>", handle_enter)      # Numpad Enter
 # Additional bindings for Russian layout compatibility
 entry.bind("<Control-KeyPress>", handle_key_press)  # Ctrl+Key combinations
 entry.bind("<Key>", handle_key_press)               # All key events
+entry.bind("<FocusOut>", schedule_prefetch)         # Typed or edited URLs are prefetched once done
 
 # Focus the entry widget by default
 entry.focus_set()
 
-output_text = tk.Text(root, height=12, width=60, bg="#34495e", fg="white", insertbackground="white", bd=2, relief="flat", font=tk_custom_font, state=tk.DISABLED)
-output_text.pack(pady=5)
+# Download queue controls
+queue_frame = tk.Frame(root, bg=default_bg)
+queue_frame.pack(pady=(0, 2))
+
+tk.Label(queue_frame, text="Workers:", bg=default_bg, fg="white", font=tk_custom_font).pack(side=tk.LEFT, padx=(0, 5))
+workers_var = tk.StringVar(value=str(DEFAULT_WORKERS))
+workers_spinbox = tk.Spinbox(queue_frame, from_=1, to=MAX_WORKERS, width=3, textvariable=workers_var,
+                             command=on_workers_changed, font=tk_custom_font, bg="#34495e", fg="white",
+                             buttonbackground="#2c3e50", bd=0)
+workers_spinbox.pack(side=tk.LEFT)
+workers_spinbox.bind("<Return>", lambda event: on_workers_changed())
+
+# Playlist mode lists entries first and downloads each one as a separate job
+playlist_var = tk.BooleanVar(value=False)
+playlist_checkbox = tk.Checkbutton(queue_frame, text="☰ Playlist", variable=playlist_var,
+                                   font=tk_custom_font, bg=default_bg, fg="white", selectcolor="#2c3e50",
+                                   activebackground=default_bg, activeforeground="white")
+playlist_checkbox.pack(side=tk.LEFT, padx=(15, 0))
+
+# Downloader backend for new jobs, Auto follows the per-site settings
+downloader_var = tk.StringVar(value=BACKEND_AUTO)
+downloader_menu = tk.OptionMenu(queue_frame, downloader_var, *DOWNLOADER_BACKENDS)
+downloader_menu.config(bg="#2c3e50", fg="white", highlightthickness=0, font=("Arial", 9), bd=0)
+downloader_menu["menu"].config(bg="#2c3e50", fg="white", font=("Arial", 9))
+downloader_menu.pack(side=tk.LEFT, padx=(10, 0))
+
+def show_metrics_window(records):
+    """Statistics of finished jobs grouped by site, preset and proxy"""
+    window = tk.Toplevel(root)
+    window.title("KirstGrab statistics")
+    window.geometry("640x400")
+    window.configure(bg="#2c3e50")
+    text = tk.Text(window, bg="#34495e", fg="white", font=("Consolas", 9), bd=0, wrap="none")
+    text.pack(fill="both", expand=True, padx=8, pady=8)
+    fmt = lambda seconds: f"{seconds:6.1f}s" if seconds is not None else "     -"
+    lines = [f"{len(records)} finished jobs, from {os.path.join(app_data_dir('logs'), 'metrics.jsonl')}", ""]
+    for field, title in (("site", "By site"), ("preset", "By preset"), ("proxy", "By proxy")):
+        lines.append(title)
+        lines.append(f"  {'':<28}{'jobs':>5}{'fail':>5}{'avg speed':>12}{'ttfb':>8}{'extract':>8}{'download':>9}{'convert':>8}")
+        for row in summarize_metrics(records, field):
+            speed = f"{format_bytes(row['avg_speed'])}/s" if row["avg_speed"] else "-"
+            phases = row["phases"]
+            lines.append(f"  {str(row[field])[:27]:<28}{row['jobs']:>5}{row['failed']:>5}{speed:>12}{fmt(row['ttfb']):>8}"
+                         f"{fmt(phases.get(PHASE_EXTRACT)):>8}{fmt(phases.get(STAGE_DOWNLOAD)):>9}"
+                         f"{fmt(phases.get(PHASE_CONVERT)):>8}")
+        lines.append("")
+    text.insert(tk.END, "\n".join(lines))
+    text.config(state=tk.DISABLED)
+
+def open_metrics_window():
+    # Reading the history may take a moment, the window opens when it is loaded
+    run_in_background(download_queue.metrics.history, on_done=show_metrics_window)
+
+stats_button = tk.Button(queue_frame, text="📊 Stats", command=open_metrics_window,
+                         font=("Arial", 9), bg="#2c3e50", fg="white", activebackground="#34495e", bd=0)
+stats_button.pack(side=tk.LEFT, padx=(10, 0))
+
+queue_status_label = tk.Label(queue_frame, text="", bg=default_bg, fg="#bdc3c7", font=("Arial", 9))
+queue_status_label.pack(side=tk.LEFT, padx=(15, 0))
+
+output_frame = tk.Frame(root, bg=default_bg)
+output_frame.pack(pady=5)
+
+jobs_listbox = tk.Listbox(output_frame, height=11, width=24, bg="#34495e", fg="white", bd=2, relief="flat",
+                          selectbackground="#3498db", activestyle="none", exportselection=False, font=tk_custom_font)
+jobs_listbox.pack(side=tk.LEFT, fill=tk.Y, padx=(0, 5))
+jobs_listbox.bind("<<ListboxSelect>>", on_job_selected)
+
+panes_frame = tk.Frame(output_frame, bg=default_bg)
+panes_frame.pack(side=tk.LEFT)
+panes_frame.grid_rowconfigure(0, weight=1)
+panes_frame.grid_columnconfigure(0, weight=1)
+
+# Output pane of the selected job
+output_text = JobPane(panes_frame, height=10, width=44, bg="#34495e", fg="white", insertbackground="white", bd=2, relief="flat", font=tk_custom_font)
+output_text.grid(row=0, column=0, sticky="nsew")
+
+progress_canvas = tk.Canvas(panes_frame, height=14, width=400, bg="#34495e", highlightthickness=0, bd=0)
+progress_canvas.grid(row=1, column=0, sticky="ew", pady=(3, 0))
+output_text.render(["Paste a URL and press Download to queue it."])
+startup_profile.mark("widgets")
+
+download_queue = create_download_queue(DEFAULT_WORKERS, on_state=on_job_state, on_output=on_job_output,
+                                       on_progress=on_job_progress,
+                                       journal=JobJournal(os.path.join(app_data_dir(), "journal.jsonl")),
+                                       max_finished=MAX_FINISHED_JOBS, on_removed=on_jobs_removed)
+ui_monitor = UiLagMonitor(open_ui_log())
+root.after(UI_FRAME_MS, drain_ui_events)
+
+# Resume whatever the previous session left unfinished, reading and
+# rewriting the journal stays off the Tk thread so the first paint isn't held up
+def on_jobs_restored(restored_jobs):
+    if restored_jobs and selected_job is None:
+        output_text.render([f"♻ Resuming {len(restored_jobs)} unfinished job(s) from the last session."])
+
+run_in_background(download_queue.restore, on_done=on_jobs_restored)
+
+if settings.get("api_server"):
+    try:
+        job_server = JobServer(download_queue, settings.get("api_port", 9746), api_token(),
+                               api_download_dir()).start()
+    except OSError as e:
+        print(f"Warning: Could not start the job API: {e}")
+
+metrics_server = start_metrics_server(download_queue)
+
+def on_close():
+    # The servers take up to half a second to stop, the window goes away first
+    root.withdraw()
+    if job_server:
+        job_server.close()
+    if metrics_server:
+        metrics_server.close()
+    download_queue.shutdown()
+    root.destroy()
+
+root.protocol("WM_DELETE_WINDOW", on_close)
+startup_profile.mark("download queue")
 
 btn_normal = None
 btn_pressed = None
 btn_normal_path = resource_path(os.path.join("images", "button_normal.png"))
 btn_pressed_path = resource_path(os.path.join("images", "button_pressed.png"))
-if os.path.exists(btn_normal_path) and os.path.exists(btn_pressed_path) and PIL_AVAILABLE:
+if os.path.exists(btn_normal_path) and os.path.exists(btn_pressed_path):
     try:
-        btn_normal = ImageTk.PhotoImage(file=btn_normal_path)
-        btn_pressed = ImageTk.PhotoImage(file=btn_pressed_path)
+        btn_normal = tk.PhotoImage(file=btn_normal_path)
+        btn_pressed = tk.PhotoImage(file=btn_pressed_path)
         button = ImageButton(root, normal_img=btn_normal, pressed_img=btn_pressed, command=on_download_clicked)
         button.pack(pady=12)
     except Exception:
@@ -973,7 +4816,34 @@ else:
     button = tk.Button(root, text="Download", font=tk_custom_font, padx=6, pady=6, command=on_download_clicked, height=2, width=14, bg="#e74c3c", fg="white", activebackground="#c0392b", bd=0)
     button.pack(pady=12)
 
-# Check for updates on startup
-check_for_updates()
+startup_profile.mark("download button")
+
+def on_first_paint(event):
+    """Runs once the main window is mapped; starts the deferred work"""
+    if event.widget is not root or getattr(on_first_paint, "done", False):
+        return
+    on_first_paint.done = True
+    root.update_idletasks()
+    startup_profile.mark("first paint")
+    if STARTUP_PROFILE_FLAG in sys.argv:
+        print(startup_profile.report())
+        try:
+            startup_profile.save(os.path.join(app_data_dir("logs"), "startup-profile.json"))
+        except OSError as e:
+            print(f"Warning: Could not save start-up profile: {e}")
+    if EXIT_AFTER_PAINT_FLAG in sys.argv:
+        root.after(0, root.destroy)
+        return
+    if background_pending:
+        prepare_background()
+    run_in_background(remove_replaced_executable)
+    # Unpack bundled binaries now rather than on the first download
+    run_in_background(binary_cache.ensure)
+    # Parse the cookie store now, start_download then only checks its signature
+    run_in_background(cookie_store.covers, "")
+    # Check for updates on startup
+    root.after(UPDATE_CHECK_DELAY_MS, check_for_updates)
+
+root.bind("<Map>", on_first_paint)
 
 root.mainloop()
@@ -4,24 +4,14 @@
 a = Analysis(
     ['KirstGrab.py'],
     pathex=[],
-    binaries=[
-        ('yt-dlp.exe', 'bin'),
-        ('ffmpeg.exe', 'bin'),
-        ('ffprobe.exe', 'bin'),
-        ('ffplay.exe', 'bin'),
-        ('avcodec-62.dll', 'bin'),
-        ('avdevice-62.dll', 'bin'),
-        ('avfilter-11.dll', 'bin'),
-        ('avformat-62.dll', 'bin'),
-        ('avutil-60.dll', 'bin'),
-        ('swresample-6.dll', 'bin'),
-        ('swscale-9.dll', 'bin'),
-    ],
+    binaries=[],
     datas=[
+        # bin.zip (yt-dlp, ffmpeg, ffprobe and the av*/sw* DLLs) is not bundled,
+        # it ships next to the exe and is unpacked once per build into the
+        # user's cache directory, see BinaryCache
         ('images/background.png', 'images'),
         ('fonts/m6x11plus.ttf', 'fonts'),
         ('icon.ico', '.'),
-        ('cookies.txt', '.'),
     ],
     hiddenimports=[],
     hookspath=[],
@@ -0,0 +1,27 @@
+"""Loads the Tk-free core of KirstGrab.py for the tests.
+
+KirstGrab.py is a script that builds its window at import, so the tests run
+everything above the mode dispatch: the download queue, the job API, the
+release check and the proxy pool. Local stand-ins replace GitHub, proxies
+and download sites, nothing leaves the machine.
+"""
+import os
+import types
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "KirstGrab.py")
+# First line of the mode dispatch, the core ends above it
+DISPATCH_MARKER = "\n# Engine workers re-launch this program"
+
+
+@pytest.fixture(scope="session")
+def kg(tmp_path_factory):
+    # Settings, caches and tokens go to a scratch directory, not the user's
+    os.environ["LOCALAPPDATA"] = str(tmp_path_factory.mktemp("appdata"))
+    with open(SCRIPT, "r", encoding="utf-8") as f:
+        source = f.read()
+    module = types.ModuleType("KirstGrab")
+    module.__file__ = SCRIPT
+    exec(compile(source[:source.index(DISPATCH_MARKER)], SCRIPT, "exec"), module.__dict__)
+    return module
@@ -0,0 +1,133 @@
+import http.client
+import json
+import os
+import socket
+import stat
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def api(kg, tmp_path):
+    download_queue = kg.DownloadQueue(1)
+    server = kg.JobServer(download_queue, 0, "secret-token", str(tmp_path)).start()
+    download_queue.on_state = server.on_state
+    yield server
+    server.close()
+    download_queue.shutdown()
+
+
+def closed_port_url():
+    """URL of a local port nothing listens on, its download fails at once"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}/video"
+
+
+def request(server, method, path, body=None, token="secret-token"):
+    connection = http.client.HTTPConnection("127.0.0.1", server.port, timeout=10)
+    headers = {"Content-Type": "application/json"}
+    if token is not None:
+        headers["X-KirstGrab-Token"] = token
+    connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+    response = connection.getresponse()
+    data = json.loads(response.read().decode("utf-8"))
+    connection.close()
+    return response.status, data
+
+
+def test_post_job_queues_download(api, tmp_path):
+    status, job = request(api, "POST", "/jobs", {"url": closed_port_url(), "preset": "720p (MP4)"})
+    assert status == 201
+    assert job["preset"] == "720p (MP4)"
+    assert job["destination"] == str(tmp_path)
+    status, listed = request(api, "GET", "/jobs")
+    assert status == 200
+    assert [j["id"] for j in listed["jobs"]] == [job["id"]]
+    status, single = request(api, "GET", f"/jobs/{job['id']}")
+    assert status == 200 and single["url"] == job["url"]
+
+
+def test_post_job_rejects_bad_request(api):
+    status, error = request(api, "POST", "/jobs", {"url": "ftp://example.com/file"})
+    assert status == 400 and "url" in error["error"]
+    status, error = request(api, "POST", "/jobs", {"url": "https://example.com/v", "preset": "8K"})
+    assert status == 400 and "preset" in error["error"]
+    assert api.download_queue.jobs == []
+
+
+@pytest.mark.parametrize("token", [None, "", "wrong-token"])
+def test_requests_without_the_token_are_rejected(api, token):
+    status, _ = request(api, "POST", "/jobs", {"url": "https://example.com/v"}, token=token)
+    assert status == 401
+    status, _ = request(api, "GET", "/jobs", token=token)
+    assert status == 401
+    assert api.download_queue.jobs == []
+
+
+def test_events_stream_job_states(api):
+    connection = http.client.HTTPConnection("127.0.0.1", api.port, timeout=60)
+    connection.request("GET", "/events", headers={"X-KirstGrab-Token": "secret-token"})
+    response = connection.getresponse()
+    assert response.status == 200
+    assert response.getheader("Content-Type") == "text/event-stream"
+    status, job = request(api, "POST", "/jobs", {"url": closed_port_url()})
+    assert status == 201
+
+    states = []
+    while "failed" not in states:
+        line = response.fp.readline().decode("utf-8")
+        assert line, "stream closed"
+        if line.startswith("data: "):
+            event = json.loads(line[len("data: "):])
+            if event["event"] == "state" and event["id"] == job["id"]:
+                states.append(event["state"])
+    connection.close()
+    assert states[0] == "queued"
+    assert "running" in states
+
+
+def test_events_unauthorized(api):
+    connection = http.client.HTTPConnection("127.0.0.1", api.port, timeout=10)
+    connection.request("GET", "/events")
+    assert connection.getresponse().status == 401
+    connection.close()
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="POSIX permissions")
+def test_api_token_is_private(kg):
+    path = os.path.join(kg.app_data_dir(), "api_token")
+    if os.path.exists(path):
+        os.remove(path)
+    token = kg.api_token()
+    assert token and kg.api_token() == token
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_events_snapshot_larger_than_backlog(kg, api, tmp_path):
+    url = closed_port_url()
+    jobs = [api.download_queue.submit(kg.DownloadJob(url, str(tmp_path), "720p (MP4)"))
+            for _ in range(kg.API_SUBSCRIBER_BACKLOG + 1)]
+    connection = http.client.HTTPConnection("127.0.0.1", api.port, timeout=60)
+    connection.request("GET", "/events", headers={"X-KirstGrab-Token": "secret-token"})
+    response = connection.getresponse()
+    assert response.status == 200
+    seen = set()
+    while len(seen) < len(jobs):
+        line = response.fp.readline().decode("utf-8")
+        assert line, "stream closed"
+        if line.startswith("data: "):
+            seen.add(json.loads(line[len("data: "):])["id"])
+    connection.close()
+    assert seen >= {job.id for job in jobs}
+
+
+def test_finished_jobs_leave_no_progress_entries(kg, api):
+    job = kg.DownloadJob(closed_port_url(), api.default_dir, "720p (MP4)")
+    api.on_progress(job)
+    assert job.id in api._published_at
+    job.state = kg.JOB_FAILED
+    api.on_state(job)
+    assert job.id not in api._published_at
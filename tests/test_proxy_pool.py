@@ -0,0 +1,149 @@
+import socket
+import socketserver
+import threading
+import time
+
+import pytest
+
+
+class ProxyStandIn(socketserver.ThreadingTCPServer):
+    """Local proxy that answers the handshake check_proxy performs.
+
+    SOCKS5 stand-ins reply to the greeting with reply (no authentication by
+    default), HTTP ones only accept the connection.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, scheme, reply=b"\x05\x00"):
+        self.scheme = scheme
+        self.reply = reply
+        super().__init__(("127.0.0.1", 0), self.Handler)
+        self.url = f"{scheme}://127.0.0.1:{self.server_address[1]}"
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            if self.server.scheme.startswith("socks5"):
+                greeting = self.request.recv(16)
+                if greeting[:1] == b"\x05":
+                    self.request.sendall(self.server.reply)
+
+
+@pytest.fixture
+def stand_ins():
+    servers = []
+
+    def start(scheme, **kwargs):
+        server = ProxyStandIn(scheme, **kwargs)
+        servers.append(server)
+        return server.url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def dead_proxy(scheme="socks5"):
+    """Proxy URL of a local port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"{scheme}://127.0.0.1:{port}"
+
+
+def wait_for_checks(pool, timeout=10):
+    """Wait until the pool's first health check marked the dead proxies"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(proxy.latency is not None or not proxy.healthy for proxy in pool.proxies):
+            return
+        time.sleep(0.05)
+    raise AssertionError("proxy checks did not finish")
+
+
+def test_check_proxy_handshakes(kg, stand_ins):
+    assert kg.check_proxy(stand_ins("socks5")) >= 0
+    assert kg.check_proxy(stand_ins("http")) >= 0
+    with pytest.raises(ConnectionError):
+        kg.check_proxy(stand_ins("socks5", reply=b"\x05\xff"))
+    with pytest.raises(OSError):
+        kg.check_proxy(dead_proxy(), timeout=2)
+
+
+def test_acquire_skips_dead_proxy(kg, stand_ins):
+    healthy = stand_ins("socks5")
+    pool = kg.ProxyPool({"proxies": [dead_proxy(), healthy]})
+    # The first acquire starts the health checks
+    pool.release(pool.acquire("example.com"), "example.com", True)
+    wait_for_checks(pool)
+    assert [pool.acquire("example.com") for _ in range(3)] == [healthy] * 3
+    pool.close()
+
+
+def test_acquire_waits_for_healthy_proxy_at_cap(kg, stand_ins):
+    healthy = stand_ins("http")
+    pool = kg.ProxyPool({"proxies": [healthy, dead_proxy("http")], "proxy_max_jobs": 1})
+    first = pool.acquire("example.com")
+    wait_for_checks(pool)
+    if first != healthy:
+        # The first pick happened before the check marked the dead proxy
+        pool.release(first, "example.com", True)
+        first = pool.acquire("example.com")
+    assert first == healthy
+
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire("example.com")))
+    waiter.start()
+    waiter.join(0.5)
+    # The healthy proxy is at proxy_max_jobs, the dead one must not be handed out
+    assert waiter.is_alive() and acquired == []
+    pool.release(healthy, "example.com", True)
+    waiter.join(5)
+    assert acquired == [healthy]
+    pool.close()
+
+
+def test_failover_goes_round_to_healthy_proxy(kg, stand_ins):
+    healthy = stand_ins("socks5")
+    pool = kg.ProxyPool({"proxies": [healthy, dead_proxy()]})
+    pool.release(pool.acquire("example.com"), "example.com", True)
+    wait_for_checks(pool)
+    # The only other proxy is down, the job tries the healthy one again
+    assert pool.acquire("example.com", exclude=[healthy]) == healthy
+    pool.close()
+
+
+def test_all_proxies_down_still_hands_one_out(kg):
+    dead = [dead_proxy(), dead_proxy()]
+    pool = kg.ProxyPool({"proxies": dead})
+    pool.release(pool.acquire("example.com"), "example.com", True)
+    wait_for_checks(pool)
+    assert not any(proxy.healthy for proxy in pool.proxies)
+    assert pool.acquire("example.com") in dead
+    pool.close()
+
+
+def test_close_wakes_waiting_acquire(kg, stand_ins):
+    pool = kg.ProxyPool({"proxies": [stand_ins("socks5")], "proxy_max_jobs": 1})
+    pool.acquire("example.com")
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire("example.com")))
+    waiter.start()
+    pool.close()
+    waiter.join(5)
+    assert acquired == [None]
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("ERROR: [generic] Unable to download webpage: HTTP Error 404: Not Found", False),
+    ("ERROR: [youtube] abc: Video unavailable", False),
+    ("ERROR: Unable to download webpage: ('Unable to connect to proxy', "
+     "OSError('Tunnel connection failed: 403 Forbidden'))", True),
+    ("ERROR: [Errno 111] Connection refused", True),
+    ("ERROR: Read timed out.", True),
+    ("WARNING: Connection reset, retrying", False),
+])
+def test_only_network_errors_fail_over(kg, line, expected):
+    assert kg.is_proxy_error(line) is expected
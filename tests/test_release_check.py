@@ -0,0 +1,108 @@
+import http.server
+import json
+import threading
+
+import pytest
+
+RELEASE = {"tag_name": "v9.9.9", "name": "KirstGrab 9.9.9", "body": "notes",
+           "html_url": "https://example.com/release", "assets": []}
+
+
+class GitHubStandIn(http.server.ThreadingHTTPServer):
+    """Answers /repos/<repo>/releases/latest like the GitHub API does"""
+
+    def __init__(self):
+        self.requests = []
+        # (status, headers) of the next answers, a 200 with the release once empty
+        self.responses = []
+        super().__init__(("127.0.0.1", 0), self.Handler)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            server = self.server
+            server.requests.append(dict(self.headers))
+            status, headers = server.responses.pop(0) if server.responses else (200, {})
+            if status == 200 and self.headers.get("If-None-Match") == '"v1"':
+                status = 304
+            body = json.dumps(RELEASE).encode("utf-8") if status == 200 else b""
+            self.send_response(status)
+            for name, value in {"ETag": '"v1"', **headers}.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+@pytest.fixture
+def github():
+    server = GitHubStandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = f"http://127.0.0.1:{server.server_port}/repos/Polykek2K/KirstGrab/releases/latest"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache(kg, tmp_path):
+    return kg.ReleaseInfoCache(str(tmp_path / "release.json"))
+
+
+def test_fresh_answer_is_served_from_disk(kg, github, cache, tmp_path):
+    assert cache.get(github.url, max_age=60, now=1000)["tag_name"] == "v9.9.9"
+    assert cache.get(github.url, max_age=60, now=1030)["tag_name"] == "v9.9.9"
+    assert len(github.requests) == 1
+    # Another process reads the same answer without asking again
+    assert kg.ReleaseInfoCache(str(tmp_path / "release.json")).get(github.url, max_age=60, now=1030)
+    assert len(github.requests) == 1
+
+
+def test_stale_answer_is_revalidated_with_etag(github, cache):
+    first = cache.get(github.url, max_age=60, now=1000)
+    second = cache.get(github.url, max_age=60, now=2000)
+    assert second == first
+    assert len(github.requests) == 2
+    assert "If-None-Match" not in github.requests[0]
+    assert github.requests[1]["If-None-Match"] == '"v1"'
+    # The 304 counts as a fresh answer
+    cache.get(github.url, max_age=60, now=2030)
+    assert len(github.requests) == 2
+
+
+def test_failures_back_off_exponentially(kg, github, cache):
+    github.responses = [(500, {}), (500, {})]
+    assert cache.get(github.url, now=1000) is None
+    assert cache.state["retry_at"] == 1000 + kg.RELEASE_BACKOFF_BASE
+    # Within the backoff nothing is requested
+    assert cache.get(github.url, now=1000 + kg.RELEASE_BACKOFF_BASE - 1) is None
+    assert len(github.requests) == 1
+    now = 1000 + kg.RELEASE_BACKOFF_BASE
+    assert cache.get(github.url, now=now) is None
+    assert cache.state["retry_at"] == now + 2 * kg.RELEASE_BACKOFF_BASE
+    assert cache.get(github.url, now=now + 2 * kg.RELEASE_BACKOFF_BASE)["tag_name"] == "v9.9.9"
+    assert cache.state["failures"] == 0 and cache.state["retry_at"] == 0
+
+
+def test_rate_limit_waits_for_reset(kg, github, cache):
+    github.responses = [(403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "5000"})]
+    assert cache.get(github.url, now=1000) is None
+    assert cache.state["retry_at"] == 5000
+
+
+def test_retry_after_is_honoured(github, cache):
+    github.responses = [(429, {"Retry-After": "900"})]
+    cache.get(github.url, now=1000)
+    assert cache.state["retry_at"] == 1900
+
+
+@pytest.mark.parametrize("headers", [
+    {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "99999999999"},
+    {"Retry-After": "99999999"},
+])
+def test_backoff_is_clamped(kg, github, cache, headers):
+    github.responses = [(403, headers)]
+    cache.get(github.url, now=1000)
+    assert cache.state["retry_at"] == 1000 + kg.RELEASE_BACKOFF_MAX